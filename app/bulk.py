@@ -0,0 +1,86 @@
+import csv
+import io
+import json
+from typing import List, Tuple, Type
+from fastapi import HTTPException, Request
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.persistence import chunked
+
+# Most rows a single bulk request may carry
+MAX_BULK_ROWS = 200000
+
+
+async def parse_rows(request: Request) -> List[dict]:
+    # A JSON array, NDJSON (one object per line) or CSV with a header row,
+    # picked by Content-Type
+    content_type = request.headers.get("content-type", "application/json").split(";")[0].strip()
+    body = (await request.body()).decode("utf-8-sig")
+    try:
+        if content_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+            rows = [json.loads(line) for line in body.splitlines() if line.strip()]
+        elif content_type == "text/csv":
+            # Empty cells are missing values, not empty strings
+            rows = [
+                {k: (v if v != "" else None) for k, v in row.items()}
+                for row in csv.DictReader(io.StringIO(body))
+            ]
+        elif content_type == "application/json":
+            rows = json.loads(body)
+        else:
+            raise HTTPException(status_code=415, detail=f"Unsupported content type {content_type}")
+    except (ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Could not parse body: {e}")
+    if not isinstance(rows, list):
+        raise HTTPException(status_code=400, detail="Expected a list of rows")
+    if len(rows) > MAX_BULK_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_ROWS} rows per request")
+    return rows
+
+
+def validate_rows(schema: Type[BaseModel], rows: List) -> Tuple[List[Tuple[int, dict]], List[dict]]:
+    # Returns (row number, values) for the valid rows and one error entry
+    # per invalid row
+    valid, errors = [], []
+    for i, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors.append({"row": i, "errors": ["row must be an object"]})
+            continue
+        try:
+            valid.append((i, schema(**row).dict()))
+        except ValidationError as e:
+            errors.append({"row": i, "errors": [
+                f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()
+            ]})
+    return valid, errors
+
+
+async def bulk_insert(session: AsyncSession, model, schema: Type[BaseModel], rows: List) -> dict:
+    # Valid rows go in one multi-row INSERT ... RETURNING per chunk, each
+    # chunk under its own savepoint. A chunk the database rejects (a bad
+    # foreign key, say) is retried row by row so that only the offending
+    # rows are reported and the rest of the load still lands.
+    valid, errors = validate_rows(schema, rows)
+    ids = []
+    for chunk in chunked(valid):
+        try:
+            async with session.begin_nested():
+                ids += (await session.execute(
+                    insert(model).values([values for _, values in chunk]).returning(model.id)
+                )).scalars().all()
+            continue
+        except (IntegrityError, DBAPIError):
+            pass
+        for i, values in chunk:
+            try:
+                async with session.begin_nested():
+                    ids.append((await session.execute(
+                        insert(model).values(values).returning(model.id)
+                    )).scalar_one())
+            except (IntegrityError, DBAPIError) as e:
+                errors.append({"row": i, "errors": [str(e.orig)]})
+    await session.commit()
+    errors.sort(key=lambda e: e["row"])
+    return {"created": len(ids), "ids": ids, "errors": errors}
@@ -0,0 +1,165 @@
+import os
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+from app.routing import Router
+
+# Off by default, forklifts pass through each other as they always have;
+# SIM_CONGESTION=1 keeps them out of each other's aisle cells in tick mode
+CONGESTION = os.getenv("SIM_CONGESTION", "0") == "1"
+# Ticks a forklift waits behind the same obstruction before it sidesteps
+YIELD_AFTER = int(os.getenv("SIM_YIELD_AFTER", "3"))
+# Ticks after which a forklift is let through regardless, so that gridlock
+# costs block time but can never stall a simulation for good
+MAX_WAIT = int(os.getenv("SIM_MAX_WAIT", "10"))
+
+Key = Tuple[Optional[int], int, int]
+
+
+class CongestionModel:
+    # Keeps forklifts from sharing aisle cells. Location cells (pickup and
+    # delivery points, the depot) hold any number of forklifts, every other
+    # cell holds one.
+    #
+    # Occupancy is a hash from (map, x, y) to the forklifts standing there,
+    # so checking a move is a dict lookup rather than a scan of the fleet.
+    # Each tick the proposed moves are resolved in priority order against
+    # a reservation table of the cells already claimed for the next tick:
+    #   - a forklift may enter a cell only if it is free, or its occupants
+    #     all move out this tick (decided first, so queues advance together)
+    #   - two forklifts swapping cells head-on, or any cycle, all wait
+    #   - loaded forklifts go first, then whoever has waited longest
+    # Every YIELD_AFTER ticks without progress a forklift yields: it
+    # sidesteps into a free neighbouring cell and is re-routed from there,
+    # which breaks head-on deadlocks and gets it around parked forklifts.
+    # Sidesteps are not progress; past MAX_WAIT ticks without any the
+    # forklift squeezes by and shares the cell for a tick.
+
+    def __init__(self, router: Router, yield_after: int = YIELD_AFTER, max_wait: int = MAX_WAIT):
+        self.router = router
+        self.yield_after = yield_after
+        self.max_wait = max_wait
+        self.maps: List[Optional[int]] = []
+        self.shared: Set[Key] = set()
+        self.waiting = np.zeros(0, dtype=bool)
+        self.waited = np.zeros(0, dtype=np.int64)
+        self.occupants: Dict[Key, List[int]] = {}
+
+    def sync(self, maps: List[Optional[int]], shared: Set[Key]):
+        self.maps = maps
+        self.shared = shared
+        self.waiting = np.zeros(len(maps), dtype=bool)
+        self.waited = np.zeros(len(maps), dtype=np.int64)
+
+    def key(self, i: int, x, y) -> Key:
+        return (self.maps[i], int(x), int(y))
+
+    def begin_tick(self, pos: np.ndarray):
+        self.waiting[:] = False
+        self.occupants = {}
+        for i, (x, y) in enumerate(pos.tolist()):
+            k = (self.maps[i], x, y)
+            if k not in self.shared:
+                self.occupants.setdefault(k, []).append(i)
+
+    def _walkable(self, i: int, cell: Tuple[int, int]) -> bool:
+        grid = self.router.grids.get(self.maps[i]) if self.maps[i] is not None else None
+        if grid is None:
+            return cell[0] >= 0 and cell[1] >= 0
+        return grid.walkable(cell)
+
+    def _free(self, i: int, k: Key, reserved: Dict[Key, int]) -> bool:
+        if k in self.shared:
+            return True
+        return k not in reserved and not any(j != i for j in self.occupants.get(k, ()))
+
+    def sidestep(self, i: int, pos: np.ndarray, step: np.ndarray, reserved: Dict[Key, int]) -> Optional[np.ndarray]:
+        # A free cell to the side of the blocked move, if there is one
+        x, y = int(pos[0]), int(pos[1])
+        dx, dy = int(step[0]), int(step[1])
+        for sx, sy in ((dy, dx), (-dy, -dx), (-dx, -dy)):
+            cell = (x + sx, y + sy)
+            k = self.key(i, *cell)
+            if self._walkable(i, cell) and self._free(i, k, reserved):
+                return np.array((sx, sy))
+        return None
+
+    def resolve(self, pos: np.ndarray, step: np.ndarray, movers: np.ndarray,
+                loaded: np.ndarray) -> Tuple[np.ndarray, List[Tuple[int, Tuple[int, int]]]]:
+        # Filters one tick of proposed moves. Returns the forklifts that may
+        # move (step is rewritten in place for those that sidestep) and, for
+        # those that sidestepped, the cell they are to route around.
+        dest = {int(i): self.key(i, *(pos[i] + step[i])) for i in movers}
+        decided: Dict[int, Optional[bool]] = {}
+        reserved: Dict[Key, int] = {}
+
+        def decide(i: int) -> bool:
+            if i in decided:
+                # None while i is still being decided: a cycle, so wait
+                return bool(decided[i])
+            decided[i] = None
+            d = dest[i]
+            ok = True
+            if d not in self.shared and self.waited[i] < self.max_wait:
+                if d in reserved:
+                    ok = False
+                else:
+                    for j in self.occupants.get(d, ()):
+                        if j != i and (j not in dest or not decide(j)):
+                            ok = False
+                            break
+                if ok:
+                    reserved[d] = i
+            decided[i] = ok
+            return ok
+
+        order = sorted((int(i) for i in movers), key=lambda i: (not loaded[i], -self.waited[i], i))
+        for i in order:
+            decide(i)
+
+        moving = np.zeros(len(self.maps), dtype=bool)
+        detours = []
+        for i in order:
+            if decided[i]:
+                moving[i] = True
+                self.waited[i] = 0
+                continue
+            self.waited[i] += 1
+            if self._yields(i):
+                side = self.sidestep(i, pos[i], step[i], reserved)
+                if side is not None:
+                    reserved[self.key(i, *(pos[i] + side))] = i
+                    detours.append((i, tuple(int(v) for v in pos[i] + step[i])))
+                    step[i] = side
+                    moving[i] = True
+                    continue
+            self.waiting[i] = True
+        return moving, detours
+
+    def _yields(self, i: int) -> bool:
+        return self.waited[i] % self.yield_after == 0
+
+    def try_move(self, i: int, pos: np.ndarray, step: np.ndarray) -> Tuple[Optional[np.ndarray], Optional[Tuple[int, int]]]:
+        # Single forklift version for the sequential loop, where earlier
+        # forklifts have already moved. Returns the step to take (None to
+        # wait) and, after a sidestep, the cell to route around.
+        d = self.key(i, *(pos + step))
+        if self.waited[i] >= self.max_wait or self._free(i, d, {}):
+            self._move(i, pos, pos + step)
+            self.waited[i] = 0
+            return step, None
+        self.waited[i] += 1
+        if self._yields(i):
+            side = self.sidestep(i, pos, step, {})
+            if side is not None:
+                self._move(i, pos, pos + side)
+                return side, tuple(int(v) for v in pos + step)
+        self.waiting[i] = True
+        return None, None
+
+    def _move(self, i: int, old, new):
+        cell = self.occupants.get(self.key(i, *old))
+        if cell is not None and i in cell:
+            cell.remove(i)
+        k = self.key(i, *new)
+        if k not in self.shared:
+            self.occupants.setdefault(k, []).append(i)
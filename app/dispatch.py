@@ -0,0 +1,49 @@
+from typing import List, Optional, Tuple
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from app.distances import UNREACHABLE
+
+# Ticks spent standing on a location to pick up or drop off a load
+HANDLING_STEPS = 1
+_NO_PATH = 1e12
+
+
+def assign_orders(distances: np.ndarray, forklift_locations: np.ndarray, pickups: np.ndarray,
+                  deliveries: np.ndarray, free_at: Optional[np.ndarray] = None) -> List[Tuple[int, int, int, int]]:
+    # Assigns orders to forklifts on one map. All location arguments are
+    # indices into the distance matrix. A forklift with work queued already
+    # starts where that queue ends, free_at steps in. The first batch, one
+    # order per forklift, is a linear sum assignment minimising total
+    # finish time; every remaining order is then appended to whichever
+    # forklift would finish it earliest. Returns (forklift, order,
+    # start_step, end_step) tuples with steps counted from the start of the
+    # plan; orders no forklift can reach are left out.
+    dist = distances.astype(np.float64)
+    dist[distances == UNREACHABLE] = np.inf
+    legs = dist[pickups, deliveries] + 2 * HANDLING_STEPS
+    free_at = np.zeros(len(forklift_locations)) if free_at is None else free_at.astype(np.float64)
+    cost = free_at[:, None] + dist[np.ix_(forklift_locations, pickups)] + legs
+
+    plans = []
+    position = forklift_locations.copy()
+    assigned = np.zeros(len(pickups), dtype=bool)
+    if len(forklift_locations) and len(pickups):
+        rows, cols = linear_sum_assignment(np.where(np.isfinite(cost), cost, _NO_PATH))
+        for f, o in zip(rows, cols):
+            if not np.isfinite(cost[f, o]):
+                continue
+            plans.append((int(f), int(o), int(free_at[f]), int(cost[f, o])))
+            free_at[f] = cost[f, o]
+            position[f] = deliveries[o]
+            assigned[o] = True
+
+    # Greedy insertion for the rest, in order
+    for o in np.flatnonzero(~assigned):
+        finish = free_at + dist[position, pickups[o]] + legs[o]
+        f = int(np.argmin(finish)) if len(finish) else -1
+        if f < 0 or not np.isfinite(finish[f]):
+            continue
+        plans.append((f, int(o), int(free_at[f]), int(finish[f])))
+        free_at[f] = finish[f]
+        position[f] = deliveries[o]
+    return plans
@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import shortest_path
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from app.db import AsyncSessionLocal
+from app.models import LocationList, LocationDistances
+from app.routing import Grid, router
+
+UNREACHABLE = -1
+# Sources searched per shortest_path call, which returns a dense row of
+# float64 per source over every cell of the map
+SOURCE_BATCH = 256
+
+
+class DistanceMatrix:
+    # Travel distance in grid steps between every pair of locations on one
+    # map, as an int32 matrix indexed in the order of `location_ids`.
+    # UNREACHABLE marks pairs with no path.
+
+    def __init__(self, map_id: int, layout_hash: str, location_ids: np.ndarray, coords: np.ndarray, distances: np.ndarray):
+        self.map_id = map_id
+        self.layout_hash = layout_hash
+        self.location_ids = location_ids
+        self.coords = coords
+        self.distances = distances
+        self.index = {int(loc): i for i, loc in enumerate(location_ids)}
+
+    def distance(self, from_location: int, to_location: int) -> Optional[int]:
+        i = self.index.get(from_location)
+        j = self.index.get(to_location)
+        if i is None or j is None:
+            return None
+        d = int(self.distances[i, j])
+        return None if d == UNREACHABLE else d
+
+    def to_row(self) -> LocationDistances:
+        return LocationDistances(
+            mapId=self.map_id,
+            layout_hash=self.layout_hash,
+            location_ids=self.location_ids.astype(np.int64).tobytes(),
+            coords=self.coords.astype(np.int64).tobytes(),
+            distances=self.distances.astype(np.int32).tobytes(),
+            updated_at=datetime.utcnow(),
+        )
+
+    @classmethod
+    def from_row(cls, row: LocationDistances) -> "DistanceMatrix":
+        ids = np.frombuffer(row.location_ids, dtype=np.int64).copy()
+        n = len(ids)
+        coords = np.frombuffer(row.coords, dtype=np.int64).reshape(n, 2).copy()
+        distances = np.frombuffer(row.distances, dtype=np.int32).reshape(n, n).copy()
+        return cls(row.mapId, row.layout_hash, ids, coords, distances)
+
+
+def layout_hash(grid: Optional[Grid]) -> str:
+    # Of the grid the router built from the layout, so keys of the layout
+    # that don't change where forklifts can go don't force a rebuild
+    key = None if grid is None else [grid.width, grid.height, sorted(grid.blocked)]
+    return hashlib.sha1(json.dumps(key).encode()).hexdigest()
+
+
+def _distance_rows(grid: Optional[Grid], coords: np.ndarray, sources: List[int]) -> np.ndarray:
+    # Distances from each of `sources` (indices into coords) to every location
+    n = len(coords)
+    if grid is None:
+        # Open floor, travel is the Manhattan distance
+        return np.abs(coords[sources, None, :] - coords[None, :, :]).sum(axis=2).astype(np.int32)
+
+    # Breadth-first search over a box covering the grid and every location,
+    # run by scipy's csgraph over a graph of the cells. Location cells can
+    # be entered even when blocked, but not crossed: a blocked location is
+    # a node without exits, plus a separate exit-only node searches from it
+    # start at.
+    cells = [tuple(c) for c in coords.tolist()] + list(grid.blocked)
+    x0 = min(0, min((c[0] for c in cells), default=0)) - 1
+    y0 = min(0, min((c[1] for c in cells), default=0)) - 1
+    x1 = max(grid.width or 0, max((c[0] for c in cells), default=0) + 2)
+    y1 = max(grid.height or 0, max((c[1] for c in cells), default=0) + 2)
+    w, h = x1 - x0, y1 - y0
+    xs, ys = np.arange(w) + x0, np.arange(h) + y0
+    walkable = np.ones((w, h), dtype=bool)
+    walkable[xs < 0, :] = False
+    walkable[:, ys < 0] = False
+    if grid.width is not None:
+        walkable[xs >= grid.width, :] = False
+    if grid.height is not None:
+        walkable[:, ys >= grid.height] = False
+    for bx, by in grid.blocked:
+        if x0 <= bx < x1 and y0 <= by < y1:
+            walkable[bx - x0, by - y0] = False
+    is_location = np.zeros((w, h), dtype=bool)
+    is_location[coords[:, 0] - x0, coords[:, 1] - y0] = True
+
+    # Node of cell (x, y) is x * h + y; exit nodes of blocked locations
+    # follow after the w * h cell nodes
+    cell_nodes = np.arange(w * h).reshape(w, h)
+    enterable = walkable | is_location
+    exits = np.flatnonzero((is_location & ~walkable).ravel())
+    exit_nodes = np.full(w * h, -1, dtype=np.int64)
+    exit_nodes[exits] = w * h + np.arange(len(exits))
+    tails, heads = [], []
+    for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+        # Every cell with a neighbour at (dx, dy) inside the box
+        a = (slice(max(0, -dx), w - max(0, dx)), slice(max(0, -dy), h - max(0, dy)))
+        b = (slice(max(0, dx), w - max(0, -dx)), slice(max(0, dy), h - max(0, -dy)))
+        into = enterable[b]
+        src, dst = cell_nodes[a], cell_nodes[b]
+        step = walkable[a] & into
+        tails.append(src[step])
+        heads.append(dst[step])
+        step = (is_location[a] & ~walkable[a]) & into
+        tails.append(exit_nodes[src[step]])
+        heads.append(dst[step])
+    tails, heads = np.concatenate(tails), np.concatenate(heads)
+    size = w * h + len(exits)
+    graph = csr_matrix((np.ones(len(tails)), (tails, heads)), shape=(size, size))
+
+    targets = cell_nodes[coords[:, 0] - x0, coords[:, 1] - y0]
+    starts = np.where(exit_nodes[targets] >= 0, exit_nodes[targets], targets)
+    rows = np.full((len(sources), n), UNREACHABLE, dtype=np.int32)
+    for i in range(0, len(sources), SOURCE_BATCH):
+        batch = np.asarray(sources[i:i + SOURCE_BATCH], dtype=np.int64)
+        dist = shortest_path(graph, method="D", unweighted=True, indices=starts[batch])[:, targets]
+        # Locations on the source's own cell are where it starts
+        dist[targets[batch][:, None] == targets[None, :]] = 0
+        rows[i:i + len(batch)] = np.where(np.isinf(dist), UNREACHABLE, dist).astype(np.int32)
+    return rows
+
+
+class DistanceIndex:
+    # Per-map distance matrices, kept in memory and in location_distances so
+    # a restart does not recompute them. On each lookup the stored
+    # coordinates are compared with LocationList: added or moved locations
+    # get their row and column recomputed, removed ones are dropped, and a
+    # changed layout rebuilds the whole matrix.
+    #
+    # map_id is a maplist id, the one locations carry; its grid comes from
+    # the route planner, which resolves and caches layouts for the engine.
+    # Searches run on a worker thread so the event loop keeps serving
+    # requests and ticks, and a changed matrix is saved in a session of its
+    # own, leaving the caller's transaction alone.
+
+    def __init__(self):
+        self.matrices: Dict[int, DistanceMatrix] = {}
+
+    async def get(self, session: AsyncSession, map_id: int) -> DistanceMatrix:
+        await router.load_maps(session, [map_id])
+        grid = router.grids.get(map_id)
+        current_hash = layout_hash(grid)
+        locations = (await session.execute(
+            select(LocationList.id, LocationList.displayX, LocationList.displayY)
+            .where(LocationList.mapId == map_id)
+            .order_by(LocationList.id)
+        )).all()
+        ids = np.array([loc[0] for loc in locations], dtype=np.int64)
+        coords = np.array([(loc[1], loc[2]) for loc in locations], dtype=np.int64).reshape(len(locations), 2)
+
+        matrix = self.matrices.get(map_id)
+        if matrix is None:
+            row = await session.get(LocationDistances, map_id)
+            if row is not None:
+                matrix = DistanceMatrix.from_row(row)
+        loop = asyncio.get_running_loop()
+        if matrix is not None and matrix.layout_hash == current_hash:
+            updated, changed = await loop.run_in_executor(None, self._update, matrix, grid, ids, coords)
+        else:
+            distances = await loop.run_in_executor(None, _distance_rows, grid, coords, list(range(len(ids))))
+            updated = DistanceMatrix(map_id, current_hash, ids, coords, distances)
+            changed = True
+        self.matrices[map_id] = updated
+        if changed:
+            async with AsyncSessionLocal() as own:
+                await own.merge(updated.to_row())
+                await own.commit()
+        return updated
+
+    @staticmethod
+    def _update(matrix: DistanceMatrix, grid: Optional[Grid], ids: np.ndarray, coords: np.ndarray) -> Tuple[DistanceMatrix, bool]:
+        n = len(ids)
+        distances = np.full((n, n), UNREACHABLE, dtype=np.int32)
+        old = np.array([matrix.index.get(int(loc), -1) for loc in ids], dtype=np.int64)
+        kept = np.flatnonzero(old >= 0)
+        # A kept location whose coordinates changed counts as moved
+        moved = kept[(matrix.coords[old[kept]] != coords[kept]).any(axis=1)]
+        kept = np.setdiff1d(kept, moved)
+        distances[np.ix_(kept, kept)] = matrix.distances[np.ix_(old[kept], old[kept])]
+        dirty = sorted(set(np.flatnonzero(old < 0).tolist()) | set(moved.tolist()))
+        if dirty:
+            # Grid distances are symmetric, so each new row is also a column
+            rows = _distance_rows(grid, coords, dirty)
+            distances[dirty, :] = rows
+            distances[:, dirty] = rows.T
+        changed = bool(dirty) or len(kept) != len(matrix.location_ids)
+        return DistanceMatrix(matrix.map_id, matrix.layout_hash, ids, coords, distances), changed
+
+
+distance_index = DistanceIndex()
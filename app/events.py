@@ -0,0 +1,130 @@
+import heapq
+from typing import Dict, List, Optional, Set, Tuple
+from app.kpi import KpiAggregator
+from app.movement import MovementKernel
+from app.world_state import OrderState, WorldState
+
+# Engine modes: "tick" steps the whole fleet one cell per tick, "event"
+# jumps from one pickup or delivery to the next
+MODES = ("tick", "event")
+
+
+class EventScheduler:
+    # Discrete-event driver for the movement kernel. Rather than stepping
+    # every forklift every tick, each forklift's next arrival (at a pickup
+    # or a delivery) is put on a heap at the tick the stepping engine would
+    # reach it: the tick its leg started plus the moves left on its route.
+    # The engine pops arrivals in (tick, kernel index) order, which is the
+    # order the stepping engine applies them in, and skips straight over
+    # the ticks in between. Positions are only worked out when needed: at
+    # an arrival, when a change from the API forces a re-plan, and before
+    # a checkpoint. Work is per event, not per forklift per tick.
+    #
+    # Pickup and drop-off take no time here, so arriving at a pickup and
+    # completing it are one event. Blocks, unblocks and new plans or
+    # orders come in as router deltas and re-plan from the current tick.
+    # Congestion needs cell-by-cell stepping, so event mode runs without
+    # it; with congestion off (the default) both modes log the same
+    # pickups and deliveries at the same times.
+
+    def __init__(self, kernel: MovementKernel):
+        self.kernel = kernel
+        self.version = -1
+        # Tick from which each forklift's position has yet to be advanced
+        self.start: List[int] = []
+        self.generation: List[int] = []
+        self.queue: List[Tuple[int, int, int]] = []  # (tick, forklift index, generation)
+        # Forklifts heading for each order, for the shared-order re-plans
+        self.holders: Dict[int, Set[int]] = {}
+        self.held: List[Optional[int]] = []
+
+    def sync(self, world: WorldState, kpis: KpiAggregator, tick: int):
+        kernel = self.kernel
+        if kernel.version != world.version:
+            if self.version == kernel.version:
+                # Routes are rebuilt from wherever the forklifts are now
+                self.materialize(world, kpis, tick)
+            kernel.sync(world)
+        if self.version != kernel.version:
+            # Take over the kernel's routes as they stand
+            self.version = kernel.version
+            n = len(kernel.forklifts)
+            self.start = [tick] * n
+            self.generation = [0] * n
+            self.queue = []
+            self.holders = {}
+            self.held = [None] * n
+            for i in range(n):
+                self.schedule(i, tick)
+
+    def schedule(self, i: int, tick: int):
+        # Forklift i sets off along its current route at `tick`
+        kernel = self.kernel
+        self.start[i] = tick
+        self.generation[i] += 1
+        if self.held[i] is not None:
+            self.holders[self.held[i]].discard(i)
+            self.held[i] = None
+        if not kernel.active[i]:
+            return
+        self.held[i] = kernel.orders[i].id
+        self.holders.setdefault(self.held[i], set()).add(i)
+        heapq.heappush(self.queue, (tick + kernel.remaining(i), i, self.generation[i]))
+
+    def next_tick(self) -> Optional[int]:
+        while self.queue:
+            tick, i, generation = self.queue[0]
+            if generation == self.generation[i]:
+                return tick
+            heapq.heappop(self.queue)  # Re-planned since
+        return None
+
+    def move(self, world: WorldState, kpis: KpiAggregator, i: int, tick: int):
+        # Brings forklift i to where the stepping engine has it at the start
+        # of `tick`
+        kernel = self.kernel
+        moves = tick - self.start[i]
+        self.start[i] = tick
+        if moves <= 0 or not kernel.active[i]:
+            return
+        moves = min(moves, kernel.remaining(i))
+        if moves == 0:
+            return
+        kernel.advance(i, moves)
+        forklift = kernel.forklifts[i]
+        forklift.x = int(kernel.pos[i, 0])
+        forklift.y = int(kernel.pos[i, 1])
+        world.moved_forklifts.add(forklift.id)
+        kpis.add_distance(forklift.id, moves)
+
+    def materialize(self, world: WorldState, kpis: KpiAggregator, tick: int):
+        if self.version != self.kernel.version:
+            return
+        for i in range(len(self.kernel.forklifts)):
+            self.move(world, kpis, i, tick)
+
+    def process(self, engine, world: WorldState, kpis: KpiAggregator, persister, tick: int, now):
+        # Applies every arrival due at `tick`
+        kernel = self.kernel
+        while self.next_tick() == tick:
+            _, i, _ = heapq.heappop(self.queue)
+            self.move(world, kpis, i, tick)
+            order = kernel.orders[i]
+            engine.arrive(world, kpis, persister, kernel.forklifts[i], kernel.plans[i], order, now)
+            kernel.arrived(world, i)
+            self.schedule(i, tick + 1)
+            self.revalidate(world, kpis, order, i, tick)
+
+    def revalidate(self, world: WorldState, kpis: KpiAggregator, order: OrderState, i: int, tick: int):
+        # Other forklifts heading for an order that just moved on re-plan the
+        # way the sequential stepping loop has them: those after i in the
+        # fleet at their turn this tick, before moving, and those before i
+        # at the end of the tick, after moving
+        kernel = self.kernel
+        for j in sorted(self.holders.get(order.id, ())):
+            if j == i or kernel.phases[j] == order.status:
+                continue
+            at = tick if j > i else tick + 1
+            self.move(world, kpis, j, at)
+            kernel.refresh(world, j)
+            self.schedule(j, at)
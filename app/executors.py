@@ -0,0 +1,201 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from typing import Dict, List, Optional
+from app.streaming import Broadcaster, Subscriber
+
+SIM_WORKERS = int(os.getenv("SIM_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+# Seconds between status snapshots sent back by each worker
+STATUS_INTERVAL = float(os.getenv("SIM_STATUS_INTERVAL", "1"))
+
+
+class _QueueBroadcaster(Broadcaster):
+    # Stands in for the parent's broadcaster inside a worker: every delta is
+    # forwarded over the event queue
+
+    def __init__(self, events, simulation_id: int):
+        super().__init__()
+        self.events = events
+        self.simulation_id = simulation_id
+
+    def __bool__(self):
+        return True
+
+    def publish(self, delta: dict):
+        self.events.put(("delta", self.simulation_id, delta))
+
+
+def _worker_main(commands, events):
+    asyncio.run(_worker(commands, events))
+
+
+async def _worker(commands, events):
+    # Each worker process runs an ordinary in-process engine on its own
+    # event loop and database pool, driven by commands from the parent
+    from app.simulation_engine import SimulationEngine
+    engine = SimulationEngine()
+    loop = asyncio.get_running_loop()
+
+    async def report():
+        while True:
+            events.put(("status", os.getpid(), engine.running_status()))
+            await asyncio.sleep(STATUS_INTERVAL)
+
+    def failed(name: str, args: tuple, error: BaseException):
+        # Reported to the parent; the worker and its other simulations go on
+        simulation_id = args[0] if args and isinstance(args[0], int) else None
+        events.put(("error", simulation_id, f"{name} failed: {error!r}"))
+
+    def check(task: asyncio.Task, name: str, args: tuple):
+        if not task.cancelled() and task.exception() is not None:
+            failed(name, args, task.exception())
+
+    reporter = asyncio.create_task(report())
+    while True:
+        name, args = await loop.run_in_executor(None, commands.get)
+        if name == "shutdown":
+            # Checkpointed and left 'running', to be resumed on next startup
+            await engine.shutdown()
+            break
+        try:
+            if name == "stream":
+                simulation_id, on = args
+                if on:
+                    engine.broadcasters[simulation_id] = _QueueBroadcaster(events, simulation_id)
+                    snapshot = engine.snapshot(simulation_id)
+                    if snapshot is not None:
+                        events.put(("delta", simulation_id, snapshot))
+                else:
+                    engine.broadcasters.pop(simulation_id, None)
+                continue
+            result = getattr(engine, name)(*args)
+            if asyncio.iscoroutine(result):
+                # Start and stop must not hold up the next command
+                task = asyncio.create_task(result)
+                task.add_done_callback(lambda t, name=name, args=args: check(t, name, args))
+        except Exception as e:
+            failed(name, args, e)
+    reporter.cancel()
+    events.put(("status", os.getpid(), {}))
+
+
+class ProcessSimulationEngine:
+    # Drop-in replacement for SimulationEngine that runs simulations in a
+    # pool of worker processes instead of on the API's event loop.
+    # Simulations are sharded over the workers by id; router deltas go to
+    # every worker, stream deltas and status snapshots come back over a
+    # shared event queue.
+
+    def __init__(self, workers: int = SIM_WORKERS):
+        self.workers = workers
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: List = []
+        self._commands: List = []
+        self._events = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._statuses: Dict[int, Dict[int, dict]] = {}
+        # Last command that failed in a worker, per simulation
+        self.errors: Dict[Optional[int], str] = {}
+        self.broadcasters: Dict[int, Broadcaster] = {}
+
+    def _ensure_started(self):
+        if self._processes:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._events = self._context.Queue()
+        for _ in range(self.workers):
+            commands = self._context.Queue()
+            process = self._context.Process(target=_worker_main, args=(commands, self._events), daemon=True)
+            process.start()
+            self._commands.append(commands)
+            self._processes.append(process)
+        threading.Thread(target=self._read_events, daemon=True).start()
+
+    def _read_events(self):
+        while True:
+            event = self._events.get()
+            self._loop.call_soon_threadsafe(self._dispatch, event)
+
+    def _dispatch(self, event):
+        kind, key, payload = event
+        if kind == "status":
+            self._statuses[key] = payload
+        elif kind == "error":
+            self.errors[key] = payload
+        elif kind == "delta":
+            broadcaster = self.broadcasters.get(key)
+            if broadcaster:
+                broadcaster.publish(payload)
+
+    def _send(self, simulation_id: int, name: str, *args):
+        self._ensure_started()
+        self._commands[simulation_id % self.workers].put((name, args))
+
+    @property
+    def running_simulations(self) -> Dict[int, dict]:
+        running = {}
+        for statuses in self._statuses.values():
+            running.update(statuses)
+        return running
+
+    def running_status(self) -> Dict[int, dict]:
+        # Same shape as SimulationEngine.running_status, merged over workers
+        return self.running_simulations
+
+    async def start_simulation(self, simulation_id: int, speed: float = 1.0, max_steps: Optional[int] = None,
+                               resume: bool = False, mode: Optional[str] = None):
+        self.errors.pop(simulation_id, None)
+        self._send(simulation_id, "start_simulation", simulation_id, speed, max_steps, resume, mode)
+
+    async def stop_simulation(self, simulation_id: int):
+        self._send(simulation_id, "stop_simulation", simulation_id)
+
+    def request_checkpoint(self, simulation_id: int) -> bool:
+        if simulation_id not in self.running_simulations:
+            return False
+        self._send(simulation_id, "request_checkpoint", simulation_id)
+        return True
+
+    def status(self, simulation_id: int) -> dict:
+        # As of the last snapshot from the worker, at most STATUS_INTERVAL old
+        status = self.running_simulations.get(simulation_id)
+        if status is not None:
+            return status
+        status = {"simulation_id": simulation_id, "running": False}
+        if simulation_id in self.errors:
+            status["error"] = self.errors[simulation_id]
+        return status
+
+    def subscribe(self, simulation_id: int) -> Subscriber:
+        broadcaster = self.broadcasters.setdefault(simulation_id, Broadcaster())
+        if not broadcaster:
+            self._send(simulation_id, "stream", simulation_id, True)
+        return broadcaster.subscribe()
+
+    def unsubscribe(self, simulation_id: int, subscriber: Subscriber):
+        broadcaster = self.broadcasters.get(simulation_id)
+        if broadcaster is not None:
+            broadcaster.unsubscribe(subscriber)
+            if not broadcaster:
+                del self.broadcasters[simulation_id]
+                self._send(simulation_id, "stream", simulation_id, False)
+
+    def __getattr__(self, name: str):
+        # notify_* deltas are fanned out to every worker; a worker without
+        # the simulation in question simply ignores them
+        if not name.startswith("notify_"):
+            raise AttributeError(name)
+
+        def notify(*args):
+            if not self._processes:
+                return
+            for commands in self._commands:
+                commands.put((name, args))
+        return notify
+
+    async def shutdown(self):
+        for commands in self._commands:
+            commands.put(("shutdown", ()))
+        for process in self._processes:
+            await asyncio.get_running_loop().run_in_executor(None, process.join, 10)
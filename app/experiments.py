@@ -0,0 +1,318 @@
+import asyncio
+import itertools
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+import numpy as np
+from pydantic import BaseModel
+from scipy import stats
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db import AsyncSessionLocal, SimSessionLocal
+from app.events import MODES, EventScheduler
+from app.executors import SIM_WORKERS
+from app.generator import GeneratorConfig, OrderStream, check_config, load_config
+from app.kpi import KpiAggregator
+from app.models import Experiment, Forklift, Simulation
+from app.movement import MovementKernel
+from app.persistence import WriteBehindPersister
+from app.routing import router
+from app.sim_clock import SimClock
+from app.simulation_engine import SimulationEngine
+from app.world_state import WorldState
+
+# Most runs a single experiment may ask for
+MAX_EXPERIMENT_RUNS = int(os.getenv("SIM_MAX_EXPERIMENT_RUNS", "2000"))
+# Seconds between progress updates written while an experiment runs
+PROGRESS_INTERVAL = 1.0
+# Per-run KPIs compared across variants
+METRICS = ("throughput_per_hour", "orders_done", "backlog", "utilization", "block_time", "wait_time", "distance")
+CONFIDENCE = 0.95
+
+
+class ExperimentGrid(BaseModel):
+    # Every combination of the values given is a variant, run once per seed.
+    # forklifts is the fleet size (the first N candidate forklifts by id),
+    # blocked how many of the fleet are blocked for the whole run and
+    # order_volume a factor on the generator's arrival rate.
+    forklifts: Optional[List[int]] = None
+    blocked: Optional[List[int]] = None
+    order_volume: Optional[List[float]] = None
+    seeds: Optional[List[int]] = None
+
+
+class ExperimentCreate(BaseModel):
+    name: Optional[str] = None
+    # Simulation whose dispatch plans every run starts with, and whose
+    # order generator is used unless one is given here
+    base_simulation_id: Optional[int] = None
+    generator: Optional[GeneratorConfig] = None
+    grid: ExperimentGrid = ExperimentGrid()
+    # Length of each run, in ticks; a run also ends once all its orders are done
+    max_steps: int
+    mode: str = "tick"
+    # Simulated start, which a time-of-day profile counts from; defaults to now
+    start_time: Optional[datetime] = None
+
+
+# An experiment is a list of independent runs, each a plain dict that is
+# shipped to a worker process. Runs are headless and entirely in memory:
+# the world is loaded read-only, generated orders never become rows and
+# nothing is written back, so hundreds of them can go at once without
+# touching each other or the database. Each worker keeps one event loop
+# (and so one database pool) for all the runs it is given.
+
+async def plan_runs(session: AsyncSession, request: ExperimentCreate) -> List[dict]:
+    # Expands the grid into runs; raises ValueError on a request that
+    # can't be run
+    if request.max_steps <= 0:
+        raise ValueError("max_steps must be positive")
+    if request.mode not in MODES:
+        raise ValueError(f"mode must be one of {', '.join(MODES)}")
+    generator = request.generator
+    if request.base_simulation_id is not None:
+        if not await session.get(Simulation, request.base_simulation_id):
+            raise ValueError("Base simulation not found")
+        generator = generator or await load_config(session, request.base_simulation_id)
+    grid = request.grid
+    if generator is None:
+        if request.base_simulation_id is None:
+            raise ValueError("An experiment needs a base simulation or an order generator")
+        if grid.order_volume or grid.seeds:
+            raise ValueError("order_volume and seeds need an order generator")
+    else:
+        problem = check_config(generator)
+        if problem is not None:
+            raise ValueError(problem)
+        if grid.order_volume and generator.process == "replay":
+            raise ValueError("order_volume does not apply to a replay")
+
+    candidates = generator.forklift_ids if generator is not None and generator.forklift_ids is not None else \
+        (await session.execute(select(Forklift.id).order_by(Forklift.id))).scalars().all()
+    fleets = grid.forklifts or [len(candidates)]
+    if min(fleets) < 1 or max(fleets) > len(candidates):
+        raise ValueError(f"forklifts must be between 1 and {len(candidates)}")
+    blocked = grid.blocked or [0]
+    if min(blocked) < 0 or max(blocked) >= min(fleets):
+        raise ValueError("blocked must leave at least one forklift of the smallest fleet free")
+    volumes = grid.order_volume or [1.0]
+    if min(volumes) <= 0:
+        raise ValueError("order_volume must be positive")
+    seeds = grid.seeds or [generator.seed if generator is not None else 0]
+
+    count = len(fleets) * len(blocked) * len(volumes) * len(seeds)
+    if count > MAX_EXPERIMENT_RUNS:
+        raise ValueError(f"{count} runs requested, at most {MAX_EXPERIMENT_RUNS} per experiment")
+    start_time = (request.start_time or datetime.utcnow()).isoformat()
+    runs = []
+    for size, block, volume, seed in itertools.product(fleets, blocked, volumes, seeds):
+        fleet = list(candidates[:size])
+        config = None
+        if generator is not None:
+            config = generator.dict()
+            config.update(seed=seed, forklift_ids=fleet)
+            if config["rate_per_hour"] is not None:
+                config["rate_per_hour"] *= volume
+            if config["hourly_rates"] is not None:
+                config["hourly_rates"] = [rate * volume for rate in config["hourly_rates"]]
+        runs.append({
+            "variant": {"forklifts": size, "blocked": block, "order_volume": volume},
+            "seed": seed,
+            "base_simulation_id": request.base_simulation_id,
+            "generator": config,
+            "forklifts": fleet,
+            # The last forklifts of the fleet
+            "blocked": fleet[len(fleet) - block:] if block else [],
+            "max_steps": request.max_steps,
+            "mode": request.mode,
+            "start_time": start_time,
+        })
+    return runs
+
+
+async def run_headless(run: dict) -> dict:
+    # One run, start to finish, with the engine's own tick logic
+    engine = SimulationEngine()
+    # The base scenario as defined, not wherever the base simulation's own
+    # runs have got to
+    world = WorldState(run["base_simulation_id"] or 0, own_state=False)
+    clock = SimClock(start=datetime.fromisoformat(run["start_time"]), speed=0)
+    kpis = KpiAggregator(clock.tick.total_seconds())
+    persister = WriteBehindPersister(world.simulation_id)
+    generator = None
+    async with SimSessionLocal() as session:
+        if run["base_simulation_id"] is not None:
+            await world.load(session)
+        await world.preload(session, forklift_ids=set(run["forklifts"]))
+        if run["generator"] is not None:
+            generator = OrderStream(world.simulation_id, GeneratorConfig(**run["generator"]), clock.now,
+                                    clock.tick.total_seconds())
+            await generator.load(session, world)
+        await router.load_maps(session, world.location_maps.values())
+    fleet = set(run["forklifts"])
+    for forklift_id in [i for i in world.forklifts if i not in fleet]:
+        world.remove_forklift(forklift_id)
+    for forklift_id in run["blocked"]:
+        world.apply_forklift_status(forklift_id, 'blocked')
+
+    if run["mode"] == "event":
+        kernel = MovementKernel(congestion=False)
+        scheduler = EventScheduler(kernel)
+    else:
+        kernel = MovementKernel()
+        scheduler = None
+    max_steps = run["max_steps"]
+    complete = False
+    while clock.steps < max_steps:
+        if generator is not None and generator.needs_refill():
+            async with SimSessionLocal() as session:
+                await generator.refill(session, world)
+                await router.load_maps(session, world.location_maps.values())
+        engine.tick(world, kernel, scheduler, kpis, persister, generator, clock.steps, clock.now)
+        # Nothing is kept but the KPIs
+        world.clear_changes()
+        persister.logs.clear()
+        clock.advance()
+        complete = kpis.complete and (generator is None or generator.exhausted)
+        if complete:
+            break
+        if scheduler is not None:
+            skip = engine.idle_ticks(world, scheduler, clock, max_steps, generator)
+            if skip:
+                kpis.record_tick(kernel, (), skip)
+                clock.advance(skip)
+    if generator is not None:
+        generator.close()
+
+    summary = kpis.summary()
+    busy, idle, block = summary["busy_time"], summary["idle_time"], summary["block_time"]
+    return {
+        "steps": clock.steps,
+        "completed": complete,
+        "throughput_per_hour": summary["throughput_per_hour"],
+        "orders_done": summary["orders"]["done"],
+        "backlog": summary["orders"]["pending"] + summary["orders"]["in_progress"],
+        "utilization": busy / (busy + idle + block) if busy + idle + block else 0.0,
+        "block_time": block,
+        "wait_time": summary["wait_time"],
+        "distance": summary["distance"],
+    }
+
+
+_worker_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _init_worker():
+    global _worker_loop
+    _worker_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_worker_loop)
+
+
+def _run_in_worker(run: dict) -> dict:
+    return _worker_loop.run_until_complete(run_headless(run))
+
+
+def compare(runs: List[dict], results: List[dict]) -> List[dict]:
+    # One row per variant: the mean of every metric over its seeds, with
+    # the half-width of a Student t confidence interval (None for one run)
+    groups: Dict[tuple, List[dict]] = {}
+    for run, result in zip(runs, results):
+        groups.setdefault(tuple(run["variant"].items()), []).append(result)
+    table = []
+    for variant, group in groups.items():
+        row = dict(variant)
+        row["runs"] = len(group)
+        row["completed"] = sum(r["completed"] for r in group)
+        for metric in METRICS:
+            values = np.array([r[metric] for r in group], dtype=np.float64)
+            row[metric] = float(values.mean())
+            row[f"{metric}_ci"] = None
+            if len(values) > 1:
+                t = stats.t.ppf((1 + CONFIDENCE) / 2, len(values) - 1)
+                row[f"{metric}_ci"] = float(t * values.std(ddof=1) / math.sqrt(len(values)))
+        table.append(row)
+    return table
+
+
+class ExperimentRunner:
+    # Fans experiment runs out over a pool of worker processes, separate
+    # from the simulation executor's, and writes progress and the
+    # comparison table back to the experiment row
+
+    def __init__(self, workers: int = SIM_WORKERS):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.tasks: Dict[int, asyncio.Task] = {}
+
+    def _ensure_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker)
+        return self._pool
+
+    def start(self, experiment_id: int, runs: List[dict]):
+        self.tasks[experiment_id] = asyncio.create_task(self._run(experiment_id, runs))
+
+    async def cancel(self, experiment_id: int):
+        task = self.tasks.pop(experiment_id, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _run(self, experiment_id: int, runs: List[dict]):
+        loop = asyncio.get_running_loop()
+        pool = self._ensure_pool()
+        results: List[Optional[dict]] = [None] * len(runs)
+        done = [0]
+        last_write = [time.monotonic()]
+
+        async def one(i: int):
+            results[i] = await loop.run_in_executor(pool, _run_in_worker, runs[i])
+            done[0] += 1
+            if time.monotonic() - last_write[0] >= PROGRESS_INTERVAL:
+                last_write[0] = time.monotonic()
+                await self._update(experiment_id, runs_done=done[0])
+
+        futures = [asyncio.ensure_future(one(i)) for i in range(len(runs))]
+        try:
+            await asyncio.gather(*futures)
+            await self._update(experiment_id, status='completed', runs_done=done[0], finished_at=datetime.utcnow(),
+                               results={"table": compare(runs, results), "runs": [
+                                   dict(run["variant"], seed=run["seed"], **result) for run, result in zip(runs, results)
+                               ]})
+        except asyncio.CancelledError:
+            await self._update(experiment_id, status='cancelled', runs_done=done[0], finished_at=datetime.utcnow())
+            raise
+        except Exception as e:
+            await self._update(experiment_id, status='failed', runs_done=done[0], finished_at=datetime.utcnow(),
+                               results={"error": str(e)})
+        finally:
+            # Runs not yet handed to a worker are dropped
+            for future in futures:
+                future.cancel()
+            if self.tasks.get(experiment_id) is asyncio.current_task():
+                del self.tasks[experiment_id]
+
+    @staticmethod
+    async def _update(experiment_id: int, **values):
+        async with AsyncSessionLocal() as session:
+            experiment = await session.get(Experiment, experiment_id)
+            if experiment is None:
+                return
+            for field, value in values.items():
+                setattr(experiment, field, value)
+            await session.commit()
+
+    async def shutdown(self):
+        for experiment_id in list(self.tasks):
+            await self.cancel(experiment_id)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+experiment_runner = ExperimentRunner()
@@ -0,0 +1,98 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, List
+from sqlalchemy import Float, Integer, TIMESTAMP, Text
+from sqlalchemy.future import select
+from app.db import ReadSessionLocal
+from app.models import OperationLog, KPI
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_BATCH_SIZE = 5000
+
+EXPORT_TABLES = {
+    "operation_logs": (OperationLog, ["id", "timestamp", "forklift_id", "event", "details", "simulation_id"]),
+    "kpis": (KPI, ["id", "timestamp", "execution_time", "block_time", "simulation_id"]),
+}
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def _value(v):
+    return v.isoformat() if isinstance(v, datetime) else v
+
+
+async def _batches(table: str, simulation_id: int) -> AsyncIterator[List[tuple]]:
+    # The session lives inside the generator because the response body is
+    # produced after the endpoint has returned
+    model, columns = EXPORT_TABLES[table]
+    query = (
+        select(*[getattr(model, c) for c in columns])
+        .where(model.simulation_id == simulation_id)
+        .order_by(model.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    async with ReadSessionLocal() as session:
+        result = await session.stream(query)
+        async for rows in result.partitions():
+            yield [tuple(row) for row in rows]
+
+
+async def export_ndjson(table: str, simulation_id: int) -> AsyncIterator[bytes]:
+    columns = EXPORT_TABLES[table][1]
+    async for rows in _batches(table, simulation_id):
+        yield "".join(
+            json.dumps({c: _value(v) for c, v in zip(columns, row)}) + "\n" for row in rows
+        ).encode()
+
+
+async def export_csv(table: str, simulation_id: int) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_TABLES[table][1])
+    yield buffer.getvalue().encode()
+    async for rows in _batches(table, simulation_id):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([[_value(v) for v in row] for row in rows])
+        yield buffer.getvalue().encode()
+
+
+def _parquet_schema(table: str):
+    # Declared from the model rather than inferred from the first batch, so
+    # an empty export is still a valid file and all-null columns keep their type
+    import pyarrow as pa
+    model, columns = EXPORT_TABLES[table]
+    types = {Integer: pa.int64(), Float: pa.float64(), Text: pa.string(), TIMESTAMP: pa.timestamp("us")}
+    return pa.schema([
+        (c, next(t for sql_type, t in types.items() if isinstance(getattr(model, c).type, sql_type)))
+        for c in columns
+    ])
+
+
+async def export_parquet(table: str, simulation_id: int) -> AsyncIterator[bytes]:
+    # One row group per batch, drained from the sink after each write
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    columns = EXPORT_TABLES[table][1]
+    schema = _parquet_schema(table)
+    sink = io.BytesIO()
+    writer = pq.ParquetWriter(sink, schema)
+    async for rows in _batches(table, simulation_id):
+        writer.write_table(pa.table({c: [row[i] for row in rows] for i, c in enumerate(columns)}, schema=schema))
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    writer.close()
+    yield sink.getvalue()
+
+
+EXPORTERS = {
+    "ndjson": export_ndjson,
+    "csv": export_csv,
+    "parquet": export_parquet,
+}
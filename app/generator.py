@@ -0,0 +1,345 @@
+import csv
+import math
+import os
+from collections import deque
+from datetime import datetime, timedelta
+from itertools import chain, islice
+from typing import Deque, Dict, Iterator, List, Literal, Optional, Tuple
+import numpy as np
+from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.dispatch import HANDLING_STEPS
+from app.models import Forklift, LocationList, OrderGenerator
+from app.persistence import WriteBehindPersister
+from app.world_state import OrderState, PlanState, WorldState, generated_id
+
+# Simulated seconds of arrivals drawn per block. Each block has its own
+# random stream, seeded from (seed, block), so a run resumed from a
+# checkpoint redraws exactly the arrivals the original would have seen.
+BLOCK_SECONDS = 3600
+# Rows read per block when replaying a CSV
+REPLAY_BLOCK_ROWS = 1000
+# Directory replay files are read from; configs name a file inside it
+REPLAY_DIR = os.getenv("SIM_REPLAY_DIR", "replays")
+
+
+class GeneratorConfig(BaseModel):
+    # "poisson" arrives at a constant rate_per_hour, "profile" follows
+    # hourly_rates (orders per hour for each hour of the day, 0-23) and
+    # "replay" reads arrivals from a CSV with pickup_location_id,
+    # delivery_location_id and either offset_seconds (from the start of the
+    # run) or timestamp columns
+    process: Literal["poisson", "profile", "replay"] = "poisson"
+    seed: int = 0
+    rate_per_hour: Optional[float] = None
+    hourly_rates: Optional[List[float]] = None
+    csv: Optional[str] = None
+    # Candidate locations, by default every location on map_id (or every
+    # location at all); weights are relative and default to uniform
+    map_id: Optional[int] = None
+    pickup_locations: Optional[List[int]] = None
+    delivery_locations: Optional[List[int]] = None
+    pickup_weights: Optional[List[float]] = None
+    delivery_weights: Optional[List[float]] = None
+    # Forklifts orders are assigned to, by default all of them
+    forklift_ids: Optional[List[int]] = None
+    # Simulated seconds after which no more orders arrive; without one a
+    # poisson or profile run goes on until it is stopped or hits max_steps
+    horizon_seconds: Optional[float] = None
+    # Upcoming orders drawn ahead of their release
+    buffer_size: int = 1000
+
+
+def check_config(config: GeneratorConfig) -> Optional[str]:
+    # Problems that don't need the database, as a message, or None
+    if config.process == "poisson" and not (config.rate_per_hour and config.rate_per_hour > 0):
+        return "poisson needs a positive rate_per_hour"
+    if config.process == "profile":
+        rates = config.hourly_rates or []
+        if len(rates) != 24 or min(rates) < 0 or max(rates) <= 0:
+            return "profile needs 24 non-negative hourly_rates, not all zero"
+    if config.process == "replay":
+        if not config.csv or os.path.basename(config.csv) != config.csv:
+            return f"replay needs csv, the name of a file in {REPLAY_DIR}"
+        if not os.path.isfile(os.path.join(REPLAY_DIR, config.csv)):
+            return f"Replay file {config.csv} not found"
+    for locations, weights, name in (
+        (config.pickup_locations, config.pickup_weights, "pickup"),
+        (config.delivery_locations, config.delivery_weights, "delivery"),
+    ):
+        if weights is None:
+            continue
+        if locations is None or len(weights) != len(locations):
+            return f"{name}_weights needs one weight per {name} location"
+        if min(weights) < 0 or sum(weights) <= 0:
+            return f"{name}_weights must be non-negative and not all zero"
+    if config.buffer_size < 1:
+        return "buffer_size must be at least 1"
+    if config.horizon_seconds is not None and config.horizon_seconds <= 0:
+        return "horizon_seconds must be positive"
+    return None
+
+
+async def load_config(session: AsyncSession, simulation_id: int) -> Optional[GeneratorConfig]:
+    row = await session.get(OrderGenerator, simulation_id)
+    return GeneratorConfig(**row.config) if row is not None else None
+
+
+class OrderStream:
+    # Feeds generated orders into a running simulation. Arrivals are drawn
+    # lazily, a block at a time, into a bounded buffer of the next ones.
+    # When an arrival's tick comes the order is released into the world
+    # with a plan starting at the arrival time, assigned to the forklift
+    # that would finish it earliest, by the same greedy rule the plan
+    # optimizer uses for its overflow, on Manhattan distances from where
+    # each forklift's queue ends.
+    #
+    # Generated orders and plans only ever exist in memory, under ids from
+    # generated_id(), and leave the world once delivered (see WorldState);
+    # the shared orders and dispatch_plans tables never see them. The
+    # operation log records every release, pickup and delivery.
+
+    def __init__(self, simulation_id: int, config: GeneratorConfig, origin: datetime, tick_seconds: float):
+        self.simulation_id = simulation_id
+        self.config = config
+        # Simulated time of step 0
+        self.origin = origin
+        self.tick_seconds = tick_seconds
+        self.pickups = np.zeros(0, dtype=np.int64)
+        self.deliveries = np.zeros(0, dtype=np.int64)
+        self.pickup_p: Optional[np.ndarray] = None
+        self.delivery_p: Optional[np.ndarray] = None
+        self.forklift_ids: List[int] = []
+        # Estimated tick each forklift's queue runs out, and where it ends
+        self.free_at = np.zeros(0, dtype=np.int64)
+        self.end_xy = np.zeros((0, 2), dtype=np.int64)
+        # Arrivals released so far, and the (block, index) of the next one
+        self.released = 0
+        self.cursor: Tuple[int, int] = (0, 0)
+        # Drawing position, ahead of the cursor by whatever is buffered
+        self._block = 0
+        self._index = 0
+        self._drawn: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+        self._drawn_block = -1
+        self._drained = False
+        # (tick, order and plan id, pickup, delivery, (block, index))
+        self.buffer: Deque[Tuple[int, int, int, int, Tuple[int, int]]] = deque()
+        self._replay: Optional[Iterator[dict]] = None
+        self._replay_file = None
+        self._replay_block = 0
+        self._replay_t0: Optional[datetime] = None
+
+    async def load(self, session: AsyncSession, world: WorldState):
+        # Resolves the candidate locations and forklifts, and loads them into
+        # the world so released orders can be routed straight away
+        config = self.config
+        if config.process != "replay":
+            self.pickups, self.pickup_p = await self._candidates(
+                session, config.pickup_locations, config.pickup_weights)
+            self.deliveries, self.delivery_p = await self._candidates(
+                session, config.delivery_locations, config.delivery_weights)
+            if not len(self.pickups) or not len(self.deliveries):
+                raise ValueError("Order generator has no candidate locations")
+            if len(self.pickups) == 1 and len(self.deliveries) == 1 and self.pickups[0] == self.deliveries[0]:
+                raise ValueError("Order generator needs a delivery location apart from the pickup")
+            await world.preload(session, location_ids=set(self.pickups.tolist()) | set(self.deliveries.tolist()))
+        if config.forklift_ids is not None:
+            forklift_ids = config.forklift_ids
+        else:
+            forklift_ids = (await session.execute(select(Forklift.id).order_by(Forklift.id))).scalars().all()
+        await world.preload(session, forklift_ids=set(forklift_ids))
+        self.forklift_ids = [i for i in forklift_ids if i in world.forklifts]
+        if not self.forklift_ids:
+            raise ValueError("Order generator has no forklifts to assign to")
+        self.free_at = np.zeros(len(self.forklift_ids), dtype=np.int64)
+        self.end_xy = np.array(
+            [(world.forklifts[i].x, world.forklifts[i].y) for i in self.forklift_ids], dtype=np.int64
+        ).reshape(-1, 2)
+
+    async def _candidates(self, session: AsyncSession, ids: Optional[List[int]],
+                          weights: Optional[List[float]]) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        stmt = select(LocationList.id).order_by(LocationList.id)
+        if ids is not None:
+            stmt = stmt.where(LocationList.id.in_(ids))
+        elif self.config.map_id is not None:
+            stmt = stmt.where(LocationList.mapId == self.config.map_id)
+        found = set((await session.execute(stmt)).scalars().all())
+        if ids is None:
+            return np.array(sorted(found), dtype=np.int64), None
+        missing = [i for i in ids if i not in found]
+        if missing:
+            raise ValueError(f"Unknown locations {missing}")
+        p = None
+        if weights is not None:
+            p = np.array(weights, dtype=np.float64)
+            p /= p.sum()
+        return np.array(ids, dtype=np.int64), p
+
+    # Drawing arrivals
+
+    def _rate(self, block: int, t: np.ndarray) -> np.ndarray:
+        # Orders per second at offsets t into a block
+        if self.config.process == "poisson":
+            return np.full(len(t), self.config.rate_per_hour / 3600)
+        start = self.origin + timedelta(seconds=block * BLOCK_SECONDS)
+        day_offset = start.hour * 3600 + start.minute * 60 + start.second + start.microsecond / 1e6
+        hours = ((day_offset + t) // 3600).astype(np.int64) % 24
+        return np.asarray(self.config.hourly_rates, dtype=np.float64)[hours] / 3600
+
+    def _draw_block(self, block: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # (offset seconds from the origin, pickups, deliveries) for one block
+        if self.config.process == "replay":
+            return self._replay_rows(block)
+        rng = np.random.default_rng([self.config.seed, block])
+        peak = self.config.rate_per_hour / 3600 if self.config.process == "poisson" else max(self.config.hourly_rates) / 3600
+        # A homogeneous process at the peak rate, thinned to the actual rate
+        t = np.sort(rng.uniform(0, BLOCK_SECONDS, rng.poisson(peak * BLOCK_SECONDS)))
+        t = t[rng.uniform(0, peak, len(t)) < self._rate(block, t)]
+        pickups = self.pickups[rng.choice(len(self.pickups), len(t), p=self.pickup_p)]
+        deliveries = self.deliveries[rng.choice(len(self.deliveries), len(t), p=self.delivery_p)]
+        same = np.flatnonzero(pickups == deliveries)
+        while len(same):
+            deliveries[same] = self.deliveries[rng.choice(len(self.deliveries), len(same), p=self.delivery_p)]
+            same = same[pickups[same] == deliveries[same]]
+        return block * BLOCK_SECONDS + t, pickups, deliveries
+
+    def _replay_rows(self, block: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Rows are read in order, so a block behind the reader means starting
+        # over from the top of the file
+        if self._replay is None or block < self._replay_block:
+            self.close()
+            self._replay_file = open(os.path.join(REPLAY_DIR, self.config.csv), newline="", encoding="utf-8-sig")
+            reader = csv.DictReader(self._replay_file)
+            first = next(reader, None)
+            # Timestamps count from the first row's
+            self._replay_t0 = datetime.fromisoformat(first["timestamp"]) if first and first.get("timestamp") else None
+            self._replay = chain([first] if first else [], reader)
+            self._replay_block = 0
+        if block > self._replay_block:
+            for _ in islice(self._replay, (block - self._replay_block) * REPLAY_BLOCK_ROWS):
+                pass
+        rows = list(islice(self._replay, REPLAY_BLOCK_ROWS))
+        self._replay_block = block + 1
+        t, pickups, deliveries = [], [], []
+        for row in rows:
+            if row.get("offset_seconds"):
+                t.append(float(row["offset_seconds"]))
+            else:
+                t.append((datetime.fromisoformat(row["timestamp"]) - self._replay_t0).total_seconds())
+            pickups.append(int(row["pickup_location_id"]))
+            deliveries.append(int(row["delivery_location_id"]))
+        return np.array(t, dtype=np.float64), np.array(pickups, dtype=np.int64), np.array(deliveries, dtype=np.int64)
+
+    def _next_arrivals(self, n: int) -> List[Tuple[float, int, int, Tuple[int, int]]]:
+        # Up to n arrivals from the drawing position on
+        horizon = self.config.horizon_seconds
+        out = []
+        while len(out) < n and not self._drained:
+            if self._drawn_block != self._block:
+                self._drawn = self._draw_block(self._block)
+                self._drawn_block = self._block
+            t, pickups, deliveries = self._drawn
+            if self.config.process == "replay" and not len(t):
+                self._drained = True
+                break
+            if self._index >= len(t):
+                if horizon is not None and (self._block + 1) * BLOCK_SECONDS >= horizon and self.config.process != "replay":
+                    self._drained = True
+                    break
+                self._block += 1
+                self._index = 0
+                continue
+            if horizon is not None and t[self._index] >= horizon:
+                self._drained = True
+                break
+            out.append((float(t[self._index]), int(pickups[self._index]), int(deliveries[self._index]),
+                        (self._block, self._index)))
+            self._index += 1
+        return out
+
+    # Buffer and release
+
+    @property
+    def exhausted(self) -> bool:
+        return self._drained and not self.buffer
+
+    def needs_refill(self) -> bool:
+        return not self._drained and len(self.buffer) <= self.config.buffer_size // 2
+
+    async def refill(self, session: AsyncSession, world: WorldState):
+        # Released on the first tick at or after their arrival time
+        arrivals = [
+            (math.ceil(t / self.tick_seconds - 1e-9), pickup, delivery, position)
+            for t, pickup, delivery, position in self._next_arrivals(self.config.buffer_size - len(self.buffer))
+        ]
+        if self.config.process == "replay":
+            await world.preload(session, location_ids={a[1] for a in arrivals} | {a[2] for a in arrivals})
+        seq = self.released + len(self.buffer)
+        for k, (tick, pickup, delivery, position) in enumerate(arrivals):
+            self.buffer.append((tick, generated_id(seq + k), pickup, delivery, position))
+
+    def _time(self, tick: int) -> datetime:
+        return self.origin + timedelta(seconds=tick * self.tick_seconds)
+
+    def next_tick(self) -> Optional[int]:
+        return self.buffer[0][0] if self.buffer else None
+
+    def release(self, world: WorldState, persister: WriteBehindPersister, tick: int,
+                now: datetime) -> List[Tuple[int, OrderState]]:
+        # Releases every buffered arrival due by `tick`; returns the forklift
+        # and order for each
+        released = []
+        while self.buffer and self.buffer[0][0] <= tick:
+            arrival_tick, order_id, pickup, delivery, _ = self.buffer.popleft()
+            px, py = world.locations.get(pickup, (0, 0))
+            dx, dy = world.locations.get(delivery, (0, 0))
+            available = np.array(
+                [world.forklifts.get(i) is not None and world.forklifts[i].status != 'blocked' for i in self.forklift_ids])
+            finish = (np.maximum(self.free_at, tick) + np.abs(self.end_xy[:, 0] - px) + np.abs(self.end_xy[:, 1] - py)
+                      + abs(px - dx) + abs(py - dy) + 2 * HANDLING_STEPS)
+            if available.any():
+                f = int(np.argmin(np.where(available, finish, np.iinfo(np.int64).max)))
+            else:
+                f = int(np.argmin(finish))
+            self.free_at[f] = finish[f]
+            self.end_xy[f] = (dx, dy)
+            forklift_id = self.forklift_ids[f]
+            order = OrderState(order_id, pickup, delivery, 'pending')
+            world.release(order, PlanState(order_id, forklift_id, order_id, self._time(arrival_tick), None))
+            released.append((forklift_id, order))
+            persister.add_log(world.simulation_id, now, forklift_id, 'order_released',
+                              f'Order {order_id} released to forklift {forklift_id}')
+            self.released += 1
+        self.cursor = self.buffer[0][4] if self.buffer else (self._block, self._index)
+        return released
+
+    def close(self):
+        if self._replay_file is not None:
+            self._replay_file.close()
+            self._replay_file = None
+            self._replay = None
+
+    # Snapshot arrays, see app/snapshots.py. Only the release position is
+    # kept; on resume the buffer is dropped and drawn again from there.
+
+    def dump(self) -> Dict[str, np.ndarray]:
+        return {
+            "gen_cursor": np.array([self.released, self.cursor[0], self.cursor[1]], dtype=np.int64),
+            "gen_forklift_id": np.array(self.forklift_ids, dtype=np.int64),
+            "gen_free_at": self.free_at.copy(),
+            "gen_end_xy": self.end_xy.copy(),
+        }
+
+    def restore(self, arrays: Dict[str, np.ndarray]):
+        released, block, index = arrays["gen_cursor"].tolist()
+        self.released = released
+        self.cursor = self._block, self._index = block, index
+        self.buffer.clear()
+        self._drained = False
+        # Forklifts still in the candidate set keep their estimates
+        saved = {i: k for k, i in enumerate(arrays["gen_forklift_id"].tolist())}
+        for k, forklift_id in enumerate(self.forklift_ids):
+            if forklift_id in saved:
+                self.free_at[k] = arrays["gen_free_at"][saved[forklift_id]]
+                self.end_xy[k] = arrays["gen_end_xy"][saved[forklift_id]]
@@ -0,0 +1,140 @@
+from collections import Counter
+from typing import Dict, Iterable, List
+import numpy as np
+from app.movement import MovementKernel
+from app.world_state import WorldState
+
+
+class KpiAggregator:
+    # Running KPI counters for one simulation, updated from state
+    # transitions instead of rescanning orders every tick.
+    #
+    # Order counts follow the engine's own pickups and deliveries and are
+    # only recounted when the world changes underneath (a router delta or
+    # sync). Forklift time is accumulated per tick from the movement
+    # kernel's masks: busy while it has an active plan, blocked while its
+    # status is blocked, idle otherwise, plus waiting while congestion holds
+    # it back. Block time counts both blocked and waiting forklifts.
+    # Distance is one cell per move.
+    # Everything summary() returns is in memory, no query needed.
+
+    def __init__(self, tick_seconds: float):
+        self.tick_seconds = tick_seconds
+        self.order_counts: Counter = Counter()
+        self.orders_total = 0
+        self.delivered = 0
+        self.elapsed = 0.0
+        self.block_time = 0.0
+        self._world_version = -1
+        # Totals per forklift id, folded in whenever the kernel is rebuilt
+        self._totals: Dict[int, np.ndarray] = {}
+        self._kernel_version = -1
+        self._ids: List[int] = []
+        self._time = np.zeros((0, 4))  # busy, idle, blocked, waiting
+        self.distance: Counter = Counter()
+
+    def sync(self, world: WorldState):
+        if self._world_version == world.version:
+            return
+        self._world_version = world.version
+        self.order_counts = Counter(o.status for o in world.orders.values())
+        # Delivered generated orders are no longer in the world
+        self.order_counts['done'] += world.retired_orders
+        self.orders_total = len(world.orders) + world.retired_orders
+
+    def order_added(self, status: str):
+        # An order released into the world between syncs
+        self.order_counts[status] += 1
+        self.orders_total += 1
+
+    def order_transition(self, old: str, new: str):
+        self.order_counts[old] -= 1
+        self.order_counts[new] += 1
+        if new == 'done':
+            self.delivered += 1
+
+    @property
+    def complete(self) -> bool:
+        return self.order_counts['done'] == self.orders_total
+
+    def record_tick(self, kernel: MovementKernel, moved: Iterable[int], ticks: int = 1):
+        # `ticks` > 1 covers a span the event engine skipped, over which
+        # nothing changed
+        if self._kernel_version != kernel.version:
+            self._fold()
+            self._kernel_version = kernel.version
+            self._ids = [f.id for f in kernel.forklifts]
+            self._time = np.zeros((len(self._ids), 4))
+        busy = kernel.active
+        blocked = kernel.blocked
+        waiting = kernel.waiting
+        seconds = self.tick_seconds * ticks
+        self._time[:, 0] += busy * seconds
+        self._time[:, 1] += ~(busy | blocked) * seconds
+        self._time[:, 2] += blocked * seconds
+        self._time[:, 3] += waiting * seconds
+        self.block_time += (blocked | waiting).sum() * seconds
+        self.distance.update(moved)
+        self.elapsed += seconds
+
+    def add_distance(self, forklift_id: int, cells: int):
+        # Moves the event engine applied in one go
+        self.distance[forklift_id] += cells
+
+    def _fold(self):
+        for forklift_id, row in zip(self._ids, self._time):
+            total = self._totals.get(forklift_id)
+            self._totals[forklift_id] = row.copy() if total is None else total + row
+
+    def _forklift_totals(self) -> Dict[int, np.ndarray]:
+        totals = {k: v.copy() for k, v in self._totals.items()}
+        for forklift_id, row in zip(self._ids, self._time):
+            totals[forklift_id] = totals[forklift_id] + row if forklift_id in totals else row.copy()
+        return totals
+
+    def dump(self) -> Dict[str, np.ndarray]:
+        totals = self._forklift_totals()
+        return {
+            "kpi_counters": np.array([self.delivered, self.elapsed, self.block_time], dtype=np.float64),
+            "kpi_forklift_id": np.array(list(totals), dtype=np.int64),
+            "kpi_time": np.array(list(totals.values()), dtype=np.float64).reshape(-1, 4),
+            "kpi_distance_id": np.array(list(self.distance), dtype=np.int64),
+            "kpi_distance": np.array(list(self.distance.values()), dtype=np.int64),
+        }
+
+    def restore(self, arrays: Dict[str, np.ndarray]):
+        delivered, self.elapsed, self.block_time = arrays["kpi_counters"].tolist()
+        self.delivered = int(delivered)
+        self._totals = {int(i): row.copy() for i, row in zip(arrays["kpi_forklift_id"], arrays["kpi_time"])}
+        self._ids = []
+        self._time = np.zeros((0, 4))
+        self._kernel_version = -1
+        self.distance = Counter(dict(zip(arrays["kpi_distance_id"].tolist(), arrays["kpi_distance"].tolist())))
+
+    def summary(self) -> dict:
+        totals = self._forklift_totals()
+        hours = self.elapsed / 3600
+        return {
+            "elapsed_seconds": self.elapsed,
+            "orders": {
+                "total": self.orders_total,
+                "done": self.order_counts['done'],
+                "in_progress": self.order_counts['in_progress'],
+                "pending": self.order_counts['pending'],
+            },
+            "throughput_per_hour": self.delivered / hours if hours else 0.0,
+            "busy_time": float(sum(v[0] for v in totals.values())),
+            "idle_time": float(sum(v[1] for v in totals.values())),
+            "block_time": float(sum(v[2] + v[3] for v in totals.values())),
+            "wait_time": float(sum(v[3] for v in totals.values())),
+            "distance": sum(self.distance.values()),
+            "forklifts": {
+                forklift_id: {
+                    "busy_time": float(v[0]),
+                    "idle_time": float(v[1]),
+                    "block_time": float(v[2] + v[3]),
+                    "wait_time": float(v[3]),
+                    "distance": self.distance[forklift_id],
+                } for forklift_id, v in totals.items()
+            },
+        }
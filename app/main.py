@@ -1,4 +1,7 @@
-from fastapi import FastAPI
+import os
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers.forklifts import router as forklifts_router
 from app.routers.orders import router as orders_router
@@ -7,6 +10,18 @@ from app.routers.warehouse import router as warehouse_router
 from app.routers.kpis import router as kpis_router
 from app.routers.operation_logs import router as operation_logs_router
 from app.routers.simulations import router as simulations_router
+from app.routers.experiments import router as experiments_router
+from app.simulation_engine import simulation_engine
+from app.experiments import experiment_runner
+from app.response_cache import response_cache
+from app.pagination import NEXT_CURSOR_HEADER
+from app.db import AsyncSessionLocal, pool_status
+from app.snapshots import interrupted_runs
+from app import metrics
+
+# Pick up simulations a restart left 'running'. Only one API process may do
+# this, so set SIM_AUTO_RESUME=0 on all but one when running several.
+AUTO_RESUME = os.getenv("SIM_AUTO_RESUME", "1") == "1"
 
 app = FastAPI()
 
@@ -16,8 +31,49 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    queries = [0]
+    token = metrics.request_queries.set(queries)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.request_queries.reset(token)
+        # Label by route template, not raw path, to keep label sets bounded
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        metrics.REQUEST_SECONDS.observe(elapsed, request.method, path, status)
+        metrics.REQUEST_QUERIES.observe(queries[0], request.method, path)
+
+def _simulation_gauge(field: str):
+    def collect():
+        return {
+            (simulation_id,): status[field]
+            for simulation_id, status in simulation_engine.running_status().items()
+            if status.get(field) is not None
+        }
+    return collect
+
+def _pool_gauge(field: str):
+    def collect():
+        return {(pool,): status[field] for pool, status in pool_status().items()}
+    return collect
+
+metrics.Gauge("sim_tick_lag_seconds", "How far the last tick finished behind its schedule", ["simulation_id"], _simulation_gauge("tick_lag"))
+metrics.Gauge("sim_step", "Ticks run so far", ["simulation_id"], _simulation_gauge("step"))
+metrics.Gauge("db_pool_checked_out", "Connections checked out of the pool", ["pool"], _pool_gauge("checked_out"))
+metrics.Gauge("db_pool_size", "Configured pool size", ["pool"], _pool_gauge("size"))
+metrics.Gauge("db_pool_wait_seconds_total", "Time spent waiting for a connection", ["pool"], _pool_gauge("wait_seconds_total"))
+metrics.Gauge("db_pool_waits_total", "Connection checkouts", ["pool"], _pool_gauge("waits"))
+
 app.include_router(forklifts_router)
 app.include_router(orders_router)
 app.include_router(plans_router)
@@ -25,6 +81,36 @@ app.include_router(warehouse_router)
 app.include_router(kpis_router)
 app.include_router(operation_logs_router)
 app.include_router(simulations_router)
+app.include_router(experiments_router)
+
+@app.on_event("startup")
+async def startup():
+    await response_cache.listen()
+    if not AUTO_RESUME:
+        return
+    async with AsyncSessionLocal() as session:
+        runs = await interrupted_runs(session)
+    for simulation_id, speed, max_steps, mode in runs:
+        # From the last checkpoint, or from the database rows if there is none
+        await simulation_engine.start_simulation(simulation_id, speed, max_steps, resume=True, mode=mode)
+
+@app.on_event("shutdown")
+async def shutdown():
+    await simulation_engine.shutdown()
+    await experiment_runner.shutdown()
+    await response_cache.close()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    # Tick timers are recorded where the tick runs, so with the process
+    # executor only the gauges fed by worker status snapshots show up here
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/db/pool")
+def db_pool():
+    # Checked-out connections and checkout waits per pool; the simulation
+    # pool running hot while API waits climb means simulations starve the API
+    return pool_status()
 
 @app.get("/")
 def read_root():
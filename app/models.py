@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey, TIMESTAMP, JSON
+from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey, TIMESTAMP, JSON, LargeBinary, Index
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -24,6 +24,9 @@ class Order(Base):
     pickup_location_id = Column(Integer, ForeignKey("locationlist.id"))
     delivery_location_id = Column(Integer, ForeignKey("locationlist.id"))
     status = Column(Text, nullable=False)
+    __table_args__ = (
+        Index("ix_orders_status", "status"),
+    )
 
 class DispatchPlan(Base):
     __tablename__ = "dispatch_plans"
@@ -33,6 +36,9 @@ class DispatchPlan(Base):
     start_time = Column(TIMESTAMP)
     end_time = Column(TIMESTAMP)
     simulation_id = Column(Integer, ForeignKey("simulations.id"))
+    __table_args__ = (
+        Index("ix_dispatch_plans_simulation_forklift", "simulation_id", "forklift_id"),
+    )
 
 class OperationLog(Base):
     __tablename__ = "operation_logs"
@@ -42,6 +48,12 @@ class OperationLog(Base):
     event = Column(Text, nullable=False)
     details = Column(Text)
     simulation_id = Column(Integer, ForeignKey("simulations.id"))
+    __table_args__ = (
+        Index("ix_operation_logs_simulation_timestamp", "simulation_id", "timestamp"),
+        Index("ix_operation_logs_simulation_forklift", "simulation_id", "forklift_id"),
+        # Keyset pages of one simulation's logs (app/pagination.py)
+        Index("ix_operation_logs_simulation_id", "simulation_id", "id"),
+    )
 
 class KPI(Base):
     __tablename__ = "kpis"
@@ -50,6 +62,63 @@ class KPI(Base):
     execution_time = Column(Float)
     block_time = Column(Float)
     simulation_id = Column(Integer, ForeignKey("simulations.id"))
+    __table_args__ = (
+        Index("ix_kpis_simulation_timestamp", "simulation_id", "timestamp"),
+        Index("ix_kpis_simulation_id", "simulation_id", "id"),
+    )
+
+class SimulationSnapshot(Base):
+    __tablename__ = "simulation_snapshots"
+    id = Column(Integer, primary_key=True, index=True)
+    simulation_id = Column(Integer, ForeignKey("simulations.id"), nullable=False)
+    # Set on forks: the simulation whose plans and shared rows it branched from
+    parent_id = Column(Integer, ForeignKey("simulations.id"))
+    step = Column(Integer, nullable=False)
+    sim_time = Column(TIMESTAMP, nullable=False)
+    speed = Column(Float)
+    max_steps = Column(Integer)
+    mode = Column(Text)
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(TIMESTAMP)
+    __table_args__ = (
+        Index("ix_simulation_snapshots_simulation_step", "simulation_id", "step"),
+    )
+
+class SimulationForklift(Base):
+    # A simulation's own position for a forklift, copied on first write
+    # and valid while the forklift is still based at location_id
+    __tablename__ = "simulation_forklifts"
+    simulation_id = Column(Integer, ForeignKey("simulations.id", ondelete="CASCADE"), primary_key=True)
+    forklift_id = Column(Integer, ForeignKey("forklifts.id", ondelete="CASCADE"), primary_key=True)
+    location_id = Column(Integer, ForeignKey("locationlist.id", ondelete="CASCADE"))
+    x = Column(Integer, nullable=False)
+    y = Column(Integer, nullable=False)
+
+class SimulationOrder(Base):
+    # A simulation's own status for an order, copied on first write
+    __tablename__ = "simulation_orders"
+    simulation_id = Column(Integer, ForeignKey("simulations.id", ondelete="CASCADE"), primary_key=True)
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), primary_key=True)
+    status = Column(Text, nullable=False)
+
+class OrderGenerator(Base):
+    __tablename__ = "order_generators"
+    simulation_id = Column(Integer, ForeignKey("simulations.id"), primary_key=True)
+    config = Column(JSON, nullable=False)
+    updated_at = Column(TIMESTAMP)
+
+class Experiment(Base):
+    # A batch of headless runs over a parameter grid, see app/experiments.py
+    __tablename__ = "experiments"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(Text)
+    status = Column(Text, nullable=False)
+    config = Column(JSON, nullable=False)
+    runs_total = Column(Integer, nullable=False)
+    runs_done = Column(Integer, nullable=False, default=0)
+    results = Column(JSON)
+    created_at = Column(TIMESTAMP)
+    finished_at = Column(TIMESTAMP)
 
 class WarehouseMap(Base):
     __tablename__ = "warehouse_map"
@@ -74,4 +143,13 @@ class LocationList(Base):
     name = Column(Text, nullable=False)
     mapId = Column("mapid", ForeignKey("maplist.id"))
     displayX = Column(Integer, nullable=False)
-    displayY = Column(Integer, nullable=False) 
\ No newline at end of file
+    displayY = Column(Integer, nullable=False)
+
+class LocationDistances(Base):
+    __tablename__ = "location_distances"
+    mapId = Column("mapid", Integer, ForeignKey("maplist.id"), primary_key=True)
+    layout_hash = Column(Text, nullable=False)
+    location_ids = Column(LargeBinary, nullable=False)
+    coords = Column(LargeBinary, nullable=False)
+    distances = Column(LargeBinary, nullable=False)
+    updated_at = Column(TIMESTAMP)
@@ -0,0 +1,301 @@
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from app.congestion import CONGESTION, CongestionModel
+from app.routing import Router, router as default_router
+from app.world_state import NO_ID, WorldState, ForkliftState, PlanState, OrderState
+
+
+class MovementKernel:
+    # Array-backed copy of every forklift's position and current waypoint, so
+    # one tick moves the whole fleet with a few vectorized operations. The
+    # stepping rule is the engine's: one cell along x until aligned, then one
+    # cell along y. Routes from the Router are corner waypoints, so each leg
+    # is axis aligned and the rule follows it exactly; on open floor the only
+    # waypoint is the goal.
+    #
+    # Targets are only recomputed for forklifts that arrived this tick, or
+    # for everyone when the world version changes (a router delta or sync).
+    # With congestion on, proposed moves go through the CongestionModel,
+    # which can hold a forklift back (waiting) or send it round a sidestep.
+
+    def __init__(self, router: Router = default_router, congestion: bool = CONGESTION):
+        self.router = router
+        self.congestion = CongestionModel(router) if congestion else None
+        self.version = -1
+        self.forklifts: List[ForkliftState] = []
+        self.index: Dict[int, int] = {}
+        self.plans: List[Optional[PlanState]] = []
+        self.orders: List[Optional[OrderState]] = []
+        self.phases: List[Optional[str]] = []
+        self.goals: List[Optional[int]] = []
+        self.route_maps: List[Optional[int]] = []
+        self.at_location: List[Optional[int]] = []
+        self.waypoints: List[List[Tuple[int, int]]] = []
+        self.cursors: List[int] = []
+        self.pos = np.zeros((0, 2), dtype=np.int64)
+        self.target = np.zeros((0, 2), dtype=np.int64)
+        self.active = np.zeros(0, dtype=bool)
+        self.final = np.zeros(0, dtype=bool)
+        self.blocked = np.zeros(0, dtype=bool)
+        self._order_refs: Counter = Counter()
+        self._shared = 0
+
+    @property
+    def has_shared_orders(self) -> bool:
+        # Two forklifts heading for the same order interact within a tick,
+        # which only the sequential loop reproduces exactly
+        return self._shared > 0
+
+    def sync(self, world: WorldState):
+        if self.version == world.version:
+            return
+        self.version = world.version
+        self.forklifts = list(world.forklifts.values())
+        self.index = {f.id: i for i, f in enumerate(self.forklifts)}
+        n = len(self.forklifts)
+        self.plans = [None] * n
+        self.orders = [None] * n
+        self.phases = [None] * n
+        self.goals = [None] * n
+        self.route_maps = [None] * n
+        self.at_location = [None] * n
+        self.waypoints = [[] for _ in range(n)]
+        self.cursors = [0] * n
+        self.pos = np.array([(f.x, f.y) for f in self.forklifts], dtype=np.int64).reshape(n, 2)
+        self.target = np.zeros((n, 2), dtype=np.int64)
+        self.active = np.zeros(n, dtype=bool)
+        self.final = np.zeros(n, dtype=bool)
+        self.blocked = np.array([f.status == 'blocked' for f in self.forklifts], dtype=bool)
+        self._order_refs = Counter()
+        self._shared = 0
+        if self.congestion is not None:
+            # Pickup and delivery points can hold any number of forklifts
+            stations = set()
+            for order in world.orders.values():
+                stations.add(order.pickup_location_id)
+                stations.add(order.delivery_location_id)
+            self.congestion.sync(
+                [world.location_maps.get(f.location_id) for f in self.forklifts],
+                {(world.location_maps.get(l),) + world.locations[l] for l in stations if l in world.locations},
+            )
+        for i in range(n):
+            self.refresh(world, i)
+
+    def refresh(self, world: WorldState, i: int):
+        old = self.orders[i]
+        if old is not None:
+            self._order_refs[old.id] -= 1
+            if self._order_refs[old.id] == 1:
+                self._shared -= 1
+        self.plans[i] = self.orders[i] = self.phases[i] = self.goals[i] = None
+        self.active[i] = False
+
+        forklift = self.forklifts[i]
+        if forklift.status == 'blocked':
+            return
+        plan = world.active_plan(forklift.id)
+        if plan is None:
+            return
+        order = world.orders[plan.order_id]
+        # Move towards pickup while pending, then towards delivery
+        if order.status == 'pending':
+            goal = order.pickup_location_id
+        elif order.status == 'in_progress':
+            goal = order.delivery_location_id
+        else:
+            return
+        target = world.locations.get(goal)
+        if target is None:
+            return
+        start = (int(self.pos[i, 0]), int(self.pos[i, 1]))
+        # Location to location legs repeat across orders and are cached
+        here = self.at_location[i]
+        pair = (here, goal) if here is not None and world.locations.get(here) == start else None
+        map_id = world.location_maps.get(goal)
+        waypoints = self.router.route(map_id, start, target, pair)
+
+        self.plans[i] = plan
+        self.orders[i] = order
+        self.phases[i] = order.status
+        self.goals[i] = goal
+        self.route_maps[i] = map_id
+        self._set_route(i, waypoints)
+        self.active[i] = True
+        self._order_refs[order.id] += 1
+        if self._order_refs[order.id] == 2:
+            self._shared += 1
+
+    def assign(self, world: WorldState, forklift_id: int, order: OrderState) -> Optional[int]:
+        # A plan appended to the back of a forklift's queue without a version
+        # change (a generated order, see app/generator.py). A busy forklift
+        # gets to it on its own; an idle one is routed now. Returns the index
+        # of a forklift that set off.
+        if self.version != world.version:
+            return None  # The next sync picks it up
+        if self.congestion is not None:
+            for location_id in (order.pickup_location_id, order.delivery_location_id):
+                if location_id in world.locations:
+                    self.congestion.shared.add((world.location_maps.get(location_id),) + world.locations[location_id])
+        i = self.index.get(forklift_id)
+        if i is None or self.active[i]:
+            return None
+        self.refresh(world, i)
+        return i if self.active[i] else None
+
+    def arrived(self, world: WorldState, i: int):
+        # Called once the engine has applied the pickup or delivery
+        self.at_location[i] = self.goals[i]
+        self.refresh(world, i)
+
+    def revalidate(self, world: WorldState, i: int):
+        # Another forklift may have moved this one's order on earlier in the tick
+        order = self.orders[i]
+        if order is not None and order.status != self.phases[i]:
+            self.refresh(world, i)
+
+    def dump(self) -> Dict[str, np.ndarray]:
+        # Routes in progress and congestion counters. A route recomputed from
+        # mid-leg can tie-break differently, so the remaining waypoints are
+        # kept to make a resumed run step exactly as the original.
+        routed = np.flatnonzero(self.active)
+        return {
+            "kernel_forklift_id": np.array([f.id for f in self.forklifts], dtype=np.int64),
+            "kernel_at_location": np.array([NO_ID if a is None else a for a in self.at_location], dtype=np.int64),
+            "kernel_waited": self.congestion.waited.copy() if self.congestion is not None else np.zeros(len(self.forklifts), dtype=np.int64),
+            "kernel_routed": routed.astype(np.int64),
+            "kernel_goal": np.array([self.goals[i] for i in routed], dtype=np.int64),
+            "kernel_cursor": np.array([self.cursors[i] for i in routed], dtype=np.int64),
+            "kernel_route_length": np.array([len(self.waypoints[i]) for i in routed], dtype=np.int64),
+            "kernel_route": np.array([p for i in routed for p in self.waypoints[i]], dtype=np.int64).reshape(-1, 2),
+        }
+
+    def restore(self, world: WorldState, arrays: Dict[str, np.ndarray]):
+        self.sync(world)
+        index = self.index
+        saved = arrays["kernel_forklift_id"].tolist()
+        for forklift_id, at in zip(saved, arrays["kernel_at_location"].tolist()):
+            if forklift_id in index and at != NO_ID:
+                self.at_location[index[forklift_id]] = at
+        if self.congestion is not None:
+            for forklift_id, waited in zip(saved, arrays["kernel_waited"].tolist()):
+                if forklift_id in index:
+                    self.congestion.waited[index[forklift_id]] = waited
+        offsets = np.concatenate(([0], np.cumsum(arrays["kernel_route_length"])))
+        route = [tuple(p) for p in arrays["kernel_route"].tolist()]
+        for n, (k, goal, cursor) in enumerate(zip(
+                arrays["kernel_routed"].tolist(), arrays["kernel_goal"].tolist(), arrays["kernel_cursor"].tolist())):
+            i = index.get(saved[k])
+            # Only where the forklift is still headed for the same place
+            if i is None or self.goals[i] != goal:
+                continue
+            self._set_route(i, route[offsets[n]:offsets[n + 1]])
+            self.cursors[i] = cursor
+            self.target[i] = self.waypoints[i][cursor]
+            self.final[i] = cursor == len(self.waypoints[i]) - 1
+
+    def _set_route(self, i: int, waypoints: List[Tuple[int, int]]):
+        self.waypoints[i] = waypoints
+        self.cursors[i] = 0
+        self.target[i] = waypoints[0]
+        self.final[i] = len(waypoints) == 1
+
+    def _detour(self, i: int, avoid: Tuple[int, int]):
+        # Re-route from wherever a sidestep left the forklift, clear of the
+        # cell that held it up
+        start = (int(self.pos[i, 0]), int(self.pos[i, 1]))
+        self._set_route(i, self.router.detour(self.route_maps[i], start, self.waypoints[i][-1], avoid))
+
+    @property
+    def waiting(self) -> np.ndarray:
+        # Forklifts held back by congestion this tick
+        if self.congestion is None:
+            return np.zeros(len(self.forklifts), dtype=bool)
+        return self.congestion.waiting
+
+    def begin_tick(self):
+        if self.congestion is not None:
+            self.congestion.begin_tick(self.pos)
+
+    def _next_waypoint(self, i: int):
+        self.cursors[i] += 1
+        self.target[i] = self.waypoints[i][self.cursors[i]]
+        self.final[i] = self.cursors[i] == len(self.waypoints[i]) - 1
+
+    def remaining(self, i: int) -> int:
+        # Moves left to the goal along the current route
+        waypoints = self.waypoints[i]
+        cursor = self.cursors[i]
+        x, y = int(self.pos[i, 0]), int(self.pos[i, 1])
+        tx, ty = waypoints[cursor]
+        total = abs(tx - x) + abs(ty - y)
+        for (ax, ay), (bx, by) in zip(waypoints[cursor:], waypoints[cursor + 1:]):
+            total += abs(bx - ax) + abs(by - ay)
+        return total
+
+    def advance(self, i: int, moves: int):
+        # Applies `moves` ticks of the stepping rule to one forklift at once,
+        # leaving position and cursor where step() would have left them
+        x, y = int(self.pos[i, 0]), int(self.pos[i, 1])
+        while moves > 0:
+            if not self.final[i] and x == self.target[i, 0] and y == self.target[i, 1]:
+                self._next_waypoint(i)
+            tx, ty = int(self.target[i, 0]), int(self.target[i, 1])
+            if x != tx:
+                d = min(moves, abs(tx - x))
+                x += d if tx > x else -d
+            elif y != ty:
+                d = min(moves, abs(ty - y))
+                y += d if ty > y else -d
+            else:
+                break
+            moves -= d
+        self.pos[i] = (x, y)
+
+    def step(self) -> Tuple[np.ndarray, np.ndarray]:
+        # Returns the indices of forklifts that moved and of those that
+        # are standing on their goal
+        for i in np.flatnonzero(self.active & ~self.final & (self.pos == self.target).all(axis=1)):
+            self._next_waypoint(i)
+        delta = self.target - self.pos
+        dx, dy = delta[:, 0], delta[:, 1]
+        move_x = self.active & (dx != 0)
+        move_y = self.active & ~move_x & (dy != 0)
+        moved = move_x | move_y
+        arrived = self.active & self.final & ~moved
+        step = np.stack((np.sign(dx) * move_x, np.sign(dy) * move_y), axis=1)
+        detours = []
+        self.begin_tick()
+        if self.congestion is not None:
+            loaded = np.array([phase == 'in_progress' for phase in self.phases], dtype=bool)
+            moved, detours = self.congestion.resolve(self.pos, step, np.flatnonzero(moved), loaded)
+        self.pos += step * moved[:, None]
+        for i, avoid in detours:
+            self._detour(i, avoid)
+        return np.flatnonzero(moved), np.flatnonzero(arrived)
+
+    def step_one(self, i: int) -> Optional[bool]:
+        # Scalar version of step() for a single forklift: True if it moved,
+        # False if it is standing on its goal, None if it has nothing to do
+        if not self.active[i]:
+            return None
+        if not self.final[i] and (self.pos[i] == self.target[i]).all():
+            self._next_waypoint(i)
+        dx = self.target[i, 0] - self.pos[i, 0]
+        dy = self.target[i, 1] - self.pos[i, 1]
+        if dx != 0:
+            step = np.array((1 if dx > 0 else -1, 0))
+        elif dy != 0:
+            step = np.array((0, 1 if dy > 0 else -1))
+        else:
+            return False
+        avoid = None
+        if self.congestion is not None:
+            # Waiting counts as nothing to do this tick
+            step, avoid = self.congestion.try_move(i, self.pos[i], step)
+            if step is None:
+                return None
+        self.pos[i] += step
+        if avoid is not None:
+            self._detour(i, avoid)
+        return True
@@ -0,0 +1,27 @@
+from typing import List, Optional
+from fastapi import HTTPException, Response
+
+# Hard cap on a single page, whatever the client asks for
+MAX_PAGE_SIZE = 10000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def paginate(query, model, after_id: Optional[int], limit: Optional[int]):
+    # Keyset pagination on the primary key: rows come back in id order and
+    # the next page starts after the last id seen, so deep pages cost the
+    # same as the first one. Without a limit every matching row comes back,
+    # on all list endpoints alike; pages are opt-in
+    if limit is not None and not 0 < limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    query = query.order_by(model.id)
+    if after_id is not None:
+        query = query.where(model.id > after_id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def set_next_cursor(response: Response, rows: List, limit: Optional[int]):
+    # A full page means there may be more; the cursor is the last id
+    if limit is not None and len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = str(rows[-1].id)
@@ -0,0 +1,207 @@
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import Integer, TIMESTAMP, and_, bindparam, column, delete, insert, or_, update, values
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db import SimSessionLocal
+from app.models import DispatchPlan, OperationLog, KPI, SimulationForklift, SimulationOrder
+from app.response_cache import PLANS, response_cache
+from app.world_state import WorldState, is_generated
+
+FLUSH_INTERVAL = float(os.getenv("SIM_FLUSH_INTERVAL", "5"))
+FLUSH_BATCH_SIZE = int(os.getenv("SIM_FLUSH_BATCH_SIZE", "5000"))
+# Rows per multi-row INSERT / VALUES list, kept well under the bind
+# parameter limit of the driver
+CHUNK_SIZE = 1000
+
+
+def chunked(rows: List, size: int = CHUNK_SIZE):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+async def discard_state(session: AsyncSession, simulation_id: int):
+    # Drops a simulation's own positions and statuses, so its next run
+    # starts over from the master rows
+    await session.execute(delete(SimulationForklift).where(SimulationForklift.simulation_id == simulation_id))
+    await session.execute(delete(SimulationOrder).where(SimulationOrder.simulation_id == simulation_id))
+
+
+class WriteBehindPersister:
+    # Buffers everything a simulation writes and flushes it in a handful of
+    # set-based statements, either every FLUSH_INTERVAL seconds or once
+    # FLUSH_BATCH_SIZE changes are pending. Position, status and end time
+    # buffers are keyed by row id, so only the last value per row is written.
+    # Positions and statuses go to the simulation's own copies, see
+    # WorldState. Generated orders and their plans are not rows and are
+    # left out.
+
+    def __init__(self, simulation_id: int, flush_interval: float = FLUSH_INTERVAL, batch_size: int = FLUSH_BATCH_SIZE):
+        self.simulation_id = simulation_id
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        # Off for forks: the dispatch plans they run are their parent's
+        self.own_plans = True
+        # Forklift id to (home location id, x, y)
+        self.positions: Dict[int, Tuple[Optional[int], int, int]] = {}
+        self.order_statuses: Dict[int, str] = {}
+        self.plan_end_times: Dict[int, Optional[datetime]] = {}
+        self.plan_forklifts: Dict[int, int] = {}
+        self.logs: List[dict] = []
+        self.kpis: List[dict] = []
+        self._last_flush = time.monotonic()
+
+    @property
+    def pending(self) -> int:
+        return (len(self.positions) + len(self.order_statuses) + len(self.plan_end_times)
+                + len(self.plan_forklifts) + len(self.logs) + len(self.kpis))
+
+    def collect(self, world: WorldState):
+        for forklift_id in world.moved_forklifts:
+            forklift = world.forklifts.get(forklift_id)
+            if forklift is not None:
+                self.positions[forklift_id] = (forklift.location_id, forklift.x, forklift.y)
+        for order_id in world.changed_orders:
+            order = world.orders.get(order_id)
+            if order is not None and not is_generated(order_id):
+                self.order_statuses[order_id] = order.status
+        if self.own_plans:
+            for plan_id in world.finished_plans:
+                plan = world.plans.get(plan_id)
+                if plan is not None and not is_generated(plan_id):
+                    self.plan_end_times[plan_id] = plan.end_time
+            for plan_id in world.assigned_plans:
+                plan = world.plans.get(plan_id)
+                if plan is not None and not is_generated(plan_id):
+                    self.plan_forklifts[plan_id] = plan.forklift_id
+        world.clear_changes()
+
+    def discard_order_status(self, order_id: Optional[int] = None):
+        # An order status written through the API wins over a buffered one
+        if order_id is None:
+            self.order_statuses.clear()
+        else:
+            self.order_statuses.pop(order_id, None)
+
+    def add_log(self, simulation_id: int, timestamp: datetime, forklift_id: Optional[int], event: str, details: str):
+        self.logs.append({
+            "timestamp": timestamp,
+            "forklift_id": forklift_id,
+            "event": event,
+            "details": details,
+            "simulation_id": simulation_id,
+        })
+
+    def add_kpi(self, simulation_id: int, timestamp: datetime, execution_time: float, block_time: float):
+        self.kpis.append({
+            "timestamp": timestamp,
+            "execution_time": execution_time,
+            "block_time": block_time,
+            "simulation_id": simulation_id,
+        })
+
+    def should_flush(self) -> bool:
+        if self.pending >= self.batch_size:
+            return True
+        return self.pending > 0 and time.monotonic() - self._last_flush >= self.flush_interval
+
+    async def maybe_flush(self):
+        if self.should_flush():
+            await self.flush()
+
+    async def flush(self):
+        self._last_flush = time.monotonic()
+        if not self.pending:
+            return
+        positions, self.positions = self.positions, {}
+        order_statuses, self.order_statuses = self.order_statuses, {}
+        plan_end_times, self.plan_end_times = self.plan_end_times, {}
+        plan_forklifts, self.plan_forklifts = self.plan_forklifts, {}
+        logs, self.logs = self.logs, []
+        kpis, self.kpis = self.kpis, []
+        try:
+            async with SimSessionLocal() as session:
+                dialect = session.bind.dialect.name
+                postgres = dialect == "postgresql"
+                await self._upsert_rows(
+                    session, dialect, SimulationForklift, ["simulation_id", "forklift_id"],
+                    [{"simulation_id": self.simulation_id, "forklift_id": k, "location_id": location_id, "x": x, "y": y}
+                     for k, (location_id, x, y) in positions.items()],
+                )
+                await self._upsert_rows(
+                    session, dialect, SimulationOrder, ["simulation_id", "order_id"],
+                    [{"simulation_id": self.simulation_id, "order_id": k, "status": v} for k, v in order_statuses.items()],
+                )
+                await self._update_rows(
+                    session, postgres, DispatchPlan,
+                    [{"id": k, "end_time": v} for k, v in plan_end_times.items()],
+                    [("end_time", TIMESTAMP, "end_time")],
+                )
+                await self._update_rows(
+                    session, postgres, DispatchPlan,
+                    [{"id": k, "forklift_id": v} for k, v in plan_forklifts.items()],
+                    [("forklift_id", Integer, "forklift_id")],
+                )
+                for chunk in chunked(logs):
+                    await session.execute(insert(OperationLog).values(chunk))
+                for chunk in chunked(kpis):
+                    await session.execute(insert(KPI).values(chunk))
+                await session.commit()
+        except BaseException:
+            # Put everything back for the next flush; whatever was buffered
+            # meanwhile is newer and wins
+            self.positions = {**positions, **self.positions}
+            self.order_statuses = {**order_statuses, **self.order_statuses}
+            self.plan_end_times = {**plan_end_times, **self.plan_end_times}
+            self.plan_forklifts = {**plan_forklifts, **self.plan_forklifts}
+            self.logs = logs + self.logs
+            self.kpis = kpis + self.kpis
+            raise
+        if plan_end_times or plan_forklifts:
+            response_cache.invalidate(PLANS)
+
+    @staticmethod
+    async def _upsert_rows(session: AsyncSession, dialect: str, model, keys: List[str], rows: List[dict]):
+        # Inserts rows, or overwrites the ones already there by primary key
+        if not rows:
+            return
+        table = model.__table__
+        for chunk in chunked(rows):
+            if dialect in ("postgresql", "sqlite"):
+                stmt = (postgresql if dialect == "postgresql" else sqlite).insert(table).values(chunk)
+                await session.execute(stmt.on_conflict_do_update(
+                    index_elements=keys,
+                    set_={c: stmt.excluded[c] for c in chunk[0] if c not in keys},
+                ))
+                continue
+            await session.execute(delete(table).where(or_(*[
+                and_(*[table.c[k] == row[k] for k in keys]) for row in chunk
+            ])))
+            await session.execute(insert(table).values(chunk))
+
+    @staticmethod
+    async def _update_rows(session: AsyncSession, postgres: bool, model, rows: List[dict], fields):
+        if not rows:
+            return
+        table = model.__table__
+        if not postgres:
+            # Fallback for dialects without UPDATE ... FROM (VALUES ...); bind
+            # names must not clash with the column names in the SET clause
+            stmt = update(table).where(table.c.id == bindparam("_id")).values(
+                {table.c[attr].name: bindparam("_" + key) for key, _, attr in fields}
+            )
+            await session.execute(stmt, [{"_" + k: v for k, v in row.items()} for row in rows])
+            return
+        for chunk in chunked(rows):
+            v = values(
+                column("id", Integer),
+                *[column(key, type_) for key, type_, _ in fields],
+                name="v",
+            ).data([tuple(row[c] for c in ["id"] + [key for key, _, _ in fields]) for row in chunk])
+            await session.execute(
+                update(table)
+                .where(table.c.id == v.c.id)
+                .values({table.c[attr].name: v.c[key] for key, _, attr in fields})
+            )
@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Set, Tuple
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import func, select
+from app import metrics
+from app.db import engine
+
+# What a cached response is built from. Every route that changes one of
+# these calls response_cache.invalidate() once it has committed.
+LOCATIONS = "locations"
+MAPS = "maps"
+FORKLIFTS = "forklifts"
+ORDERS = "orders"
+PLANS = "plans"
+
+# Seconds a cached response is served without an invalidation. Bounds how
+# stale a response gets after writes no route saw (seed scripts, manual
+# SQL) or that no other process heard of (without Postgres).
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "60"))
+# Responses kept per process, least recently used dropped first
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+# Postgres LISTEN/NOTIFY channel invalidations are shared over
+CHANNEL = "response_cache"
+CACHE_CONTROL = "no-cache"
+
+
+class _Entry(NamedTuple):
+    versions: Tuple[int, ...]
+    stored_at: float
+    etag: str
+    body: bytes
+    headers: Dict[str, str]
+
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+class ResponseCache:
+    # Serialized bodies of read-heavy list endpoints, with an ETag each.
+    # Every scope has a version counter, bumped on invalidation; an entry
+    # holds the versions it was built at and is rebuilt once any of them
+    # moves on. The ETag is a hash of the body, so every API worker hands
+    # out the same one for the same data and a client revalidating against
+    # a worker that just rebuilt still gets its 304. A 304 from a current
+    # entry never touches the database.
+    #
+    # With several uvicorn workers, or simulations in worker processes,
+    # invalidations go out over Postgres NOTIFY and each API worker LISTENs
+    # for them. Without Postgres, or if the listener can't connect, each
+    # process only sees its own invalidations and RESPONSE_CACHE_TTL bounds
+    # the rest.
+    #
+    # Entries are built from the primary, never a read replica: a rebuild
+    # right after an invalidation would otherwise cache whatever the
+    # replica has not caught up on, under a fresh ETag, for the whole TTL.
+
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL, size: int = RESPONSE_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self.versions: Dict[str, int] = {}
+        self.entries: "OrderedDict[tuple, _Entry]" = OrderedDict()
+        self._listener = None
+        self._publishing: Set[asyncio.Task] = set()
+
+    @property
+    def shared(self) -> bool:
+        return self._listener is not None
+
+    def invalidate(self, *scopes: str):
+        self._bump(scopes)
+        if engine.dialect.name != "postgresql":
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = loop.create_task(self._publish(scopes))
+        self._publishing.add(task)
+        task.add_done_callback(self._publishing.discard)
+
+    def _bump(self, scopes):
+        for scope in scopes:
+            self.versions[scope] = self.versions.get(scope, 0) + 1
+
+    async def _publish(self, scopes):
+        # Tagged with the pid so the sender skips its own notification
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(select(func.pg_notify(CHANNEL, f"{os.getpid()}:{','.join(scopes)}")))
+        except Exception:
+            # The other workers catch up within the TTL
+            pass
+
+    async def listen(self):
+        # Called once per API worker on startup
+        if engine.dialect.name != "postgresql":
+            return
+        import asyncpg
+        url = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        try:
+            self._listener = await asyncpg.connect(url)
+            await self._listener.add_listener(CHANNEL, self._on_notify)
+        except (OSError, asyncpg.PostgresError):
+            self._listener = None
+            return
+        self._listener.add_termination_listener(self._on_lost)
+
+    async def close(self):
+        listener, self._listener = self._listener, None
+        if listener is not None:
+            await listener.close()
+        if self._publishing:
+            await asyncio.gather(*self._publishing, return_exceptions=True)
+
+    def _on_notify(self, connection, pid, channel, payload: str):
+        sender, _, scopes = payload.partition(":")
+        if sender != str(os.getpid()):
+            self._bump(scopes.split(","))
+
+    def _on_lost(self, connection):
+        # Whatever was missed meanwhile is unknown; start over on the TTL
+        self._listener = None
+        self.entries.clear()
+
+    async def respond(self, request: Request, scopes: Tuple[str, ...],
+                      build: Callable[[Response], Awaitable]) -> Response:
+        # `build` queries and returns the content; headers it sets on the
+        # response it is given are cached along with the body
+        route = request.scope["route"].path
+        key = (request.url.path, tuple(sorted(request.query_params.multi_items())))
+        versions = tuple(self.versions.get(scope, 0) for scope in scopes)
+        entry = self.entries.get(key)
+        if entry is None or entry.versions != versions or time.monotonic() - entry.stored_at >= self.ttl:
+            metrics.RESPONSE_CACHE.inc(route, "miss")
+            scratch = Response()
+            content = await build(scratch)
+            body = json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False,
+                              separators=(",", ":")).encode("utf-8")
+            headers = {k: v for k, v in scratch.headers.items() if k not in ("content-length", "content-type")}
+            # Versions from before the build: an invalidation racing it
+            # leaves the entry already stale
+            entry = _Entry(versions, time.monotonic(), f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"',
+                           body, headers)
+            self.entries[key] = entry
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        else:
+            metrics.RESPONSE_CACHE.inc(route, "hit")
+        self.entries.move_to_end(key)
+        headers = {**entry.headers, "ETag": entry.etag, "Cache-Control": CACHE_CONTROL}
+        if _matches(request.headers.get("if-none-match"), entry.etag):
+            metrics.RESPONSE_CACHE.inc(route, "not_modified")
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+response_cache = ResponseCache()
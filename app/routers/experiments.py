@@ -0,0 +1,73 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from app.db import get_session, get_read_session
+from app.experiments import ExperimentCreate, experiment_runner, plan_runs
+from app.models import Experiment
+from pydantic import BaseModel
+from typing import List, Optional
+from datetime import datetime
+
+router = APIRouter(prefix="/experiments", tags=["experiments"])
+
+class ExperimentSummary(BaseModel):
+    id: int
+    name: Optional[str]
+    status: str
+    runs_total: int
+    runs_done: int
+    created_at: Optional[datetime]
+    finished_at: Optional[datetime]
+    class Config:
+        orm_mode = True
+
+class ExperimentOut(ExperimentSummary):
+    config: dict
+    # {"table": one row per variant, "runs": one row per run} once
+    # completed, {"error": ...} if a run failed
+    results: Optional[dict]
+
+@router.get("/", response_model=List[ExperimentSummary])
+async def list_experiments(session: AsyncSession = Depends(get_read_session)):
+    result = await session.execute(select(Experiment).order_by(Experiment.id))
+    return result.scalars().all()
+
+@router.get("/{experiment_id}", response_model=ExperimentOut)
+async def get_experiment(experiment_id: int, session: AsyncSession = Depends(get_session)):
+    experiment = await session.get(Experiment, experiment_id)
+    if not experiment:
+        raise HTTPException(status_code=404, detail="Experiment not found")
+    return experiment
+
+@router.post("/", response_model=ExperimentOut)
+async def create_experiment(request: ExperimentCreate, session: AsyncSession = Depends(get_session)):
+    # Runs every variant of the grid headless in worker processes, in the
+    # background; poll GET /experiments/{id} for progress and the table
+    try:
+        runs = await plan_runs(session, request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    experiment = Experiment(
+        name=request.name,
+        status='running',
+        config=request.dict() | {"start_time": runs[0]["start_time"]},
+        runs_total=len(runs),
+        runs_done=0,
+        created_at=datetime.utcnow(),
+    )
+    session.add(experiment)
+    await session.commit()
+    await session.refresh(experiment)
+    experiment_runner.start(experiment.id, runs)
+    return experiment
+
+@router.delete("/{experiment_id}")
+async def delete_experiment(experiment_id: int, session: AsyncSession = Depends(get_session)):
+    # Cancels it first if it is still running here
+    experiment = await session.get(Experiment, experiment_id)
+    if not experiment:
+        raise HTTPException(status_code=404, detail="Experiment not found")
+    await experiment_runner.cancel(experiment_id)
+    await session.delete(experiment)
+    await session.commit()
+    return {"ok": True}
@@ -1,9 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
+from fastapi import APIRouter, Depends, HTTPException, Body, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import update, delete
+from sqlalchemy import update, delete, insert
+from app.bulk import bulk_insert, parse_rows
 from app.db import get_session
-from app.models import Forklift, OperationLog
+from app.models import Forklift, OperationLog, LocationList
+from app.persistence import chunked
+from app.response_cache import FORKLIFTS, response_cache
+from app.simulation_engine import simulation_engine
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
@@ -29,12 +33,21 @@ class ForkliftOut(ForkliftBase):
         orm_mode = True
 
 @router.get("/", response_model=List[ForkliftOut])
-async def list_forklifts(status: Optional[str] = None, session: AsyncSession = Depends(get_session)):
-    query = select(Forklift)
-    if status:
-        query = query.where(Forklift.status == status)
-    result = await session.execute(query)
-    return result.scalars().all()
+async def list_forklifts(request: Request, status: Optional[str] = None, session: AsyncSession = Depends(get_session)):
+    async def build(response):
+        query = select(Forklift)
+        if status:
+            query = query.where(Forklift.status == status)
+        result = await session.execute(query)
+        return [
+            {
+                "name": f.name,
+                "status": f.status,
+                "location_id": f.location_id,
+                "id": f.id
+            } for f in result.scalars().all()
+        ]
+    return await response_cache.respond(request, (FORKLIFTS,), build)
 
 @router.get("/{forklift_id}", response_model=ForkliftOut)
 async def get_forklift(forklift_id: int, session: AsyncSession = Depends(get_session)):
@@ -49,8 +62,16 @@ async def create_forklift(forklift: ForkliftCreate, session: AsyncSession = Depe
     session.add(db_forklift)
     await session.commit()
     await session.refresh(db_forklift)
+    response_cache.invalidate(FORKLIFTS)
     return db_forklift
 
+@router.post("/bulk")
+async def create_forklifts_bulk(request: Request, session: AsyncSession = Depends(get_session)):
+    # JSON array, NDJSON or CSV body; invalid rows are reported, not fatal
+    result = await bulk_insert(session, Forklift, ForkliftCreate, await parse_rows(request))
+    response_cache.invalidate(FORKLIFTS)
+    return result
+
 @router.put("/{forklift_id}", response_model=ForkliftOut)
 async def update_forklift(forklift_id: int, forklift: ForkliftUpdate, session: AsyncSession = Depends(get_session)):
     db_forklift = await session.get(Forklift, forklift_id)
@@ -60,6 +81,8 @@ async def update_forklift(forklift_id: int, forklift: ForkliftUpdate, session: A
         setattr(db_forklift, field, value)
     await session.commit()
     await session.refresh(db_forklift)
+    simulation_engine.notify_forklift_changed(forklift_id)
+    response_cache.invalidate(FORKLIFTS)
     return db_forklift
 
 @router.delete("/{forklift_id}")
@@ -69,6 +92,8 @@ async def delete_forklift(forklift_id: int, session: AsyncSession = Depends(get_
         raise HTTPException(status_code=404, detail="Forklift not found")
     await session.delete(db_forklift)
     await session.commit()
+    simulation_engine.notify_forklift_deleted(forklift_id)
+    response_cache.invalidate(FORKLIFTS)
     return {"ok": True}
 
 @router.post("/{forklift_id}/block")
@@ -84,6 +109,8 @@ async def block_forklift(forklift_id: int, session: AsyncSession = Depends(get_s
         details=f"Forklift {forklift.id} blocked"
     ))
     await session.commit()
+    simulation_engine.notify_forklift_status(forklift_id, "blocked")
+    response_cache.invalidate(FORKLIFTS)
     return {"message": f"Forklift {forklift_id} blocked."}
 
 @router.post("/{forklift_id}/unblock")
@@ -99,6 +126,8 @@ async def unblock_forklift(forklift_id: int, session: AsyncSession = Depends(get
         details=f"Forklift {forklift.id} unblocked"
     ))
     await session.commit()
+    simulation_engine.notify_forklift_status(forklift_id, "available")
+    response_cache.invalidate(FORKLIFTS)
     return {"message": f"Forklift {forklift_id} unblocked."}
 
 class ForkliftStatusUpdate(BaseModel):
@@ -118,13 +147,84 @@ async def update_forklift_status(forklift_id: int, status_update: ForkliftStatus
         details=f"Forklift {forklift.id} status changed from {old_status} to {status_update.status}"
     ))
     await session.commit()
+    simulation_engine.notify_forklift_status(forklift_id, status_update.status)
+    response_cache.invalidate(FORKLIFTS)
     return {"message": f"Forklift {forklift_id} status updated to {status_update.status}."}
 
+class ForkliftSelection(BaseModel):
+    # Explicit ids and/or a zone (a rectangle of cells on one map),
+    # optionally narrowed to forklifts currently in a given status
+    ids: Optional[List[int]] = None
+    map_id: Optional[int] = None
+    x_min: Optional[int] = None
+    x_max: Optional[int] = None
+    y_min: Optional[int] = None
+    y_max: Optional[int] = None
+    from_status: Optional[str] = None
+
+class ForkliftBulkStatus(ForkliftSelection):
+    status: str
+
+def selection_filters(selection: ForkliftSelection) -> list:
+    filters = []
+    if selection.ids is not None:
+        filters.append(Forklift.id.in_(selection.ids))
+    if selection.map_id is not None:
+        zone = select(LocationList.id).where(LocationList.mapId == selection.map_id)
+        if selection.x_min is not None:
+            zone = zone.where(LocationList.displayX >= selection.x_min)
+        if selection.x_max is not None:
+            zone = zone.where(LocationList.displayX <= selection.x_max)
+        if selection.y_min is not None:
+            zone = zone.where(LocationList.displayY >= selection.y_min)
+        if selection.y_max is not None:
+            zone = zone.where(LocationList.displayY <= selection.y_max)
+        filters.append(Forklift.location_id.in_(zone))
+    if not filters:
+        raise HTTPException(status_code=400, detail="Select forklifts by ids and/or map_id")
+    if selection.from_status is not None:
+        filters.append(Forklift.status == selection.from_status)
+    return filters
+
+async def set_forklift_statuses(session: AsyncSession, filters: list, status: str, event: str) -> List[int]:
+    # One UPDATE ... RETURNING for the whole set, then one multi-row insert
+    # of the matching log entries
+    result = await session.execute(
+        update(Forklift).where(*filters).values(status=status).returning(Forklift.id),
+        execution_options={"synchronize_session": False},
+    )
+    forklift_ids = result.scalars().all()
+    now = datetime.utcnow()
+    for chunk in chunked(forklift_ids):
+        await session.execute(insert(OperationLog).values([{
+            "timestamp": now,
+            "forklift_id": forklift_id,
+            "event": event,
+            "details": f"Forklift {forklift_id} status changed to {status}",
+        } for forklift_id in chunk]))
+    await session.commit()
+    for forklift_id in forklift_ids:
+        simulation_engine.notify_forklift_status(forklift_id, status)
+    response_cache.invalidate(FORKLIFTS)
+    return forklift_ids
+
+@router.post("/block")
+async def block_forklifts(selection: ForkliftSelection, session: AsyncSession = Depends(get_session)):
+    forklift_ids = await set_forklift_statuses(session, selection_filters(selection), "blocked", "block")
+    return {"updated": len(forklift_ids), "ids": forklift_ids}
+
+@router.post("/unblock")
+async def unblock_forklifts(selection: ForkliftSelection, session: AsyncSession = Depends(get_session)):
+    forklift_ids = await set_forklift_statuses(session, selection_filters(selection), "available", "unblock")
+    return {"updated": len(forklift_ids), "ids": forklift_ids}
+
+@router.patch("/status")
+async def update_forklift_statuses(status_update: ForkliftBulkStatus, session: AsyncSession = Depends(get_session)):
+    forklift_ids = await set_forklift_statuses(session, selection_filters(status_update), status_update.status, "status_update")
+    return {"updated": len(forklift_ids), "ids": forklift_ids}
+
 @router.post("/reset-status")
 async def reset_all_forklift_status(session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(Forklift))
-    forklifts = result.scalars().all()
-    for forklift in forklifts:
-        forklift.status = 'available'
-    await session.commit()
-    return {"message": "All forklift statuses reset to available"} 
\ No newline at end of file
+    # Forklifts already available are left alone and not logged
+    forklift_ids = await set_forklift_statuses(session, [Forklift.status != 'available'], 'available', "status_update")
+    return {"message": "All forklift statuses reset to available", "updated": len(forklift_ids)} 
\ No newline at end of file
@@ -1,15 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from app.db import get_session
+from app.db import get_session, get_read_session
 from app.models import KPI
+from app.pagination import paginate, set_next_cursor
+from app.simulation_engine import simulation_engine
 from pydantic import BaseModel
 from typing import List, Optional
+from datetime import datetime
 
 router = APIRouter(prefix="/kpis", tags=["kpis"])
 
 class KPIBase(BaseModel):
-    timestamp: Optional[str]
+    timestamp: Optional[datetime]
     execution_time: Optional[float]
     block_time: Optional[float]
 
@@ -17,7 +20,7 @@ class KPICreate(KPIBase):
     pass
 
 class KPIUpdate(BaseModel):
-    timestamp: Optional[str]
+    timestamp: Optional[datetime]
     execution_time: Optional[float]
     block_time: Optional[float]
 
@@ -27,9 +30,34 @@ class KPIOut(KPIBase):
         orm_mode = True
 
 @router.get("/", response_model=List[KPIOut])
-async def list_kpis(session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(KPI))
-    return result.scalars().all()
+async def list_kpis(
+    response: Response,
+    simulation_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    session: AsyncSession = Depends(get_read_session),
+):
+    query = select(KPI)
+    if simulation_id is not None:
+        query = query.where(KPI.simulation_id == simulation_id)
+    if since:
+        query = query.where(KPI.timestamp >= since)
+    if until:
+        query = query.where(KPI.timestamp < until)
+    result = await session.execute(paginate(query, KPI, after_id, limit))
+    kpis = result.scalars().all()
+    set_next_cursor(response, kpis, limit)
+    return kpis
+
+@router.get("/summary")
+async def kpi_summary(simulation_id: int):
+    # Live counters of a running simulation, served from memory
+    kpis = simulation_engine.status(simulation_id).get("kpis")
+    if kpis is None:
+        raise HTTPException(status_code=404, detail="Simulation not running")
+    return kpis
 
 @router.get("/{kpi_id}", response_model=KPIOut)
 async def get_kpi(kpi_id: int, session: AsyncSession = Depends(get_session)):
@@ -1,15 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from app.db import get_session
+from app.db import get_session, get_read_session
 from app.models import OperationLog
+from app.pagination import paginate, set_next_cursor
 from pydantic import BaseModel
 from typing import List, Optional
+from datetime import datetime
 
 router = APIRouter(prefix="/operation_logs", tags=["operation_logs"])
 
 class OperationLogBase(BaseModel):
-    timestamp: Optional[str]
+    timestamp: Optional[datetime]
     forklift_id: Optional[int]
     event: str
     details: Optional[str]
@@ -18,7 +20,7 @@ class OperationLogCreate(OperationLogBase):
     pass
 
 class OperationLogUpdate(BaseModel):
-    timestamp: Optional[str]
+    timestamp: Optional[datetime]
     forklift_id: Optional[int]
     event: Optional[str]
     details: Optional[str]
@@ -29,9 +31,32 @@ class OperationLogOut(OperationLogBase):
         orm_mode = True
 
 @router.get("/", response_model=List[OperationLogOut])
-async def list_operation_logs(session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(OperationLog))
-    return result.scalars().all()
+async def list_operation_logs(
+    response: Response,
+    simulation_id: Optional[int] = None,
+    forklift_id: Optional[int] = None,
+    event: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    session: AsyncSession = Depends(get_read_session),
+):
+    query = select(OperationLog)
+    if simulation_id is not None:
+        query = query.where(OperationLog.simulation_id == simulation_id)
+    if forklift_id is not None:
+        query = query.where(OperationLog.forklift_id == forklift_id)
+    if event:
+        query = query.where(OperationLog.event == event)
+    if since:
+        query = query.where(OperationLog.timestamp >= since)
+    if until:
+        query = query.where(OperationLog.timestamp < until)
+    result = await session.execute(paginate(query, OperationLog, after_id, limit))
+    logs = result.scalars().all()
+    set_next_cursor(response, logs, limit)
+    return logs
 
 @router.get("/{log_id}", response_model=OperationLogOut)
 async def get_operation_log(log_id: int, session: AsyncSession = Depends(get_session)):
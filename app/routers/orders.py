@@ -1,10 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from app.db import get_session
-from app.models import Order
+from sqlalchemy import delete, insert, or_, update
+from app.bulk import bulk_insert, parse_rows
+from app.db import get_session, get_read_session
+from app.models import Order, DispatchPlan, OperationLog, SimulationOrder
+from app.pagination import paginate, set_next_cursor
+from app.response_cache import ORDERS, response_cache
+from app.simulation_engine import simulation_engine
 from pydantic import BaseModel
 from typing import List, Optional
+from datetime import datetime
 
 router = APIRouter(prefix="/orders", tags=["orders"])
 
@@ -27,9 +33,23 @@ class OrderOut(OrderBase):
         orm_mode = True
 
 @router.get("/", response_model=List[OrderOut])
-async def list_orders(session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(Order))
-    return result.scalars().all()
+async def list_orders(
+    response: Response,
+    status: Optional[str] = None,
+    simulation_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    session: AsyncSession = Depends(get_read_session),
+):
+    query = select(Order)
+    if status:
+        query = query.where(Order.status == status)
+    if simulation_id is not None:
+        query = query.where(planned_in(simulation_id))
+    result = await session.execute(paginate(query, Order, after_id, limit))
+    orders = result.scalars().all()
+    set_next_cursor(response, orders, limit)
+    return orders
 
 @router.get("/{order_id}", response_model=OrderOut)
 async def get_order(order_id: int, session: AsyncSession = Depends(get_session)):
@@ -44,8 +64,16 @@ async def create_order(order: OrderCreate, session: AsyncSession = Depends(get_s
     session.add(db_order)
     await session.commit()
     await session.refresh(db_order)
+    response_cache.invalidate(ORDERS)
     return db_order
 
+@router.post("/bulk")
+async def create_orders_bulk(request: Request, session: AsyncSession = Depends(get_session)):
+    # JSON array, NDJSON or CSV body; invalid rows are reported, not fatal
+    result = await bulk_insert(session, Order, OrderCreate, await parse_rows(request))
+    response_cache.invalidate(ORDERS)
+    return result
+
 @router.put("/{order_id}", response_model=OrderOut)
 async def update_order(order_id: int, order: OrderUpdate, session: AsyncSession = Depends(get_session)):
     db_order = await session.get(Order, order_id)
@@ -55,6 +83,8 @@ async def update_order(order_id: int, order: OrderUpdate, session: AsyncSession
         setattr(db_order, field, value)
     await session.commit()
     await session.refresh(db_order)
+    simulation_engine.notify_order_changed(order_id)
+    response_cache.invalidate(ORDERS)
     return db_order
 
 @router.patch("/{order_id}/status")
@@ -63,7 +93,11 @@ async def update_order_status(order_id: int, status: str, session: AsyncSession
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     order.status = status
+    # An edit overrides whatever status the simulations left it in
+    await session.execute(delete(SimulationOrder).where(SimulationOrder.order_id == order_id))
     await session.commit()
+    simulation_engine.notify_order_status(order_id, status)
+    response_cache.invalidate(ORDERS)
     return {"message": f"Order {order_id} status updated to {status}"}
 
 @router.delete("/{order_id}")
@@ -73,13 +107,81 @@ async def delete_order(order_id: int, session: AsyncSession = Depends(get_sessio
         raise HTTPException(status_code=404, detail="Order not found")
     await session.delete(db_order)
     await session.commit()
+    simulation_engine.notify_order_deleted(order_id)
+    response_cache.invalidate(ORDERS)
     return {"ok": True}
 
-@router.post("/reset-status")
-async def reset_all_order_status(session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(Order))
-    orders = result.scalars().all()
-    for order in orders:
-        order.status = 'pending'
+class OrderBulkStatus(BaseModel):
+    # Every given predicate must match; at least one is required
+    status: str
+    ids: Optional[List[int]] = None
+    from_status: Optional[str] = None
+    simulation_id: Optional[int] = None
+    pickup_location_id: Optional[int] = None
+    delivery_location_id: Optional[int] = None
+
+def planned_in(simulation_id: int):
+    return Order.id.in_(
+        select(DispatchPlan.order_id).where(DispatchPlan.simulation_id == simulation_id)
+    )
+
+async def set_order_statuses(session: AsyncSession, filters: list, status: str, simulation_id: Optional[int] = None) -> List[int]:
+    # One UPDATE ... RETURNING for the whole set plus a single log entry
+    result = await session.execute(
+        update(Order).where(*filters).values(status=status).returning(Order.id),
+        execution_options={"synchronize_session": False},
+    )
+    order_ids = result.scalars().all()
+    # An edit overrides whatever status the simulations left them in
+    dropped = delete(SimulationOrder).where(SimulationOrder.order_id.in_(order_ids))
+    if simulation_id is not None:
+        dropped = dropped.where(SimulationOrder.simulation_id == simulation_id)
+    await session.execute(dropped)
+    await session.execute(insert(OperationLog).values(
+        timestamp=datetime.utcnow(),
+        event="order_status_update",
+        details=f"{len(order_ids)} orders set to {status}",
+        simulation_id=simulation_id,
+    ))
     await session.commit()
-    return {"message": "All order statuses reset to pending"} 
\ No newline at end of file
+    response_cache.invalidate(ORDERS)
+    return order_ids
+
+@router.patch("/status")
+async def update_order_statuses(status_update: OrderBulkStatus, session: AsyncSession = Depends(get_session)):
+    filters = []
+    if status_update.ids is not None:
+        filters.append(Order.id.in_(status_update.ids))
+    if status_update.from_status is not None:
+        filters.append(Order.status == status_update.from_status)
+    if status_update.simulation_id is not None:
+        filters.append(planned_in(status_update.simulation_id))
+    if status_update.pickup_location_id is not None:
+        filters.append(Order.pickup_location_id == status_update.pickup_location_id)
+    if status_update.delivery_location_id is not None:
+        filters.append(Order.delivery_location_id == status_update.delivery_location_id)
+    if not filters:
+        raise HTTPException(status_code=400, detail="At least one predicate is required")
+    order_ids = await set_order_statuses(session, filters, status_update.status, status_update.simulation_id)
+    for order_id in order_ids:
+        simulation_engine.notify_order_status(order_id, status_update.status)
+    return {"updated": len(order_ids), "ids": order_ids}
+
+@router.post("/reset-status")
+async def reset_all_order_status(simulation_id: Optional[int] = None, session: AsyncSession = Depends(get_session)):
+    # With simulation_id, only the orders planned in that simulation
+    # Runs only change the simulations' own copies of the statuses, so
+    # those count too
+    own = select(SimulationOrder.order_id).where(SimulationOrder.status != 'pending')
+    filters = []
+    if simulation_id is not None:
+        own = own.where(SimulationOrder.simulation_id == simulation_id)
+        filters.append(planned_in(simulation_id))
+    filters.append(or_(Order.status != 'pending', Order.id.in_(own)))
+    order_ids = await set_order_statuses(session, filters, 'pending', simulation_id)
+    if simulation_id is None:
+        simulation_engine.notify_all_order_status('pending')
+    else:
+        for order_id in order_ids:
+            simulation_engine.notify_order_status(order_id, 'pending')
+    return {"message": "All order statuses reset to pending", "updated": len(order_ids)} 
\ No newline at end of file
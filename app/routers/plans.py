@@ -1,8 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy import and_, insert, update, func, literal, cast, String
+import numpy as np
+from app.bulk import bulk_insert, parse_rows
 from app.db import get_session
-from app.models import DispatchPlan, Order, Forklift
+from app.dispatch import HANDLING_STEPS, assign_orders
+from app.distances import distance_index
+from app.models import DispatchPlan, Order, Forklift, LocationList, Simulation, SimulationOrder, OperationLog
+from app.pagination import paginate, set_next_cursor
+from app.persistence import chunked
+from app.response_cache import FORKLIFTS, ORDERS, PLANS, response_cache
+from app.sim_clock import TICK_SECONDS
+from app.simulation_engine import simulation_engine
+from app.trajectories import trajectory_index, epoch_seconds
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime, timedelta
@@ -14,6 +25,7 @@ class PlanBase(BaseModel):
     order_id: Optional[int]
     start_time: Optional[str]
     end_time: Optional[str]
+    simulation_id: Optional[int]
 
 class PlanCreate(PlanBase):
     pass
@@ -23,6 +35,12 @@ class PlanUpdate(BaseModel):
     order_id: Optional[int]
     start_time: Optional[str]
     end_time: Optional[str]
+    simulation_id: Optional[int]
+
+class PlanBulk(PlanBase):
+    # Bulk rows bypass the ORM, so times are parsed up front
+    start_time: Optional[datetime]
+    end_time: Optional[datetime]
 
 class PlanOut(PlanBase):
     id: int
@@ -42,28 +60,176 @@ def to_dict(obj):
 #     return result.scalars().all()
 
 @router.get("/all", response_model=List[dict])
-async def list_plans(session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(DispatchPlan))
-    plans = result.scalars().all()
-    # Fetch related orders and forklifts
-    order_ids = [p.order_id for p in plans]
-    forklift_ids = [p.forklift_id for p in plans]
-    orders = (await session.execute(select(Order).where(Order.id.in_(order_ids)))).scalars().all()
-    forklifts = (await session.execute(select(Forklift).where(Forklift.id.in_(forklift_ids)))).scalars().all()
-    order_map = {o.id: o for o in orders}
-    forklift_map = {f.id: f for f in forklifts}
-    return [
-        {
-            "id": p.id,
-            "forklift_id": p.forklift_id,
-            "order_id": p.order_id,
-            "start_time": p.start_time,
-            "end_time": p.end_time,
-            "simulation_id": p.simulation_id,
-            "order": to_dict(order_map.get(p.order_id)),
-            "forklift": to_dict(forklift_map.get(p.forklift_id))
-        } for p in plans
-    ]
+async def list_plans(
+    request: Request,
+    simulation_id: Optional[int] = None,
+    forklift_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    session: AsyncSession = Depends(get_session),
+):
+    async def build(response):
+        query = select(DispatchPlan)
+        if simulation_id is not None:
+            query = query.where(DispatchPlan.simulation_id == simulation_id)
+        if forklift_id is not None:
+            query = query.where(DispatchPlan.forklift_id == forklift_id)
+        if since:
+            query = query.where(DispatchPlan.start_time >= since)
+        if until:
+            query = query.where(DispatchPlan.start_time < until)
+        result = await session.execute(paginate(query, DispatchPlan, after_id, limit))
+        plans = result.scalars().all()
+        set_next_cursor(response, plans, limit)
+        # Fetch related orders and forklifts
+        order_ids = [p.order_id for p in plans]
+        forklift_ids = [p.forklift_id for p in plans]
+        orders = (await session.execute(select(Order).where(Order.id.in_(order_ids)))).scalars().all()
+        forklifts = (await session.execute(select(Forklift).where(Forklift.id.in_(forklift_ids)))).scalars().all()
+        order_map = {o.id: o for o in orders}
+        forklift_map = {f.id: f for f in forklifts}
+        return [
+            {
+                "id": p.id,
+                "forklift_id": p.forklift_id,
+                "order_id": p.order_id,
+                "start_time": p.start_time,
+                "end_time": p.end_time,
+                "simulation_id": p.simulation_id,
+                "order": to_dict(order_map.get(p.order_id)),
+                "forklift": to_dict(forklift_map.get(p.forklift_id))
+            } for p in plans
+        ]
+    # Running simulations write plans too, see WriteBehindPersister.flush
+    return await response_cache.respond(request, (PLANS, ORDERS, FORKLIFTS), build)
+
+# Most time samples a single positions request may ask for
+MAX_POSITION_SAMPLES = 10000
+
+@router.get("/positions")
+async def plan_positions(
+    simulation_id: int,
+    at: Optional[datetime] = None,
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+    step: float = 1.0,
+    session: AsyncSession = Depends(get_session),
+):
+    # Interpolated forklift positions in one simulation's plans at one time,
+    # or sampled every `step` seconds over [from, to]. x and y are indexed
+    # [forklift][sample].
+    if at is not None:
+        times = np.array([epoch_seconds(at)])
+    elif from_ is not None and to is not None:
+        if step <= 0:
+            raise HTTPException(status_code=400, detail="step must be positive")
+        start, stop = epoch_seconds(from_), epoch_seconds(to)
+        if stop < start or (stop - start) / step >= MAX_POSITION_SAMPLES:
+            raise HTTPException(status_code=400, detail=f"Range must be ordered and at most {MAX_POSITION_SAMPLES} samples")
+        times = np.arange(start, stop + step / 2, step)
+    else:
+        raise HTTPException(status_code=400, detail="Pass either at, or from and to")
+    trajectories = await trajectory_index.get(session, simulation_id)
+    xs, ys = trajectories.positions(times)
+    if at is not None:
+        return {"forklift_ids": trajectories.forklift_ids, "t": times[0], "x": xs[:, 0].tolist(), "y": ys[:, 0].tolist()}
+    return {"forklift_ids": trajectories.forklift_ids, "t": times.tolist(), "x": xs.tolist(), "y": ys.tolist()}
+
+@router.post("/optimize")
+async def optimize_plans(simulation_id: int, session: AsyncSession = Depends(get_session)):
+    if not await session.get(Simulation, simulation_id):
+        raise HTTPException(status_code=404, detail="Simulation not found")
+    planned = select(DispatchPlan.order_id).where(
+        DispatchPlan.simulation_id == simulation_id, DispatchPlan.order_id.isnot(None)
+    )
+    orders = (await session.execute(
+        select(Order).where(Order.status == 'pending', Order.id.notin_(planned)).order_by(Order.id)
+    )).scalars().all()
+    forklifts = (await session.execute(
+        select(Forklift).where(Forklift.status == 'available').order_by(Forklift.id)
+    )).scalars().all()
+    # Plans each forklift already has in this simulation, for orders the
+    # simulation has not finished, in the order the engine works them
+    queued = (await session.execute(
+        select(DispatchPlan.forklift_id, DispatchPlan.start_time, DispatchPlan.id,
+               Order.pickup_location_id, Order.delivery_location_id)
+        .join(Order, Order.id == DispatchPlan.order_id)
+        .outerjoin(SimulationOrder, and_(SimulationOrder.simulation_id == simulation_id,
+                                         SimulationOrder.order_id == Order.id))
+        .where(DispatchPlan.simulation_id == simulation_id,
+               DispatchPlan.forklift_id.in_([f.id for f in forklifts]),
+               func.coalesce(SimulationOrder.status, Order.status) != 'done')
+    )).all()
+    queues = {}
+    for plan in sorted(queued, key=lambda p: (p.start_time is None, p.start_time or datetime.min, p.id)):
+        queues.setdefault(plan.forklift_id, []).append(plan)
+    location_ids = ({f.location_id for f in forklifts} | {o.pickup_location_id for o in orders}
+                    | {p.pickup_location_id for p in queued} | {p.delivery_location_id for p in queued})
+    location_maps = dict((await session.execute(
+        select(LocationList.id, LocationList.mapId).where(LocationList.id.in_(location_ids))
+    )).all())
+
+    # Where and when, in steps from now, each forklift's queue ends. A leg
+    # with no path on its map counts as no travel, as it has no route in
+    # the engine either.
+    now = datetime.utcnow()
+    matrices = {}
+    ends = {}
+    for f in forklifts:
+        at, free_at = f.location_id, 0.0
+        for plan in queues.get(f.id, ()):
+            if plan.start_time is not None:
+                free_at = max(free_at, (plan.start_time - now).total_seconds() / TICK_SECONDS)
+            for a, b in ((at, plan.pickup_location_id), (plan.pickup_location_id, plan.delivery_location_id)):
+                map_id = location_maps.get(b)
+                if map_id is not None and location_maps.get(a) == map_id:
+                    if map_id not in matrices:
+                        matrices[map_id] = await distance_index.get(session, map_id)
+                    free_at += matrices[map_id].distance(a, b) or 0
+            free_at += 2 * HANDLING_STEPS
+            at = plan.delivery_location_id
+        ends[f.id] = (at, free_at)
+
+    # Orders and forklifts are matched per map, orders by their pickup
+    rows = []
+    assigned = set()
+    for map_id in sorted({m for m in location_maps.values() if m is not None}):
+        matrix = matrices.get(map_id) or await distance_index.get(session, map_id)
+        fleet = [f for f in forklifts if ends[f.id][0] in matrix.index and location_maps.get(ends[f.id][0]) == map_id]
+        batch = [o for o in orders if o.pickup_location_id in matrix.index and o.delivery_location_id in matrix.index
+                 and location_maps.get(o.pickup_location_id) == map_id]
+        if not fleet or not batch:
+            continue
+        plans = assign_orders(
+            matrix.distances,
+            np.array([matrix.index[ends[f.id][0]] for f in fleet]),
+            np.array([matrix.index[o.pickup_location_id] for o in batch]),
+            np.array([matrix.index[o.delivery_location_id] for o in batch]),
+            np.array([ends[f.id][1] for f in fleet]),
+        )
+        for f, o, start, end in plans:
+            assigned.add(batch[o].id)
+            rows.append({
+                "forklift_id": fleet[f].id,
+                "order_id": batch[o].id,
+                "start_time": now + timedelta(seconds=start * TICK_SECONDS),
+                "end_time": now + timedelta(seconds=end * TICK_SECONDS),
+                "simulation_id": simulation_id,
+            })
+
+    plan_ids = []
+    for chunk in chunked(rows):
+        plan_ids += (await session.execute(insert(DispatchPlan).values(chunk).returning(DispatchPlan.id))).scalars().all()
+    await session.commit()
+    for plan_id in plan_ids:
+        simulation_engine.notify_plan_changed(plan_id)
+    response_cache.invalidate(PLANS)
+    return {
+        "created": len(plan_ids),
+        "unassigned": [o.id for o in orders if o.id not in assigned],
+    }
 
 @router.get("/{plan_id}", response_model=PlanOut)
 async def get_plan(plan_id: int, session: AsyncSession = Depends(get_session)):
@@ -78,8 +244,19 @@ async def create_plan(plan: PlanCreate, session: AsyncSession = Depends(get_sess
     session.add(db_plan)
     await session.commit()
     await session.refresh(db_plan)
+    simulation_engine.notify_plan_changed(db_plan.id)
+    response_cache.invalidate(PLANS)
     return db_plan
 
+@router.post("/bulk")
+async def create_plans_bulk(request: Request, session: AsyncSession = Depends(get_session)):
+    # JSON array, NDJSON or CSV body; invalid rows are reported, not fatal
+    result = await bulk_insert(session, DispatchPlan, PlanBulk, await parse_rows(request))
+    for plan_id in result["ids"]:
+        simulation_engine.notify_plan_changed(plan_id)
+    response_cache.invalidate(PLANS)
+    return result
+
 @router.put("/{plan_id}", response_model=PlanOut)
 async def update_plan(plan_id: int, plan: PlanUpdate, session: AsyncSession = Depends(get_session)):
     db_plan = await session.get(DispatchPlan, plan_id)
@@ -89,6 +266,8 @@ async def update_plan(plan_id: int, plan: PlanUpdate, session: AsyncSession = De
         setattr(db_plan, field, value)
     await session.commit()
     await session.refresh(db_plan)
+    simulation_engine.notify_plan_changed(plan_id)
+    response_cache.invalidate(PLANS)
     return db_plan
 
 @router.delete("/{plan_id}")
@@ -98,16 +277,49 @@ async def delete_plan(plan_id: int, session: AsyncSession = Depends(get_session)
         raise HTTPException(status_code=404, detail="Plan not found")
     await session.delete(db_plan)
     await session.commit()
+    simulation_engine.notify_plan_deleted(plan_id)
+    response_cache.invalidate(PLANS)
     return {"ok": True}
 
+# Each plan lasts this long after a reset
+PLAN_SLOT_SECONDS = 10
+
 @router.post("/reset_times")
-async def reset_plan_times(session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(DispatchPlan).order_by(DispatchPlan.id))
-    plans = result.scalars().all()
+async def reset_plan_times(simulation_id: Optional[int] = None, per_forklift: bool = False, session: AsyncSession = Depends(get_session)):
+    # Lays plans back to back from now in id order, in one UPDATE ... FROM
+    # over a row_number() window. per_forklift restarts the sequence for
+    # each forklift so that every forklift's plans start now.
     now = datetime.now()  # Use local time
-    interval = timedelta(seconds=10)  # Each plan lasts 10 seconds
-    for i, plan in enumerate(plans):
-        plan.start_time = now + i * interval
-        plan.end_time = now + (i + 1) * interval
+    order = func.row_number().over(
+        partition_by=DispatchPlan.forklift_id if per_forklift else None,
+        order_by=DispatchPlan.id,
+    )
+    slots = select(DispatchPlan.id.label("id"), (order - 1).label("slot"))
+    if simulation_id is not None:
+        slots = slots.where(DispatchPlan.simulation_id == simulation_id)
+    slots = slots.subquery()
+    if session.bind.dialect.name == "postgresql":
+        interval = literal(timedelta(seconds=PLAN_SLOT_SECONDS))
+        start = literal(now) + slots.c.slot * interval
+        end = literal(now) + (slots.c.slot + 1) * interval
+    else:
+        # SQLite has no interval type; shift the timestamp with datetime()
+        def start_at(slot):
+            return func.datetime(literal(now), "+" + cast(slot * PLAN_SLOT_SECONDS, String) + " seconds")
+        start, end = start_at(slots.c.slot), start_at(slots.c.slot + 1)
+    table = DispatchPlan.__table__
+    plan_ids = (await session.execute(
+        update(table).where(table.c.id == slots.c.id).values(start_time=start, end_time=end).returning(table.c.id)
+    )).scalars().all()
+    await session.execute(insert(OperationLog).values(
+        timestamp=datetime.utcnow(),
+        event="plan_times_reset",
+        details=f"{len(plan_ids)} plan times reset",
+        simulation_id=simulation_id,
+    ))
     await session.commit()
-    return {"message": "Plan times reset to start from now."} 
\ No newline at end of file
+    # Start times set the order running simulations work through plans in
+    for plan_id in plan_ids:
+        simulation_engine.notify_plan_changed(plan_id)
+    response_cache.invalidate(PLANS)
+    return {"message": "Plan times reset to start from now.", "updated": len(plan_ids)} 
\ No newline at end of file
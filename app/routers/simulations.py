@@ -1,9 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy import and_, func, or_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from app.db import get_session
-from app.models import Simulation
+from app.db import get_session, get_read_session
+from app.events import MODES
+from app.export import EXPORTERS, EXPORT_TABLES, MEDIA_TYPES
+from app.generator import GeneratorConfig, OrderStream, check_config
+from app.snapshots import fork_snapshot, latest_snapshot, list_snapshots
+from app.models import DispatchPlan, Forklift, LocationList, Order, OrderGenerator, Simulation, SimulationForklift, SimulationOrder
 from app.simulation_engine import simulation_engine
+from app.world_state import WorldState
+from datetime import datetime
 from pydantic import BaseModel
 from typing import List, Optional
 
@@ -30,7 +39,7 @@ class SimulationOut(SimulationBase):
         orm_mode = True
 
 @router.get("/", response_model=List[SimulationOut])
-async def list_simulations(session: AsyncSession = Depends(get_session)):
+async def list_simulations(session: AsyncSession = Depends(get_read_session)):
     result = await session.execute(select(Simulation))
     return result.scalars().all()
 
@@ -70,11 +79,208 @@ async def delete_simulation(simulation_id: int, session: AsyncSession = Depends(
     return {"ok": True}
 
 @router.post("/{simulation_id}/start")
-async def start_simulation(simulation_id: int, background_tasks: BackgroundTasks):
-    background_tasks.add_task(simulation_engine.start_simulation, simulation_id)
+async def start_simulation(simulation_id: int, background_tasks: BackgroundTasks, speed: float = 1.0, max_steps: Optional[int] = None, mode: str = "tick"):
+    # speed is simulated seconds per wall second; 0 runs headless, as fast as possible.
+    # mode=event jumps from event to event instead of stepping every tick
+    # (no congestion model), which makes long horizons cheap.
+    if speed < 0:
+        raise HTTPException(status_code=400, detail="speed must be >= 0")
+    if max_steps is not None and max_steps <= 0:
+        raise HTTPException(status_code=400, detail="max_steps must be positive")
+    if mode not in MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(MODES)}")
+    background_tasks.add_task(simulation_engine.start_simulation, simulation_id, speed, max_steps, False, mode)
     return {"message": f"Simulation {simulation_id} started."}
 
+@router.post("/{simulation_id}/resume")
+async def resume_simulation(simulation_id: int, background_tasks: BackgroundTasks, speed: float = 1.0, max_steps: Optional[int] = None, mode: Optional[str] = None, session: AsyncSession = Depends(get_session)):
+    # Carries on from the latest checkpoint; max_steps counts from step 0.
+    # The mode it was checkpointed in is kept unless one is given.
+    if speed < 0:
+        raise HTTPException(status_code=400, detail="speed must be >= 0")
+    if max_steps is not None and max_steps <= 0:
+        raise HTTPException(status_code=400, detail="max_steps must be positive")
+    if mode is not None and mode not in MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(MODES)}")
+    snapshot = await latest_snapshot(session, simulation_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="No snapshot to resume from")
+    background_tasks.add_task(simulation_engine.start_simulation, simulation_id, speed, max_steps, True, mode)
+    return {"message": f"Simulation {simulation_id} resumed from step {snapshot.step}."}
+
+@router.post("/{simulation_id}/checkpoint")
+async def checkpoint_simulation(simulation_id: int):
+    if not simulation_engine.request_checkpoint(simulation_id):
+        raise HTTPException(status_code=404, detail="Simulation not running")
+    return {"message": f"Checkpoint of simulation {simulation_id} requested."}
+
+@router.get("/{simulation_id}/snapshots")
+async def get_snapshots(simulation_id: int, session: AsyncSession = Depends(get_read_session)):
+    return await list_snapshots(session, simulation_id)
+
+@router.post("/{simulation_id}/fork", response_model=SimulationOut)
+async def fork_simulation(simulation_id: int, step: Optional[int] = None, name: Optional[str] = None, session: AsyncSession = Depends(get_session)):
+    # "What if" branch: a new simulation starting from the latest checkpoint
+    # at or before `step`, resumed separately. Run the source with
+    # max_steps=N first to branch at exactly step N.
+    source = await session.get(Simulation, simulation_id)
+    if not source:
+        raise HTTPException(status_code=404, detail="Simulation not found")
+    forked = await fork_snapshot(session, source, step, name)
+    if forked is None:
+        raise HTTPException(status_code=404, detail="No snapshot to fork from")
+    return forked[0]
+
+@router.put("/{simulation_id}/generator", response_model=GeneratorConfig)
+async def set_generator(simulation_id: int, config: GeneratorConfig, session: AsyncSession = Depends(get_session)):
+    # Streams generated orders into the simulation as it runs, see
+    # app/generator.py. Takes effect the next time it starts or resumes.
+    if not await session.get(Simulation, simulation_id):
+        raise HTTPException(status_code=404, detail="Simulation not found")
+    problem = check_config(config)
+    if problem is None:
+        # Resolve the locations and forklifts once, as a run would
+        try:
+            await OrderStream(simulation_id, config, datetime.utcnow(), 1.0).load(session, WorldState(simulation_id))
+        except ValueError as e:
+            problem = str(e)
+    if problem is not None:
+        raise HTTPException(status_code=400, detail=problem)
+    generator = await session.get(OrderGenerator, simulation_id)
+    if generator is None:
+        generator = OrderGenerator(simulation_id=simulation_id)
+        session.add(generator)
+    generator.config = config.dict()
+    generator.updated_at = datetime.utcnow()
+    await session.commit()
+    return config
+
+@router.get("/{simulation_id}/generator", response_model=GeneratorConfig)
+async def get_generator(simulation_id: int, session: AsyncSession = Depends(get_session)):
+    generator = await session.get(OrderGenerator, simulation_id)
+    if not generator:
+        raise HTTPException(status_code=404, detail="No order generator")
+    return generator.config
+
+@router.delete("/{simulation_id}/generator")
+async def delete_generator(simulation_id: int, session: AsyncSession = Depends(get_session)):
+    generator = await session.get(OrderGenerator, simulation_id)
+    if not generator:
+        raise HTTPException(status_code=404, detail="No order generator")
+    await session.delete(generator)
+    await session.commit()
+    return {"ok": True}
+
+@router.get("/{simulation_id}/state")
+async def simulation_state(simulation_id: int, session: AsyncSession = Depends(get_read_session)):
+    # Where this simulation has its forklifts and orders, as last flushed;
+    # the forklifts and orders endpoints show the master rows, which runs
+    # never write to. Generated orders are not rows and only show up in
+    # the live stream and the operation log.
+    if not await session.get(Simulation, simulation_id):
+        raise HTTPException(status_code=404, detail="Simulation not found")
+    own = and_(SimulationForklift.simulation_id == simulation_id,
+               SimulationForklift.forklift_id == Forklift.id,
+               SimulationForklift.location_id == Forklift.location_id)
+    forklifts = (await session.execute(
+        select(Forklift.id, Forklift.status, Forklift.location_id,
+               func.coalesce(SimulationForklift.x, LocationList.displayX),
+               func.coalesce(SimulationForklift.y, LocationList.displayY))
+        .outerjoin(LocationList, LocationList.id == Forklift.location_id)
+        .outerjoin(SimulationForklift, own)
+        .order_by(Forklift.id)
+    )).all()
+    orders = (await session.execute(
+        select(Order.id, func.coalesce(SimulationOrder.status, Order.status))
+        .outerjoin(SimulationOrder, and_(SimulationOrder.simulation_id == simulation_id,
+                                         SimulationOrder.order_id == Order.id))
+        # A fork runs its parent's plans, so also the orders it has touched
+        .where(or_(Order.id.in_(select(DispatchPlan.order_id).where(DispatchPlan.simulation_id == simulation_id)),
+                   SimulationOrder.order_id.is_not(None)))
+        .order_by(Order.id)
+    )).all()
+    return {
+        "forklifts": [{"id": i, "status": status, "location_id": location_id, "x": x, "y": y}
+                      for i, status, location_id, x, y in forklifts],
+        "orders": [{"id": i, "status": status} for i, status in orders],
+    }
+
+@router.get("/{simulation_id}/status")
+async def simulation_status(simulation_id: int):
+    return simulation_engine.status(simulation_id)
+
+@router.post("/{simulation_id}/profile/start")
+async def start_profile(simulation_id: int):
+    # Only simulations running on the API's own event loop can be profiled
+    if not hasattr(simulation_engine, "start_profile"):
+        raise HTTPException(status_code=501, detail="Profiling needs the in-process executor")
+    if not simulation_engine.start_profile(simulation_id):
+        raise HTTPException(status_code=404, detail="Simulation not running")
+    return {"message": f"Profiling simulation {simulation_id}."}
+
+@router.post("/{simulation_id}/profile/stop", response_class=PlainTextResponse)
+async def stop_profile(simulation_id: int, limit: int = 30):
+    if not hasattr(simulation_engine, "stop_profile"):
+        raise HTTPException(status_code=501, detail="Profiling needs the in-process executor")
+    stats = simulation_engine.stop_profile(simulation_id, limit)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Simulation not being profiled")
+    return stats
+
 @router.post("/{simulation_id}/stop")
 async def stop_simulation(simulation_id: int, background_tasks: BackgroundTasks):
     background_tasks.add_task(simulation_engine.stop_simulation, simulation_id)
-    return {"message": f"Simulation {simulation_id} stopped."} 
\ No newline at end of file
+    return {"message": f"Simulation {simulation_id} stopped."}
+
+@router.get("/{simulation_id}/export")
+async def export_simulation(simulation_id: int, format: str = "ndjson", table: str = "operation_logs", session: AsyncSession = Depends(get_session)):
+    # Streams a whole history off a server-side cursor, batch by batch, so
+    # memory stays flat however long the simulation ran
+    if format not in EXPORTERS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORTERS)}")
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=400, detail=f"table must be one of {', '.join(EXPORT_TABLES)}")
+    if format == "parquet":
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=501, detail="parquet export requires pyarrow")
+    if not await session.get(Simulation, simulation_id):
+        raise HTTPException(status_code=404, detail="Simulation not found")
+    filename = f"simulation_{simulation_id}_{table}.{format}"
+    return StreamingResponse(
+        EXPORTERS[format](table, simulation_id),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@router.websocket("/{simulation_id}/stream")
+async def stream_simulation(websocket: WebSocket, simulation_id: int):
+    # Pushes per-tick deltas: moved forklifts, status changes and new log
+    # events. A slow client gets everything that piled up coalesced into
+    # its next message instead of holding up the simulation.
+    await websocket.accept()
+    subscriber = simulation_engine.subscribe(simulation_id)
+
+    async def watch_disconnect():
+        # Between deltas nothing is sent, so a client going away is only
+        # noticed by reading; uvicorn's pings catch dead connections
+        try:
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+        finally:
+            subscriber.close()
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        while True:
+            message = await subscriber.next()
+            if message is None:
+                break
+            await websocket.send_json(message)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        subscriber.close()
+        watcher.cancel()
+        simulation_engine.unsubscribe(simulation_id, subscriber)
@@ -1,32 +1,79 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Body, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from typing import Optional
 from app.db import get_session
-from app.models import LocationList, MapList
+from app.models import LocationList, MapList, WarehouseMap
+from app.distances import distance_index
+from app.response_cache import LOCATIONS, MAPS, response_cache
+from app.routing import router as route_planner
+from app.simulation_engine import simulation_engine
 
 router = APIRouter(prefix="/warehouse", tags=["warehouse"])
 
 @router.get("/locations")
-async def list_locations(session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(LocationList))
-    locations = result.scalars().all()
-    return [
-        {
-            "id": loc.id,
-            "name": loc.name,
-            "mapId": loc.mapId,
-            "displayX": loc.displayX,
-            "displayY": loc.displayY
-        } for loc in locations
-    ]
+async def list_locations(request: Request, session: AsyncSession = Depends(get_session)):
+    async def build(response):
+        result = await session.execute(select(LocationList))
+        locations = result.scalars().all()
+        return [
+            {
+                "id": loc.id,
+                "name": loc.name,
+                "mapId": loc.mapId,
+                "displayX": loc.displayX,
+                "displayY": loc.displayY
+            } for loc in locations
+        ]
+    return await response_cache.respond(request, (LOCATIONS,), build)
 
 @router.get("/maps")
-async def list_maps(session: AsyncSession = Depends(get_session)):
-    result = await session.execute(select(MapList))
-    maps = result.scalars().all()
-    return [
-        {
-            "id": m.id,
-            "name": m.name
-        } for m in maps
-    ] 
\ No newline at end of file
+async def list_maps(request: Request, session: AsyncSession = Depends(get_session)):
+    async def build(response):
+        result = await session.execute(select(MapList))
+        maps = result.scalars().all()
+        return [
+            {
+                "id": m.id,
+                "name": m.name
+            } for m in maps
+        ]
+    return await response_cache.respond(request, (MAPS,), build)
+
+@router.put("/maps/{map_id}/layout")
+async def update_map_layout(map_id: int, layout: dict = Body(...), session: AsyncSession = Depends(get_session)):
+    warehouse_map = await session.get(WarehouseMap, map_id)
+    if not warehouse_map:
+        raise HTTPException(status_code=404, detail="Map not found")
+    warehouse_map.layout = layout
+    await session.commit()
+    simulation_engine.notify_map_changed(map_id)
+    return {"message": f"Layout of map {map_id} updated."}
+
+@router.get("/maps/{map_id}/route")
+async def get_route(map_id: int, from_location: int, to_location: int, session: AsyncSession = Depends(get_session)):
+    start = await session.get(LocationList, from_location)
+    goal = await session.get(LocationList, to_location)
+    if not start or not goal:
+        raise HTTPException(status_code=404, detail="Location not found")
+    await route_planner.load_maps(session, [map_id])
+    waypoints = route_planner.route(
+        map_id,
+        (start.displayX, start.displayY),
+        (goal.displayX, goal.displayY),
+        (from_location, to_location),
+    )
+    return {"from": [start.displayX, start.displayY], "waypoints": [list(w) for w in waypoints]}
+
+@router.get("/maps/{map_id}/distances")
+async def get_distances(map_id: int, from_location: Optional[int] = None, session: AsyncSession = Depends(get_session)):
+    # Distances in grid steps, -1 where no path exists
+    if not await session.get(MapList, map_id):
+        raise HTTPException(status_code=404, detail="Map not found")
+    matrix = await distance_index.get(session, map_id)
+    if from_location is not None:
+        i = matrix.index.get(from_location)
+        if i is None:
+            raise HTTPException(status_code=404, detail="Location not on this map")
+        return {"location_ids": matrix.location_ids.tolist(), "distances": matrix.distances[i].tolist()}
+    return {"location_ids": matrix.location_ids.tolist(), "distances": matrix.distances.tolist()}
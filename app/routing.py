@@ -0,0 +1,180 @@
+import heapq
+import os
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from app.models import WarehouseMap
+
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "100000"))
+
+Cell = Tuple[int, int]
+
+
+class Grid:
+    # Walkable grid built from WarehouseMap.layout. Accepted layout keys:
+    #   "width", "height"  bounds of the grid (optional, unbounded if absent)
+    #   "grid"             rows of strings or lists; '#', 'X', 1 or True mark
+    #                      a blocked cell, row index is y
+    #   "obstacles"        [x, y] cells or {"x", "y", "w", "h"} rectangles
+    # Cells outside the bounds are blocked. Start and goal cells are always
+    # walkable so that locations placed on racks stay reachable.
+
+    def __init__(self, blocked: Set[Cell], width: Optional[int] = None, height: Optional[int] = None):
+        self.blocked = blocked
+        self.width = width
+        self.height = height
+
+    @classmethod
+    def from_layout(cls, layout) -> Optional["Grid"]:
+        if not isinstance(layout, dict):
+            return None
+        blocked: Set[Cell] = set()
+        rows = layout.get("grid") or []
+        for y, row in enumerate(rows):
+            for x, cell in enumerate(row):
+                if cell in ('#', 'X', 'x', 1, True):
+                    blocked.add((x, y))
+        for obstacle in layout.get("obstacles") or []:
+            if isinstance(obstacle, dict):
+                x0, y0 = int(obstacle.get("x", 0)), int(obstacle.get("y", 0))
+                for dx in range(int(obstacle.get("w", 1))):
+                    for dy in range(int(obstacle.get("h", 1))):
+                        blocked.add((x0 + dx, y0 + dy))
+            else:
+                blocked.add((int(obstacle[0]), int(obstacle[1])))
+        width = layout.get("width") or (max((len(r) for r in rows), default=0) or None)
+        height = layout.get("height") or (len(rows) or None)
+        if not blocked and width is None and height is None:
+            return None
+        return cls(blocked, width, height)
+
+    def walkable(self, cell: Cell) -> bool:
+        x, y = cell
+        if x < 0 or y < 0:
+            return False
+        if self.width is not None and x >= self.width:
+            return False
+        if self.height is not None and y >= self.height:
+            return False
+        return cell not in self.blocked
+
+    def astar(self, start: Cell, goal: Cell, avoid: Set[Cell] = frozenset()) -> Optional[List[Cell]]:
+        # 4-connected A* with the Manhattan heuristic. Ties are broken by
+        # insertion order so a given layout always yields the same path.
+        # Cells in `avoid` are treated as blocked for this search only.
+        if start == goal:
+            return [start]
+        gx, gy = goal
+        open_heap = [(abs(gx - start[0]) + abs(gy - start[1]), 0, 0, start)]
+        came_from: Dict[Cell, Cell] = {}
+        cost = {start: 0}
+        counter = 1
+        while open_heap:
+            _, g, _, cell = heapq.heappop(open_heap)
+            if cell == goal:
+                path = [cell]
+                while cell in came_from:
+                    cell = came_from[cell]
+                    path.append(cell)
+                return path[::-1]
+            if g > cost[cell]:
+                continue
+            x, y = cell
+            for nxt in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+                if nxt != goal and (not self.walkable(nxt) or nxt in avoid):
+                    continue
+                ng = g + 1
+                if ng < cost.get(nxt, ng + 1):
+                    cost[nxt] = ng
+                    came_from[nxt] = cell
+                    h = abs(gx - nxt[0]) + abs(gy - nxt[1])
+                    heapq.heappush(open_heap, (ng + h, ng, counter, nxt))
+                    counter += 1
+        return None
+
+
+def corners(path: List[Cell]) -> List[Cell]:
+    # Collapse a cell path into the cells where it turns, plus the goal.
+    # Every leg between two corners is axis aligned.
+    if len(path) < 2:
+        return list(path[-1:])
+    waypoints = []
+    for prev, cell, nxt in zip(path, path[1:], path[2:]):
+        if (cell[0] - prev[0], cell[1] - prev[1]) != (nxt[0] - cell[0], nxt[1] - cell[1]):
+            waypoints.append(cell)
+    waypoints.append(path[-1])
+    return waypoints
+
+
+class Router:
+    # Routes between cells on a warehouse map, returned as corner waypoints.
+    # Maps without a usable layout are open floor: the route is the goal
+    # itself, which the movement kernel reaches by stepping x then y.
+    # Routes between two locations are kept in an LRU cache keyed by
+    # (map, from_location, to_location); changing a layout drops that map.
+
+    def __init__(self, cache_size: int = ROUTE_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.grids: Dict[int, Optional[Grid]] = {}
+        self._cache: "OrderedDict[Tuple[int, int, int], List[Cell]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def load_maps(self, session: AsyncSession, map_ids: Iterable[Optional[int]]):
+        missing = {i for i in map_ids if i is not None and i not in self.grids}
+        if not missing:
+            return
+        maps = (await session.execute(
+            select(WarehouseMap).where(WarehouseMap.id.in_(missing))
+        )).scalars().all()
+        for m in maps:
+            self.grids[m.id] = Grid.from_layout(m.layout)
+        for map_id in missing - {m.id for m in maps}:
+            self.grids[map_id] = None
+
+    def invalidate(self, map_id: int):
+        self.grids.pop(map_id, None)
+        for key in [k for k in self._cache if k[0] == map_id]:
+            del self._cache[key]
+
+    def route(self, map_id: Optional[int], start: Cell, goal: Cell,
+              locations: Optional[Tuple[int, int]] = None) -> List[Cell]:
+        grid = self.grids.get(map_id) if map_id is not None else None
+        if grid is None:
+            return [goal]
+        key = (map_id, locations[0], locations[1]) if locations is not None else None
+        if key is not None:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+        path = grid.astar(start, goal)
+        # No way through: fall back to the straight line rather than stall
+        waypoints = corners(path) if path else [goal]
+        if key is not None:
+            self._cache[key] = waypoints
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return waypoints
+
+    def detour(self, map_id: Optional[int], start: Cell, goal: Cell, avoid: Cell) -> List[Cell]:
+        # A route that keeps clear of one cell, for a forklift stepping round
+        # an obstruction. Never cached, the obstruction is transient.
+        grid = self.grids.get(map_id) if map_id is not None else None
+        if grid is not None:
+            path = grid.astar(start, goal, {avoid})
+            return corners(path) if path else [goal]
+        # Open floor: x then y unless that runs through the cell, then y first
+        (sx, sy), (gx, gy), (ax, ay) = start, goal, avoid
+        on_x_leg = ay == sy and min(sx, gx) <= ax <= max(sx, gx)
+        on_y_leg = ax == gx and min(sy, gy) <= ay <= max(sy, gy)
+        if (on_x_leg or on_y_leg) and sx != gx and sy != gy:
+            return [(sx, gy), goal]
+        return [goal]
+
+
+# Shared by every simulation, routes do not depend on simulation state
+router = Router()
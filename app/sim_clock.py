@@ -0,0 +1,49 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+TICK_SECONDS = 1.0
+
+
+class SimClock:
+    # Simulated time for one run. Every tick advances `now` by TICK_SECONDS
+    # of simulated time; `speed` is how many simulated seconds pass per wall
+    # second. A speed of 0 (or below) is headless mode: ticks run back to
+    # back and only yield to the event loop between them.
+
+    def __init__(self, start: Optional[datetime] = None, speed: float = 1.0, tick_seconds: float = TICK_SECONDS):
+        self.now = start or datetime.utcnow()
+        self.speed = speed
+        self.tick = timedelta(seconds=tick_seconds)
+        self.steps = 0
+        # Wall seconds the last tick finished behind schedule
+        self.lag = 0.0
+        self._deadline = time.monotonic()
+        self._ticks = 0
+
+    @property
+    def headless(self) -> bool:
+        return self.speed <= 0
+
+    @property
+    def ticks_per_second(self) -> int:
+        # Ticks that pass in one wall second at this speed
+        return max(1, int(self.speed / self.tick.total_seconds())) if not self.headless else 0
+
+    def advance(self, ticks: int = 1):
+        # The event engine skips over ticks where nothing happens
+        self.now += self.tick * ticks
+        self.steps += ticks
+        self._ticks += ticks
+
+    async def wait(self):
+        ticks, self._ticks = self._ticks, 0
+        if self.headless:
+            await asyncio.sleep(0)
+            return
+        # Sleep against a running deadline so slow ticks don't accumulate drift
+        self._deadline += ticks * self.tick.total_seconds() / self.speed
+        remaining = self._deadline - time.monotonic()
+        self.lag = max(0.0, -remaining)
+        await asyncio.sleep(max(0.0, remaining))
@@ -1,19 +1,41 @@
 import asyncio
-from typing import Dict
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.future import select
-from app.models import Forklift, Order, DispatchPlan, OperationLog, KPI, Simulation, LocationList
-from app.db import AsyncSessionLocal
+import cProfile
+import io
+import os
+import pstats
+import time
+from typing import Dict, Optional, Set
+from app.models import Simulation
+from app.db import SimSessionLocal
+from app.persistence import WriteBehindPersister, discard_state
+from app.sim_clock import SimClock
+from app.streaming import Broadcaster, Subscriber, tick_delta
+from app.kpi import KpiAggregator
+from app.events import EventScheduler
+from app.generator import OrderStream, load_config
+from app.metrics import TICK_DURATION, TICK_PHASE_SECONDS, timed
+from app.movement import MovementKernel
+from app.routing import router
+from app.snapshots import SNAPSHOT_INTERVAL, decode, discard_after, encode, latest_snapshot, restore, save_snapshot
+from app.world_state import WorldState, ForkliftState, OrderState, PlanState
 from datetime import datetime
 
 class SimulationEngine:
     def __init__(self):
         self.running_simulations: Dict[int, asyncio.Task] = {}
+        self.worlds: Dict[int, WorldState] = {}
+        self.persisters: Dict[int, WriteBehindPersister] = {}
+        self.clocks: Dict[int, SimClock] = {}
+        self.broadcasters: Dict[int, Broadcaster] = {}
+        self.kpis: Dict[int, KpiAggregator] = {}
+        self.profilers: Dict[int, cProfile.Profile] = {}
+        self.checkpoint_requests: Set[int] = set()
 
-    async def start_simulation(self, simulation_id: int):
+    async def start_simulation(self, simulation_id: int, speed: float = 1.0, max_steps: Optional[int] = None,
+                               resume: bool = False, mode: Optional[str] = None):
         if simulation_id in self.running_simulations:
             return  # Already running
-        task = asyncio.create_task(self.run_simulation(simulation_id))
+        task = asyncio.create_task(self.run_simulation(simulation_id, speed, max_steps, resume, mode))
         self.running_simulations[simulation_id] = task
 
     async def stop_simulation(self, simulation_id: int):
@@ -21,114 +43,457 @@ class SimulationEngine:
         if task:
             task.cancel()
             del self.running_simulations[simulation_id]
+            # Let the task run its final flush before the status is written
+            await asyncio.gather(task, return_exceptions=True)
             # Optionally update simulation status in DB
-            async with AsyncSessionLocal() as session:
+            async with SimSessionLocal() as session:
                 sim = await session.get(Simulation, simulation_id)
                 if sim:
                     sim.status = 'stopped'
                     sim.end_time = datetime.utcnow()
                     await session.commit()
 
-    async def run_simulation(self, simulation_id: int):
+    async def shutdown(self):
+        # Cancelled runs flush and checkpoint on the way out but stay
+        # 'running' in the database, so the next startup resumes them
+        tasks = list(self.running_simulations.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def request_checkpoint(self, simulation_id: int) -> bool:
+        # Taken at the end of the current tick
+        if simulation_id not in self.running_simulations:
+            return False
+        self.checkpoint_requests.add(simulation_id)
+        return True
+
+    # Live state streams
+
+    def snapshot(self, simulation_id: int) -> Optional[dict]:
+        # Full current state of a running simulation, in delta form
+        world = self.worlds.get(simulation_id)
+        if world is None:
+            return None
+        return {
+            "status": "running",
+            "forklifts": {f.id: (f.x, f.y) for f in world.forklifts.values()},
+            "forklift_statuses": {f.id: f.status for f in world.forklifts.values()},
+            "orders": {o.id: o.status for o in world.orders.values()},
+        }
+
+    def subscribe(self, simulation_id: int) -> Subscriber:
+        subscriber = self.broadcasters.setdefault(simulation_id, Broadcaster()).subscribe()
+        snapshot = self.snapshot(simulation_id)
+        if snapshot is not None:
+            # Start the client off with the full current state
+            subscriber.merge(snapshot)
+        return subscriber
+
+    def unsubscribe(self, simulation_id: int, subscriber: Subscriber):
+        broadcaster = self.broadcasters.get(simulation_id)
+        if broadcaster is not None:
+            broadcaster.unsubscribe(subscriber)
+            if not broadcaster:
+                del self.broadcasters[simulation_id]
+
+    def publish(self, simulation_id: int, delta: dict):
+        broadcaster = self.broadcasters.get(simulation_id)
+        if broadcaster:
+            broadcaster.publish(delta)
+
+    def status(self, simulation_id: int) -> dict:
+        clock = self.clocks.get(simulation_id)
+        kpis = self.kpis.get(simulation_id)
+        return {
+            "simulation_id": simulation_id,
+            "running": simulation_id in self.running_simulations,
+            "step": clock.steps if clock else None,
+            "time": clock.now.isoformat() if clock else None,
+            "speed": clock.speed if clock else None,
+            "tick_lag": clock.lag if clock else None,
+            "orders_done": kpis.order_counts['done'] if kpis else None,
+            "orders_total": kpis.orders_total if kpis else None,
+            "kpis": kpis.summary() if kpis else None,
+        }
+
+    def running_status(self) -> Dict[int, dict]:
+        return {simulation_id: self.status(simulation_id) for simulation_id in self.running_simulations}
+
+    # Opt-in profiling of one simulation's tick logic. Deterministic
+    # (cProfile) but only enabled around that simulation's stepping, so
+    # other simulations and request handling on the loop are left out.
+
+    def start_profile(self, simulation_id: int) -> bool:
+        if simulation_id not in self.running_simulations:
+            return False
+        self.profilers.setdefault(simulation_id, cProfile.Profile())
+        return True
+
+    def stop_profile(self, simulation_id: int, limit: int = 30) -> Optional[str]:
+        profiler = self.profilers.pop(simulation_id, None)
+        if profiler is None:
+            return None
+        out = io.StringIO()
+        stats = pstats.Stats(profiler, stream=out)
+        if stats.total_calls:
+            stats.sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+    # Deltas from the routers, fanned out to every running simulation
+
+    def notify_forklift_status(self, forklift_id: int, status: str):
+        for simulation_id, world in self.worlds.items():
+            world.apply_forklift_status(forklift_id, status)
+            if forklift_id in world.forklifts:
+                self.publish(simulation_id, {"forklift_statuses": {forklift_id: status}})
+
+    def notify_all_forklift_status(self, status: str):
+        for world in self.worlds.values():
+            world.apply_all_forklift_status(status)
+
+    def notify_forklift_changed(self, forklift_id: int):
+        for world in self.worlds.values():
+            world.mark_forklift_stale(forklift_id)
+
+    def notify_forklift_deleted(self, forklift_id: int):
+        for world in self.worlds.values():
+            world.remove_forklift(forklift_id)
+
+    def notify_order_status(self, order_id: int, status: str):
+        for world in self.worlds.values():
+            world.apply_order_status(order_id, status)
+        for persister in self.persisters.values():
+            persister.discard_order_status(order_id)
+
+    def notify_all_order_status(self, status: str):
+        for world in self.worlds.values():
+            world.apply_all_order_status(status)
+        for persister in self.persisters.values():
+            persister.discard_order_status()
+
+    def notify_order_changed(self, order_id: int):
+        for world in self.worlds.values():
+            world.mark_order_stale(order_id)
+
+    def notify_order_deleted(self, order_id: int):
+        for world in self.worlds.values():
+            world.remove_order(order_id)
+
+    def notify_plan_changed(self, plan_id: int):
+        for world in self.worlds.values():
+            world.mark_plan_stale(plan_id)
+
+    def notify_plan_deleted(self, plan_id: int):
+        for world in self.worlds.values():
+            world.remove_plan(plan_id)
+
+    def notify_map_changed(self, map_id: int):
+        router.invalidate(map_id)
+        for world in self.worlds.values():
+            world.mark_maps_stale()
+
+    async def run_simulation(self, simulation_id: int, speed: float = 1.0, max_steps: Optional[int] = None,
+                             resume: bool = False, mode: Optional[str] = None):
+        # With resume, carries on from the latest checkpoint if there is one.
+        # mode is "tick" (the default) or "event", see app/events.py; a
+        # resumed run keeps its mode unless told otherwise. A simulation with
+        # an order generator (app/generator.py) also takes in new orders as
+        # it runs, and only completes once the generator has run dry.
+        world = WorldState(simulation_id)
+        persister = WriteBehindPersister(simulation_id)
+        clock = SimClock(speed=speed)
+        kernel = None
+        scheduler = None
+        generator = None
+        kpis = KpiAggregator(clock.tick.total_seconds())
+        self.persisters[simulation_id] = persister
+        self.clocks[simulation_id] = clock
+        self.kpis[simulation_id] = kpis
+        parent_id = None
+        loaded = False
         try:
-            async with AsyncSessionLocal() as session:
+            async with SimSessionLocal() as session:
+                snapshot = await latest_snapshot(session, simulation_id) if resume else None
+                if snapshot is not None:
+                    arrays = decode(snapshot.data)
+                    parent_id = snapshot.parent_id
+                    mode = mode or snapshot.mode
+                    if parent_id is not None:
+                        world.plan_simulation_id = parent_id
+                        persister.own_plans = False
+                    restore(arrays, world, clock, kpis)
+                    await discard_after(session, simulation_id, clock.now)
+                config = await load_config(session, simulation_id)
+                if snapshot is None:
+                    if not resume:
+                        # A fresh run starts from the master rows
+                        await discard_state(session, simulation_id)
+                    await world.load(session)
+                if config is not None:
+                    generator = OrderStream(simulation_id, config, clock.now - clock.tick * clock.steps,
+                                            clock.tick.total_seconds())
+                    await generator.load(session, world)
+                    if snapshot is not None and "gen_cursor" in arrays:
+                        # Arrivals past the checkpoint are drawn again
+                        generator.restore(arrays)
                 # Set simulation status to running
                 sim = await session.get(Simulation, simulation_id)
                 if sim:
                     sim.status = 'running'
-                    sim.start_time = datetime.utcnow()
-                    await session.commit()
+                    if snapshot is None or sim.start_time is None:
+                        sim.start_time = clock.now
+                await session.commit()
+                await router.load_maps(session, world.location_maps.values())
+            mode = mode or "tick"
+            if mode == "event":
+                kernel = MovementKernel(congestion=False)
+                scheduler = EventScheduler(kernel)
+            else:
+                kernel = MovementKernel()
+            if snapshot is not None:
+                kernel.restore(world, arrays)
+            self.worlds[simulation_id] = world
+            loaded = True
+            self.publish(simulation_id, {"status": "running"})
+            next_checkpoint = time.monotonic() + SNAPSHOT_INTERVAL
+            if snapshot is not None and scheduler is not None:
+                # A run stopped at max_steps can have stopped between events,
+                # on a tick the event engine skips. Carry on from the next
+                # event, as the uninterrupted run did, rather than run the
+                # stopped-on tick and record a KPI sample for it.
+                if generator is not None and generator.needs_refill():
+                    async with SimSessionLocal() as session:
+                        await generator.refill(session, world)
+                        await router.load_maps(session, world.location_maps.values())
+                scheduler.sync(world, kpis, clock.steps)
+                skip = self.idle_ticks(world, scheduler, clock, max_steps, generator)
+                if skip:
+                    kpis.record_tick(kernel, (), skip)
+                    clock.advance(skip)
 
-            while True:
-                async with AsyncSessionLocal() as session:
-                    # Fetch all active plans for this simulation
-                    plans = (await session.execute(
-                        select(DispatchPlan).where(DispatchPlan.simulation_id == simulation_id)
-                    )).scalars().all()
-                    # Fetch forklifts and orders
-                    forklifts = (await session.execute(
-                        select(Forklift)
-                    )).scalars().all()
-                    # Fetch all locations for forklifts and orders
-                    order_location_ids = [o.pickup_location_id for o in orders] + [o.delivery_location_id for o in orders]
-                    all_location_ids = set(location_ids + order_location_ids)
-                    locations = (await session.execute(
-                        select(LocationList).where(LocationList.id.in_(all_location_ids))
-                    )).scalars().all()
-                    location_map = {loc.id: loc for loc in locations}
-                    orders = (await session.execute(
-                        select(Order)
-                    )).scalars().all()
-
-                    # Simulate movement and update statuses
-                    for plan in plans:
-                        # Example: Move forklift towards pickup/delivery (simple logic)
-                        forklift = next((f for f in forklifts if f.id == plan.forklift_id), None)
-                        order = next((o for o in orders if o.id == plan.order_id), None)
-                        if not forklift or not order:
-                            continue
-                        # Move towards pickup if not at pickup
-                        if order.status == 'pending':
-                            forklift_loc = location_map.get(forklift.location_id)
-                            pickup_loc = location_map.get(order.pickup_location_id)
-                            dx = pickup_loc.displayX - forklift_loc.displayX
-                            dy = pickup_loc.displayY - forklift_loc.displayY
-                            if dx != 0:
-                                forklift_loc.displayX += 1 if dx > 0 else -1
-                            elif dy != 0:
-                                forklift_loc.displayY += 1 if dy > 0 else -1
-                            else:
-                                order.status = 'in_progress'
-                                # Log pickup
-                                session.add(OperationLog(
-                                    timestamp=datetime.utcnow(),
-                                    forklift_id=forklift.id,
-                                    event='pickup',
-                                    details=f'Order {order.id} picked up',
-                                    simulation_id=simulation_id
-                                ))
-                        # Move towards delivery if at pickup
-                        elif order.status == 'in_progress':
-                            forklift_loc = location_map.get(forklift.location_id)
-                            delivery_loc = location_map.get(order.delivery_location_id)
-                            dx = delivery_loc.displayX - forklift_loc.displayX
-                            dy = delivery_loc.displayY - forklift_loc.displayY
-                            if dx != 0:
-                                forklift_loc.displayX += 1 if dx > 0 else -1
-                            elif dy != 0:
-                                forklift_loc.displayY += 1 if dy > 0 else -1
-                            else:
-                                order.status = 'done'
-                                plan.end_time = datetime.utcnow()
-                                # Log delivery
-                                session.add(OperationLog(
-                                    timestamp=datetime.utcnow(),
-                                    forklift_id=forklift.id,
-                                    event='delivery',
-                                    details=f'Order {order.id} delivered',
-                                    simulation_id=simulation_id
-                                ))
-                    # Update KPIs (simple example: count done orders)
-                    done_orders = sum(1 for o in orders if o.status == 'done')
-                    session.add(KPI(
-                        timestamp=datetime.utcnow(),
-                        execution_time=done_orders,  # Placeholder
-                        block_time=0,  # Placeholder
-                        simulation_id=simulation_id
-                    ))
-                    await session.commit()
+            while max_steps is None or clock.steps < max_steps:
+                tick_start = time.perf_counter()
+                # Pick up rows the API changed since the last tick
+                if world.has_stale():
+                    with timed(TICK_PHASE_SECONDS, "sync"):
+                        async with SimSessionLocal() as session:
+                            await world.sync(session)
+                            await router.load_maps(session, world.location_maps.values())
+                if generator is not None and generator.needs_refill():
+                    with timed(TICK_PHASE_SECONDS, "generate"):
+                        async with SimSessionLocal() as session:
+                            await generator.refill(session, world)
+                            await router.load_maps(session, world.location_maps.values())
 
-                    # Check for completion
-                    if all(o.status == 'done' for o in orders):
-                        sim = await session.get(Simulation, simulation_id)
-                        if sim:
-                            sim.status = 'completed'
-                            sim.end_time = datetime.utcnow()
-                            await session.commit()
-                        break
-                await asyncio.sleep(1)  # Time step
+                now = clock.now
+                logged = len(persister.logs)
+                with timed(TICK_PHASE_SECONDS, "step"):
+                    profiler = self.profilers.get(simulation_id)
+                    if profiler is not None:
+                        profiler.enable()
+                    self.tick(world, kernel, scheduler, kpis, persister, generator, clock.steps, now)
+                    if profiler is not None:
+                        profiler.disable()
+                if self.broadcasters.get(simulation_id):
+                    with timed(TICK_PHASE_SECONDS, "publish"):
+                        self.publish(simulation_id, tick_delta(
+                            clock.steps, now,
+                            ((i, world.forklifts[i].x, world.forklifts[i].y) for i in world.moved_forklifts),
+                            ((i, world.orders[i].status) for i in world.changed_orders),
+                            persister.logs[logged:],
+                        ))
+                with timed(TICK_PHASE_SECONDS, "collect"):
+                    persister.collect(world)
+                    persister.add_kpi(simulation_id, now, kpis.elapsed, kpis.block_time)
+
+                clock.advance()
+                # Check for completion, or the step budget of a what-if run
+                complete = kpis.complete and (generator is None or generator.exhausted)
+                if scheduler is not None and not complete:
+                    skip = self.idle_ticks(world, scheduler, clock, max_steps, generator)
+                    if skip:
+                        kpis.record_tick(kernel, (), skip)
+                        clock.advance(skip)
+                if complete or (max_steps is not None and clock.steps >= max_steps):
+                    loaded = False
+                    await self.finish(world, clock, kpis, kernel, scheduler, persister, parent_id, max_steps, mode,
+                                      generator, complete)
+                    break
+                if simulation_id in self.checkpoint_requests or (SNAPSHOT_INTERVAL > 0 and time.monotonic() >= next_checkpoint):
+                    with timed(TICK_PHASE_SECONDS, "checkpoint"):
+                        await self.checkpoint(world, clock, kpis, kernel, scheduler, persister, parent_id, max_steps,
+                                              mode, generator)
+                    next_checkpoint = time.monotonic() + SNAPSHOT_INTERVAL
+                else:
+                    with timed(TICK_PHASE_SECONDS, "flush"):
+                        await persister.maybe_flush()
+                TICK_DURATION.observe(time.perf_counter() - tick_start)
+                await clock.wait()  # Time step
+            else:
+                # Resumed with its step budget already used up
+                loaded = False
+                await self.finish(world, clock, kpis, kernel, scheduler, persister, parent_id, max_steps, mode,
+                                  generator, False)
         except asyncio.CancelledError:
             pass
+        finally:
+            # Final flush so nothing buffered is lost on stop, and a final
+            # checkpoint so a stopped or interrupted run can be resumed
+            if loaded:
+                await self.checkpoint(world, clock, kpis, kernel, scheduler, persister, parent_id, max_steps, mode,
+                                      generator)
+            else:
+                persister.collect(world)
+                await persister.flush()
+            if generator is not None:
+                generator.close()
+            self.worlds.pop(simulation_id, None)
+            self.persisters.pop(simulation_id, None)
+            self.clocks.pop(simulation_id, None)
+            self.kpis.pop(simulation_id, None)
+            self.profilers.pop(simulation_id, None)
+            self.checkpoint_requests.discard(simulation_id)
+            if self.running_simulations.get(simulation_id) is asyncio.current_task():
+                del self.running_simulations[simulation_id]
+
+    async def finish(self, world: WorldState, clock: SimClock, kpis: KpiAggregator, kernel: MovementKernel,
+                     scheduler: Optional[EventScheduler], persister: WriteBehindPersister,
+                     parent_id: Optional[int], max_steps: Optional[int], mode: str,
+                     generator: Optional[OrderStream], complete: bool):
+        # End of a run that completed or used up its step budget
+        status = 'completed' if complete else 'stopped'
+        await self.checkpoint(world, clock, kpis, kernel, scheduler, persister, parent_id, max_steps, mode, generator)
+        async with SimSessionLocal() as session:
+            sim = await session.get(Simulation, world.simulation_id)
+            if sim:
+                sim.status = status
+                sim.end_time = clock.now
+                await session.commit()
+        self.publish(world.simulation_id, {"status": status})
+
+    async def checkpoint(self, world: WorldState, clock: SimClock, kpis: KpiAggregator, kernel: MovementKernel,
+                         scheduler: Optional[EventScheduler], persister: WriteBehindPersister,
+                         parent_id: Optional[int], max_steps: Optional[int], mode: str,
+                         generator: Optional[OrderStream] = None):
+        # Flushed first, so the rows in the database match the snapshot
+        self.checkpoint_requests.discard(world.simulation_id)
+        if scheduler is not None:
+            # Forklifts between events are only where they were last placed
+            scheduler.materialize(world, kpis, clock.steps)
+        persister.collect(world)
+        await persister.flush()
+        await save_snapshot(world.simulation_id, parent_id, clock, max_steps, mode,
+                            encode(world, clock, kpis, kernel, generator))
+
+    @staticmethod
+    def idle_ticks(world: WorldState, scheduler: EventScheduler, clock: SimClock, max_steps: Optional[int],
+                   generator: Optional[OrderStream] = None) -> int:
+        # Ticks from now until the next event that the event engine can skip.
+        # Changes from the API are applied first; in real time the skip is
+        # capped at a wall second so they are picked up promptly. A generated
+        # order arriving is an event too.
+        if world.has_stale() or scheduler.version != world.version:
+            return 0
+        horizon = scheduler.next_tick()
+        if generator is not None:
+            if not generator.buffer and not generator.exhausted:
+                return 0  # Refilled first
+            arrival = generator.next_tick()
+            if arrival is not None:
+                horizon = arrival if horizon is None else min(horizon, arrival)
+        if horizon is None:
+            # Nothing scheduled: idle tick by tick, as the stepping engine does
+            horizon = max_steps if max_steps is not None else clock.steps
+        if max_steps is not None:
+            horizon = min(horizon, max_steps)
+        if not clock.headless:
+            horizon = min(horizon, clock.steps + clock.ticks_per_second)
+        return max(0, horizon - clock.steps)
+
+    def tick(self, world: WorldState, kernel: MovementKernel, scheduler: Optional[EventScheduler], kpis: KpiAggregator,
+             persister: WriteBehindPersister, generator: Optional[OrderStream], tick: int, now: datetime):
+        # One tick of simulation logic, without any I/O
+        if generator is not None:
+            self.release(world, kernel, scheduler, kpis, persister, generator, tick, now)
+        kpis.sync(world)
+        if scheduler is None:
+            self.step(world, kernel, kpis, persister, now)
+            kpis.record_tick(kernel, world.moved_forklifts)
+        else:
+            scheduler.sync(world, kpis, tick)
+            scheduler.process(self, world, kpis, persister, tick, now)
+            kpis.record_tick(kernel, ())
+
+    @staticmethod
+    def release(world: WorldState, kernel: MovementKernel, scheduler: Optional[EventScheduler], kpis: KpiAggregator,
+                persister: WriteBehindPersister, generator: OrderStream, tick: int, now: datetime):
+        # Generated orders due this tick join the back of a forklift's queue;
+        # a forklift with nothing to do sets off for its new order at once
+        for forklift_id, order in generator.release(world, persister, tick, now):
+            kpis.order_added(order.status)
+            i = kernel.assign(world, forklift_id, order)
+            if i is not None and scheduler is not None and scheduler.version == kernel.version:
+                scheduler.schedule(i, tick)
+
+    def step(self, world: WorldState, kernel: MovementKernel, kpis: KpiAggregator,
+             persister: WriteBehindPersister, now: datetime):
+        kernel.sync(world)
+        if kernel.has_shared_orders:
+            self.step_sequential(world, kernel, kpis, persister, now)
+            return
+        moved, arrived = kernel.step()
+        pos = kernel.pos
+        for i in moved:
+            forklift = kernel.forklifts[i]
+            forklift.x = int(pos[i, 0])
+            forklift.y = int(pos[i, 1])
+            world.moved_forklifts.add(forklift.id)
+        for i in arrived:
+            self.arrive(world, kpis, persister, kernel.forklifts[i], kernel.plans[i], kernel.orders[i], now)
+            kernel.arrived(world, i)
+
+    def step_sequential(self, world: WorldState, kernel: MovementKernel, kpis: KpiAggregator,
+                        persister: WriteBehindPersister, now: datetime):
+        # One forklift at a time, so a pickup or delivery is visible to the
+        # forklifts after it in the same tick
+        kernel.begin_tick()
+        for i, forklift in enumerate(kernel.forklifts):
+            kernel.revalidate(world, i)
+            moved = kernel.step_one(i)
+            if moved:
+                forklift.x = int(kernel.pos[i, 0])
+                forklift.y = int(kernel.pos[i, 1])
+                world.moved_forklifts.add(forklift.id)
+            elif moved is not None:
+                self.arrive(world, kpis, persister, forklift, kernel.plans[i], kernel.orders[i], now)
+                kernel.arrived(world, i)
+        # Forklifts before an arrival still point at the order it moved on
+        for i in range(len(kernel.forklifts)):
+            kernel.revalidate(world, i)
+
+    @staticmethod
+    def arrive(world: WorldState, kpis: KpiAggregator, persister: WriteBehindPersister, forklift: ForkliftState,
+               plan: PlanState, order: OrderState, now: datetime):
+        if order.status == 'pending':
+            order.status = 'in_progress'
+            kpis.order_transition('pending', 'in_progress')
+            world.changed_orders.add(order.id)
+            # Log pickup
+            persister.add_log(world.simulation_id, now, forklift.id, 'pickup', f'Order {order.id} picked up')
+        else:
+            order.status = 'done'
+            kpis.order_transition('in_progress', 'done')
+            plan.end_time = now
+            world.changed_orders.add(order.id)
+            world.finished_plans.add(plan.id)
+            # Log delivery
+            persister.add_log(world.simulation_id, now, forklift.id, 'delivery', f'Order {order.id} delivered')
 
-# Global simulation engine instance
-simulation_engine = SimulationEngine() 
\ No newline at end of file
+# Global simulation engine instance. SIM_EXECUTOR=process runs simulations
+# in a pool of worker processes instead of on the API's event loop.
+if os.getenv("SIM_EXECUTOR", "inprocess") == "process":
+    from app.executors import ProcessSimulationEngine
+    simulation_engine = ProcessSimulationEngine()
+else:
+    simulation_engine = SimulationEngine()
@@ -0,0 +1,163 @@
+import io
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import TIMESTAMP, delete, insert, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db import SimSessionLocal
+from app.generator import OrderStream
+from app.kpi import KpiAggregator
+from app.models import KPI, OperationLog, OrderGenerator, Simulation, SimulationSnapshot
+from app.movement import MovementKernel
+from app.sim_clock import SimClock
+from app.world_state import WorldState
+
+# Wall seconds between checkpoints of a running simulation; 0 only
+# checkpoints on request and when a run stops
+SNAPSHOT_INTERVAL = float(os.getenv("SIM_SNAPSHOT_INTERVAL", "60"))
+# Checkpoints kept per simulation, newest first; older ones are pruned
+SNAPSHOT_KEEP = int(os.getenv("SIM_SNAPSHOT_KEEP", "10"))
+FORMAT_VERSION = 1
+
+# A checkpoint is everything a run holds in memory, as one compressed .npz:
+# the world (forklifts, orders, plans, locations), the clock, the KPI
+# counters, the movement kernel's routes in progress and, with an order
+# generator, its release position. Every field is a
+# flat NumPy array, so encoding is a handful of buffer copies rather than a
+# walk over Python objects, and nothing is pickled.
+
+
+def encode(world: WorldState, clock: SimClock, kpis: KpiAggregator, kernel: MovementKernel,
+           generator: Optional[OrderStream] = None) -> bytes:
+    arrays = {
+        "format": np.array([FORMAT_VERSION], dtype=np.int64),
+        "clock_steps": np.array([clock.steps], dtype=np.int64),
+        "clock_now": np.array([clock.now], dtype="datetime64[us]"),
+    }
+    arrays.update(world.dump())
+    arrays.update(kpis.dump())
+    arrays.update(kernel.dump())
+    if generator is not None:
+        arrays.update(generator.dump())
+    out = io.BytesIO()
+    np.savez_compressed(out, **arrays)
+    return out.getvalue()
+
+
+def decode(data: bytes) -> Dict[str, np.ndarray]:
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        arrays = {k: npz[k] for k in npz.files}
+    if int(arrays["format"][0]) != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format {int(arrays['format'][0])}")
+    return arrays
+
+
+def restore(arrays: Dict[str, np.ndarray], world: WorldState, clock: SimClock, kpis: KpiAggregator):
+    # The kernel is restored separately, once the maps it routes on are loaded
+    world.restore(arrays)
+    clock.steps = int(arrays["clock_steps"][0])
+    clock.now = arrays["clock_now"].astype(object)[0]
+    kpis.restore(arrays)
+
+
+async def save_snapshot(simulation_id: int, parent_id: Optional[int], clock: SimClock,
+                        max_steps: Optional[int], mode: str, data: bytes):
+    async with SimSessionLocal() as session:
+        session.add(SimulationSnapshot(
+            simulation_id=simulation_id,
+            parent_id=parent_id,
+            step=clock.steps,
+            sim_time=clock.now,
+            speed=clock.speed,
+            max_steps=max_steps,
+            mode=mode,
+            data=data,
+            created_at=datetime.utcnow(),
+        ))
+        await session.flush()
+        stale = select(SimulationSnapshot.id).where(
+            SimulationSnapshot.simulation_id == simulation_id
+        ).order_by(SimulationSnapshot.step.desc(), SimulationSnapshot.id.desc()).offset(SNAPSHOT_KEEP)
+        await session.execute(delete(SimulationSnapshot).where(SimulationSnapshot.id.in_(stale.scalar_subquery())))
+        await session.commit()
+
+
+def _latest(simulation_id: int, step: Optional[int] = None):
+    stmt = select(SimulationSnapshot).where(SimulationSnapshot.simulation_id == simulation_id)
+    if step is not None:
+        stmt = stmt.where(SimulationSnapshot.step <= step)
+    return stmt.order_by(SimulationSnapshot.step.desc(), SimulationSnapshot.id.desc()).limit(1)
+
+
+async def latest_snapshot(session: AsyncSession, simulation_id: int, step: Optional[int] = None) -> Optional[SimulationSnapshot]:
+    # The newest checkpoint, or the newest at or before `step`
+    return (await session.execute(_latest(simulation_id, step))).scalars().first()
+
+
+async def list_snapshots(session: AsyncSession, simulation_id: int) -> List[dict]:
+    rows = (await session.execute(
+        select(
+            SimulationSnapshot.id, SimulationSnapshot.parent_id, SimulationSnapshot.step,
+            SimulationSnapshot.sim_time, SimulationSnapshot.created_at,
+        ).where(SimulationSnapshot.simulation_id == simulation_id).order_by(SimulationSnapshot.step.desc())
+    )).all()
+    return [dict(row._mapping) for row in rows]
+
+
+async def discard_after(session: AsyncSession, simulation_id: int, sim_time: datetime):
+    # History written between the checkpoint and the interruption is about
+    # to be simulated again
+    await session.execute(delete(OperationLog).where(
+        OperationLog.simulation_id == simulation_id, OperationLog.timestamp >= sim_time))
+    await session.execute(delete(KPI).where(
+        KPI.simulation_id == simulation_id, KPI.timestamp >= sim_time))
+
+
+async def fork_snapshot(session: AsyncSession, source: Simulation, step: Optional[int],
+                        name: Optional[str]) -> Optional[Tuple[Simulation, int]]:
+    # A new simulation whose first checkpoint is a copy of the source's,
+    # made with one INSERT ... SELECT so the payload never leaves the
+    # database. Returns the fork and the step it starts from.
+    snapshot = (await session.execute(
+        _latest(source.id, step).with_only_columns(
+            SimulationSnapshot.id, SimulationSnapshot.parent_id, SimulationSnapshot.step,
+        )
+    )).first()
+    if snapshot is None:
+        return None
+    fork = Simulation(name=name or f"{source.name or source.id} (fork at step {snapshot.step})", status='stopped')
+    session.add(fork)
+    await session.flush()
+    await session.execute(insert(SimulationSnapshot).from_select(
+        ["simulation_id", "parent_id", "step", "sim_time", "speed", "mode", "data", "created_at"],
+        select(
+            literal(fork.id), literal(snapshot.parent_id or source.id), SimulationSnapshot.step,
+            SimulationSnapshot.sim_time, SimulationSnapshot.speed, SimulationSnapshot.mode, SimulationSnapshot.data,
+            literal(datetime.utcnow(), TIMESTAMP),
+        ).where(SimulationSnapshot.id == snapshot.id),
+    ))
+    # Orders keep arriving in the fork as they would have in the source
+    generator = await session.get(OrderGenerator, source.id)
+    if generator is not None:
+        session.add(OrderGenerator(simulation_id=fork.id, config=generator.config, updated_at=datetime.utcnow()))
+    await session.commit()
+    return fork, snapshot.step
+
+
+async def interrupted_runs(session: AsyncSession) -> List[Tuple[int, float, Optional[int], Optional[str]]]:
+    # Simulations left 'running' by a restart, with the speed, step budget
+    # and engine mode of their last checkpoint
+    ids = (await session.execute(select(Simulation.id).where(Simulation.status == 'running'))).scalars().all()
+    runs = []
+    for simulation_id in ids:
+        snapshot = (await session.execute(
+            _latest(simulation_id).with_only_columns(
+                SimulationSnapshot.speed, SimulationSnapshot.max_steps, SimulationSnapshot.mode)
+        )).first()
+        if snapshot is None:
+            runs.append((simulation_id, 1.0, None, None))
+        else:
+            speed = snapshot.speed if snapshot.speed is not None else 1.0
+            runs.append((simulation_id, speed, snapshot.max_steps, snapshot.mode))
+    return runs
@@ -0,0 +1,105 @@
+import asyncio
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Events kept per subscriber between two sends; older ones are dropped and
+# counted so a slow client knows it missed some
+MAX_PENDING_EVENTS = 1000
+
+
+class Subscriber:
+    # Pending delta for one client. Publishing only merges into it, so the
+    # tick loop never waits on a socket: positions and statuses are keyed by
+    # id and coalesce to the latest value, events are a bounded queue.
+
+    def __init__(self, max_events: int = MAX_PENDING_EVENTS):
+        self.positions: Dict[int, Tuple[int, int]] = {}
+        self.forklift_statuses: Dict[int, str] = {}
+        self.order_statuses: Dict[int, str] = {}
+        self.events: deque = deque(maxlen=max_events)
+        self.dropped_events = 0
+        self.step: Optional[int] = None
+        self.time: Optional[str] = None
+        self.status: Optional[str] = None
+        self.closed = False
+        self._ready = asyncio.Event()
+
+    def merge(self, delta: dict):
+        self.positions.update(delta.get("forklifts", {}))
+        self.forklift_statuses.update(delta.get("forklift_statuses", {}))
+        self.order_statuses.update(delta.get("orders", {}))
+        for event in delta.get("events", ()):
+            if len(self.events) == self.events.maxlen:
+                self.dropped_events += 1
+            self.events.append(event)
+        if "step" in delta:
+            self.step = delta["step"]
+            self.time = delta["time"]
+        if "status" in delta:
+            self.status = delta["status"]
+        self._ready.set()
+
+    async def next(self) -> Optional[dict]:
+        # Waits for something to send and hands over everything pending
+        await self._ready.wait()
+        self._ready.clear()
+        if self.closed:
+            return None
+        message = {
+            "step": self.step,
+            "time": self.time,
+            "status": self.status,
+            "forklifts": {str(k): list(v) for k, v in self.positions.items()},
+            "forklift_statuses": {str(k): v for k, v in self.forklift_statuses.items()},
+            "orders": {str(k): v for k, v in self.order_statuses.items()},
+            "events": list(self.events),
+            "dropped_events": self.dropped_events,
+        }
+        self.positions, self.forklift_statuses, self.order_statuses = {}, {}, {}
+        self.events.clear()
+        self.dropped_events = 0
+        return message
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+
+class Broadcaster:
+    # Fans per-tick deltas of one simulation out to its stream subscribers
+
+    def __init__(self):
+        self.subscribers: Set[Subscriber] = set()
+
+    def __bool__(self):
+        return bool(self.subscribers)
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber()
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, delta: dict):
+        for subscriber in self.subscribers:
+            subscriber.merge(delta)
+
+
+def tick_delta(step: int, time, positions: Iterable[Tuple[int, int, int]],
+               order_statuses: Iterable[Tuple[int, str]], events: List[dict]) -> dict:
+    return {
+        "step": step,
+        "time": time.isoformat(),
+        "forklifts": {forklift_id: (x, y) for forklift_id, x, y in positions},
+        "orders": dict(order_statuses),
+        "events": [
+            {
+                "timestamp": e["timestamp"].isoformat(),
+                "forklift_id": e["forklift_id"],
+                "event": e["event"],
+                "details": e["details"],
+            } for e in events
+        ],
+    }
@@ -0,0 +1,153 @@
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import aliased
+from app.models import DispatchPlan, Forklift, LocationList, Order
+from app.response_cache import FORKLIFTS, LOCATIONS, ORDERS, PLANS, response_cache
+
+# Same timings the frontend animates with
+DEPOT_TO_PICKUP_SECONDS = 10
+RETURN_TO_DEPOT_SECONDS = 10
+# Simulations whose trajectories are kept, least recently used dropped first
+TRAJECTORY_CACHE_SIZE = int(os.getenv("TRAJECTORY_CACHE_SIZE", "32"))
+# What a simulation's trajectories are built from
+SCOPES = (PLANS, ORDERS, LOCATIONS, FORKLIFTS)
+
+
+def epoch_seconds(value: datetime) -> float:
+    # Naive timestamps in the database are UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class _Track:
+    # One forklift's plans as sorted parallel arrays
+
+    def __init__(self, plans: List[Tuple[float, float, Tuple[int, int], Tuple[int, int]]]):
+        plans.sort(key=lambda p: p[0])
+        self.starts = np.array([p[0] for p in plans], dtype=np.float64)
+        self.ends = np.array([p[1] for p in plans], dtype=np.float64)
+        self.pickups = np.array([p[2] for p in plans], dtype=np.float64).reshape(len(plans), 2)
+        self.deliveries = np.array([p[3] for p in plans], dtype=np.float64).reshape(len(plans), 2)
+
+
+class Trajectories:
+    # Forklift positions over time in one simulation, interpolated from its
+    # dispatch plan start and end times the way SimulationGrid.jsx does:
+    # from the depot to the pickup in the first DEPOT_TO_PICKUP_SECONDS of a
+    # plan, on to the delivery by its end, then back to the depot. Each
+    # lookup is a binary search per forklift over its start times,
+    # vectorized over all requested times.
+
+    def __init__(self, forklift_ids: List[int], tracks: Dict[int, _Track], depot: Optional[np.ndarray],
+                 versions: Tuple[int, ...]):
+        self.forklift_ids = forklift_ids
+        self.tracks = tracks
+        self.depot = depot
+        self.versions = versions
+        self.built_at = time.monotonic()
+
+    @classmethod
+    async def load(cls, session: AsyncSession, simulation_id: int, versions: Tuple[int, ...]) -> "Trajectories":
+        pickup, delivery = aliased(LocationList), aliased(LocationList)
+        rows = (await session.execute(
+            select(DispatchPlan.forklift_id, DispatchPlan.start_time, DispatchPlan.end_time,
+                   pickup.displayX, pickup.displayY, delivery.displayX, delivery.displayY)
+            .join(Order, Order.id == DispatchPlan.order_id)
+            .join(pickup, pickup.id == Order.pickup_location_id)
+            .join(delivery, delivery.id == Order.delivery_location_id)
+            .where(DispatchPlan.simulation_id == simulation_id, DispatchPlan.forklift_id.isnot(None),
+                   DispatchPlan.start_time.isnot(None), DispatchPlan.end_time.isnot(None))
+        )).all()
+        depot = (await session.execute(
+            select(LocationList.displayX, LocationList.displayY)
+            .where(func.lower(LocationList.name) == 'depot').order_by(LocationList.id).limit(1)
+        )).first()
+        forklift_ids = list((await session.execute(select(Forklift.id).order_by(Forklift.id))).scalars().all())
+        per_forklift: Dict[int, list] = {}
+        for forklift_id, start, end, px, py, dx, dy in rows:
+            per_forklift.setdefault(forklift_id, []).append(
+                (epoch_seconds(start), epoch_seconds(end), (px, py), (dx, dy))
+            )
+        return cls(
+            forklift_ids,
+            {forklift_id: _Track(plans) for forklift_id, plans in per_forklift.items()},
+            np.array(depot, dtype=np.float64) if depot else None,
+            versions,
+        )
+
+    def positions(self, times: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # Returns x and y arrays shaped (forklifts, times)
+        n = len(self.forklift_ids)
+        xs = np.zeros((n, len(times)), dtype=np.int64)
+        ys = np.zeros((n, len(times)), dtype=np.int64)
+        if self.depot is None:
+            # The frontend parks everything at the origin without a depot
+            return xs, ys
+        for row, forklift_id in enumerate(self.forklift_ids):
+            pos = self._track_positions(self.tracks.get(forklift_id), times)
+            # Math.round semantics
+            xs[row] = np.floor(pos[:, 0] + 0.5)
+            ys[row] = np.floor(pos[:, 1] + 0.5)
+        return xs, ys
+
+    def _track_positions(self, track: Optional[_Track], times: np.ndarray) -> np.ndarray:
+        depot = self.depot
+        pos = np.tile(depot, (len(times), 1))
+        if track is None or not len(track.starts):
+            return pos
+        i = np.searchsorted(track.starts, times, side='right') - 1
+        started = i >= 0
+        i = np.maximum(i, 0)
+        start, end = track.starts[i], track.ends[i]
+        pickup, delivery = track.pickups[i], track.deliveries[i]
+        t = times
+
+        in_plan = started & (t <= end)
+        to_pickup = in_plan & (t < start + DEPOT_TO_PICKUP_SECONDS)
+        to_delivery = in_plan & ~to_pickup
+        returning = started & (t > end)
+
+        f = np.clip((t - start) / DEPOT_TO_PICKUP_SECONDS, 0, 1)[:, None]
+        pos = np.where(to_pickup[:, None], depot + (pickup - depot) * f, pos)
+        span = end - start - DEPOT_TO_PICKUP_SECONDS
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f = np.where(span > 0, np.clip((t - start - DEPOT_TO_PICKUP_SECONDS) / span, 0, 1), 1.0)[:, None]
+        pos = np.where(to_delivery[:, None], pickup + (delivery - pickup) * f, pos)
+        f = np.clip((t - end) / RETURN_TO_DEPOT_SECONDS, 0, 1)[:, None]
+        pos = np.where(returning[:, None], delivery + (depot - delivery) * f, pos)
+        return pos
+
+
+class TrajectoryIndex:
+    # Built trajectories per simulation. An entry is rebuilt once any of
+    # the rows it was built from changes: every route writing plans,
+    # orders, locations or forklifts, and every simulation flushing plan
+    # end times, invalidates the matching response cache scope, and the
+    # versions of those scopes are compared here. Writes no process heard
+    # of are picked up after RESPONSE_CACHE_TTL, as with cached responses.
+
+    def __init__(self, size: int = TRAJECTORY_CACHE_SIZE):
+        self.size = size
+        self.entries: "OrderedDict[int, Trajectories]" = OrderedDict()
+
+    async def get(self, session: AsyncSession, simulation_id: int) -> Trajectories:
+        versions = tuple(response_cache.versions.get(scope, 0) for scope in SCOPES)
+        entry = self.entries.get(simulation_id)
+        if entry is None or entry.versions != versions or time.monotonic() - entry.built_at >= response_cache.ttl:
+            entry = await Trajectories.load(session, simulation_id, versions)
+            self.entries[simulation_id] = entry
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        self.entries.move_to_end(simulation_id)
+        return entry
+
+
+trajectory_index = TrajectoryIndex()
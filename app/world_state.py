@@ -0,0 +1,392 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from app.models import Forklift, Order, DispatchPlan, LocationList, SimulationForklift, SimulationOrder
+
+# Stands in for a missing id in snapshot arrays
+NO_ID = -1
+# Generated orders (see app/generator.py) and their plans are never rows.
+# They are numbered down from here, so they clash neither with a row id
+# nor with NO_ID; an order and its plan share the number.
+FIRST_GENERATED_ID = NO_ID - 1
+
+
+def generated_id(seq: int) -> int:
+    # Id of a generator's arrival number `seq`, the same on every run
+    return FIRST_GENERATED_ID - seq
+
+
+def is_generated(row_id: int) -> bool:
+    return row_id <= FIRST_GENERATED_ID
+
+
+@dataclass
+class ForkliftState:
+    id: int
+    status: str
+    location_id: Optional[int]
+    x: int
+    y: int
+
+
+@dataclass
+class OrderState:
+    id: int
+    pickup_location_id: Optional[int]
+    delivery_location_id: Optional[int]
+    status: str
+
+
+@dataclass
+class PlanState:
+    id: int
+    forklift_id: Optional[int]
+    order_id: Optional[int]
+    start_time: Optional[datetime]
+    end_time: Optional[datetime]
+
+
+class WorldState:
+    # Resident copy of everything a running simulation touches. It is loaded
+    # once at start; afterwards the routers push deltas in (see the notify_*
+    # methods on SimulationEngine) and only rows that were explicitly marked
+    # stale are re-selected, so a tick never scans whole tables.
+    #
+    # The forklifts, orders and locations tables are shared master data and
+    # are only read. Positions and order statuses a simulation changes are
+    # written to its own simulation_forklifts and simulation_orders rows,
+    # which are laid over the master rows on load, so runs going at the same
+    # time neither see nor lock each other's state.
+
+    def __init__(self, simulation_id: int, plan_simulation_id: Optional[int] = None, own_state: bool = True):
+        self.simulation_id = simulation_id
+        # Off to start from the master rows alone, ignoring wherever this
+        # simulation's runs left its forklifts and orders
+        self.own_state = own_state
+        # Whose dispatch plans this world runs; a fork runs its parent's
+        self.plan_simulation_id = plan_simulation_id or simulation_id
+        self.forklifts: Dict[int, ForkliftState] = {}
+        self.orders: Dict[int, OrderState] = {}
+        self.plans: Dict[int, PlanState] = {}
+        self.locations: Dict[int, Tuple[int, int]] = {}
+        self.location_maps: Dict[int, Optional[int]] = {}
+        # Each forklift works through its plans one at a time, in start order
+        self.forklift_plans: Dict[int, List[int]] = {}
+        self._cursors: Dict[int, int] = {}
+        # Bumped on every change that did not come from the engine's own
+        # stepping, so derived structures know when to rebuild
+        self.version = 0
+        # Generated orders delivered and dropped from the world so far
+        self.retired_orders = 0
+
+        # Changes made by the engine that still have to be written back
+        self.moved_forklifts: Set[int] = set()
+        self.changed_orders: Set[int] = set()
+        self.finished_plans: Set[int] = set()
+        self.assigned_plans: Set[int] = set()
+
+        # Changes made through the API that still have to be loaded
+        self._stale_forklifts: Set[int] = set()
+        self._stale_orders: Set[int] = set()
+        self._stale_plans: Set[int] = set()
+        self._stale_maps = False
+
+    async def load(self, session: AsyncSession):
+        plans = (await session.execute(
+            select(DispatchPlan).where(DispatchPlan.simulation_id == self.plan_simulation_id)
+        )).scalars().all()
+        self.plans = {p.id: self._plan_state(p) for p in plans}
+        await self._load_forklifts(session, {p.forklift_id for p in plans if p.forklift_id is not None})
+        await self._load_orders(session, {p.order_id for p in plans if p.order_id is not None})
+        self._reorder_plans()
+        self.version += 1
+
+    async def preload(self, session: AsyncSession, forklift_ids: Set[int] = frozenset(),
+                      location_ids: Set[int] = frozenset()):
+        # Rows an order generator will hand out before any plan names them
+        await self._load_forklifts(session, {i for i in forklift_ids if i not in self.forklifts})
+        await self._load_locations(session, location_ids)
+
+    def has_stale(self) -> bool:
+        return bool(self._stale_forklifts or self._stale_orders or self._stale_plans or self._stale_maps)
+
+    async def sync(self, session: AsyncSession):
+        if not self.has_stale():
+            return
+        plan_ids, self._stale_plans = self._stale_plans, set()
+        forklift_ids, self._stale_forklifts = self._stale_forklifts, set()
+        order_ids, self._stale_orders = self._stale_orders, set()
+        self._stale_maps = False
+
+        if plan_ids:
+            plans = (await session.execute(
+                select(DispatchPlan).where(DispatchPlan.id.in_(plan_ids))
+            )).scalars().all()
+            for plan_id in plan_ids:
+                self.plans.pop(plan_id, None)
+            for p in plans:
+                if p.simulation_id != self.plan_simulation_id:
+                    continue
+                self.plans[p.id] = self._plan_state(p)
+                if p.forklift_id is not None and p.forklift_id not in self.forklifts:
+                    forklift_ids.add(p.forklift_id)
+                if p.order_id is not None and p.order_id not in self.orders:
+                    order_ids.add(p.order_id)
+            self._reorder_plans()
+
+        if forklift_ids:
+            await self._load_forklifts(session, forklift_ids)
+        if order_ids:
+            await self._load_orders(session, order_ids)
+        self.version += 1
+
+    async def _load_forklifts(self, session: AsyncSession, forklift_ids: Set[int]):
+        if not forklift_ids:
+            return
+        forklifts = (await session.execute(
+            select(Forklift).where(Forklift.id.in_(forklift_ids))
+        )).scalars().all()
+        await self._load_locations(session, {f.location_id for f in forklifts})
+        own = {
+            s.forklift_id: s for s in (await session.execute(
+                select(SimulationForklift).where(
+                    SimulationForklift.simulation_id == self.simulation_id,
+                    SimulationForklift.forklift_id.in_(forklift_ids))
+            )).scalars().all()
+        } if self.own_state else {}
+        for f in forklifts:
+            current = self.forklifts.get(f.id)
+            if current is not None and current.location_id == f.location_id:
+                # The engine owns the position while running; only pick up
+                # the other columns
+                current.status = f.status
+                continue
+            x, y = self.locations.get(f.location_id, (0, 0))
+            if f.id in own and own[f.id].location_id == f.location_id:
+                # Where this simulation left it, unless it has been rehomed
+                x, y = own[f.id].x, own[f.id].y
+            self.forklifts[f.id] = ForkliftState(f.id, f.status, f.location_id, x, y)
+
+    async def _load_orders(self, session: AsyncSession, order_ids: Set[int]):
+        if not order_ids:
+            return
+        orders = (await session.execute(
+            select(Order).where(Order.id.in_(order_ids))
+        )).scalars().all()
+        await self._load_locations(
+            session,
+            {o.pickup_location_id for o in orders} | {o.delivery_location_id for o in orders},
+        )
+        own = dict((await session.execute(
+            select(SimulationOrder.order_id, SimulationOrder.status).where(
+                SimulationOrder.simulation_id == self.simulation_id, SimulationOrder.order_id.in_(order_ids))
+        )).all()) if self.own_state else {}
+        for o in orders:
+            self.orders[o.id] = OrderState(o.id, o.pickup_location_id, o.delivery_location_id, own.get(o.id, o.status))
+        self._cursors.clear()
+
+    async def _load_locations(self, session: AsyncSession, location_ids: Set[int]):
+        missing = {i for i in location_ids if i is not None and i not in self.locations}
+        if not missing:
+            return
+        locations = (await session.execute(
+            select(LocationList).where(LocationList.id.in_(missing))
+        )).scalars().all()
+        for loc in locations:
+            self.locations[loc.id] = (loc.displayX, loc.displayY)
+            self.location_maps[loc.id] = loc.mapId
+
+    @staticmethod
+    def _plan_state(plan: DispatchPlan) -> PlanState:
+        return PlanState(plan.id, plan.forklift_id, plan.order_id, plan.start_time, plan.end_time)
+
+    def _reorder_plans(self):
+        queues: Dict[int, List[PlanState]] = {}
+        for plan in self.plans.values():
+            if plan.forklift_id is not None:
+                queues.setdefault(plan.forklift_id, []).append(plan)
+        self.forklift_plans = {
+            forklift_id: [p.id for p in sorted(plans, key=lambda p: (p.start_time is None, p.start_time or datetime.min, p.id))]
+            for forklift_id, plans in queues.items()
+        }
+        self._cursors.clear()
+
+    def active_plan(self, forklift_id: int) -> Optional[PlanState]:
+        queue = self.forklift_plans.get(forklift_id, ())
+        i = self._cursors.get(forklift_id, 0)
+        while i < len(queue):
+            plan = self.plans[queue[i]]
+            order = self.orders.get(plan.order_id)
+            if order is not None and order.status in ('pending', 'in_progress'):
+                break
+            i += 1
+        self._cursors[forklift_id] = i
+        return self.plans[queue[i]] if i < len(queue) else None
+
+    # Snapshot arrays, see app/snapshots.py. Dicts are written in iteration
+    # order and rebuilt in the same order, so a resumed run steps the fleet
+    # exactly as the original would have.
+
+    def dump(self) -> Dict[str, np.ndarray]:
+        forklifts = list(self.forklifts.values())
+        orders = list(self.orders.values())
+        plans = list(self.plans.values())
+        return {
+            "world_forklift_id": np.array([f.id for f in forklifts], dtype=np.int64),
+            "world_forklift_status": np.array([f.status for f in forklifts], dtype=str),
+            "world_forklift_location": _ids([f.location_id for f in forklifts]),
+            "world_forklift_xy": np.array([(f.x, f.y) for f in forklifts], dtype=np.int64).reshape(-1, 2),
+            "world_order_id": np.array([o.id for o in orders], dtype=np.int64),
+            "world_order_pickup": _ids([o.pickup_location_id for o in orders]),
+            "world_order_delivery": _ids([o.delivery_location_id for o in orders]),
+            "world_order_status": np.array([o.status for o in orders], dtype=str),
+            "world_plan_id": np.array([p.id for p in plans], dtype=np.int64),
+            "world_plan_forklift": _ids([p.forklift_id for p in plans]),
+            "world_plan_order": _ids([p.order_id for p in plans]),
+            "world_plan_start": np.array([p.start_time for p in plans], dtype="datetime64[us]"),
+            "world_plan_end": np.array([p.end_time for p in plans], dtype="datetime64[us]"),
+            "world_location_id": np.array(list(self.locations), dtype=np.int64),
+            "world_location_xy": np.array(list(self.locations.values()), dtype=np.int64).reshape(-1, 2),
+            "world_location_map": _ids([self.location_maps.get(i) for i in self.locations]),
+            "world_retired": np.array([self.retired_orders], dtype=np.int64),
+        }
+
+    def restore(self, arrays: Dict[str, np.ndarray]):
+        a = {k: v.tolist() for k, v in arrays.items() if k.startswith("world_") and v.dtype.kind != "M"}
+        self.forklifts = {
+            i: ForkliftState(i, status, _id(location), x, y)
+            for i, status, location, (x, y) in zip(
+                a["world_forklift_id"], a["world_forklift_status"], a["world_forklift_location"], a["world_forklift_xy"])
+        }
+        self.orders = {
+            i: OrderState(i, _id(pickup), _id(delivery), status)
+            for i, pickup, delivery, status in zip(
+                a["world_order_id"], a["world_order_pickup"], a["world_order_delivery"], a["world_order_status"])
+        }
+        self.plans = {
+            i: PlanState(i, _id(forklift), _id(order), start, end)
+            for i, forklift, order, start, end in zip(
+                a["world_plan_id"], a["world_plan_forklift"], a["world_plan_order"],
+                arrays["world_plan_start"].astype(object), arrays["world_plan_end"].astype(object))
+        }
+        self.locations = {i: tuple(xy) for i, xy in zip(a["world_location_id"], a["world_location_xy"])}
+        self.location_maps = {i: _id(m) for i, m in zip(a["world_location_id"], a["world_location_map"])}
+        self.retired_orders = int(arrays["world_retired"][0]) if "world_retired" in arrays else 0
+        self._reorder_plans()
+        # The database may have moved on past the snapshot; write every row
+        # back on the first flush
+        self.moved_forklifts = set(self.forklifts)
+        self.changed_orders = set(self.orders)
+        self.finished_plans = set(self.plans)
+        self.version += 1
+
+    def clear_changes(self):
+        self._retire()
+        self.moved_forklifts.clear()
+        self.changed_orders.clear()
+        self.finished_plans.clear()
+        self.assigned_plans.clear()
+
+    def _retire(self):
+        # Generated orders delivered this tick leave the world, so a long
+        # stream holds only the orders still open. Everything they leave
+        # behind is in the operation log and retired_orders.
+        for plan_id in self.finished_plans:
+            plan = self.plans.get(plan_id)
+            if plan is None or not is_generated(plan_id):
+                continue
+            order = self.orders.get(plan.order_id)
+            if order is None or order.status != 'done':
+                continue
+            del self.plans[plan_id]
+            del self.orders[order.id]
+            queue = self.forklift_plans.get(plan.forklift_id)
+            if queue is not None and plan_id in queue:
+                i = queue.index(plan_id)
+                del queue[i]
+                cursor = self._cursors.get(plan.forklift_id)
+                if cursor is not None and cursor > i:
+                    self._cursors[plan.forklift_id] = cursor - 1
+            self.retired_orders += 1
+
+    def release(self, order: OrderState, plan: PlanState):
+        # A generated order coming in, already assigned. It goes to the back
+        # of its forklift's queue without a version bump, so the fleet isn't
+        # re-routed for every arrival; see MovementKernel.assign.
+        self.orders[order.id] = order
+        self.plans[plan.id] = plan
+        self.forklift_plans.setdefault(plan.forklift_id, []).append(plan.id)
+        self.assigned_plans.add(plan.id)
+        self.changed_orders.add(order.id)
+
+    # Deltas pushed in by the routers
+
+    def apply_forklift_status(self, forklift_id: int, status: str):
+        forklift = self.forklifts.get(forklift_id)
+        if forklift:
+            forklift.status = status
+            self.version += 1
+
+    def apply_all_forklift_status(self, status: str):
+        for forklift in self.forklifts.values():
+            forklift.status = status
+        self.version += 1
+
+    def apply_order_status(self, order_id: int, status: str):
+        order = self.orders.get(order_id)
+        if order:
+            order.status = status
+            # This simulation's copy follows the master row
+            self.changed_orders.add(order_id)
+            # A reopened order may sit behind the cursor
+            self._cursors.clear()
+            self.version += 1
+
+    def apply_all_order_status(self, status: str):
+        for order in self.orders.values():
+            order.status = status
+        self.changed_orders.update(self.orders)
+        self._cursors.clear()
+        self.version += 1
+
+    def mark_forklift_stale(self, forklift_id: int):
+        if forklift_id in self.forklifts:
+            self._stale_forklifts.add(forklift_id)
+
+    def mark_order_stale(self, order_id: int):
+        if order_id in self.orders:
+            self._stale_orders.add(order_id)
+
+    def mark_plan_stale(self, plan_id: int):
+        self._stale_plans.add(plan_id)
+
+    def mark_maps_stale(self):
+        # Routes have to be recomputed against a changed layout
+        self._stale_maps = True
+
+    def remove_forklift(self, forklift_id: int):
+        self.forklifts.pop(forklift_id, None)
+        self.moved_forklifts.discard(forklift_id)
+        self.version += 1
+
+    def remove_order(self, order_id: int):
+        self.orders.pop(order_id, None)
+        self.changed_orders.discard(order_id)
+        self.version += 1
+
+    def remove_plan(self, plan_id: int):
+        if self.plans.pop(plan_id, None) is not None:
+            self.finished_plans.discard(plan_id)
+            self._reorder_plans()
+            self.version += 1
+
+
+def _ids(values: List[Optional[int]]) -> np.ndarray:
+    return np.array([NO_ID if v is None else v for v in values], dtype=np.int64)
+
+
+def _id(value: int) -> Optional[int]:
+    return None if value == NO_ID else value
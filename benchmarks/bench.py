@@ -0,0 +1,247 @@
+# Benchmark harness for the simulation engine and the list endpoints.
+#
+# Seeds a synthetic warehouse (rack rows on a grid map, one dispatch plan
+# per order) into a scratch database and measures:
+#   - ticks per second of SimulationEngine over a fixed number of ticks
+#   - wall time to complete every order, headless
+#   - peak Python memory of one simulation (tracemalloc)
+#   - p50/p99 latency of /plans/all, /forklifts/ and /orders/ under
+#     concurrent load, served in-process through httpx
+# and writes the numbers as JSON so runs can be compared across commits.
+#
+#   python -m benchmarks.bench --forklifts 50 --orders 2000 --out bench.json
+#
+# The target database is dropped and recreated, so point --database-url at
+# a scratch database; the default is a SQLite file in the temp directory.
+# The SQLite driver and httpx for the latency run are not app requirements:
+#
+#   pip install -r benchmarks/requirements.txt
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the simulation engine and the list endpoints")
+    parser.add_argument("--database-url", default="sqlite+aiosqlite:///" + os.path.join(tempfile.gettempdir(), "forklift_bench.db"))
+    parser.add_argument("--map-size", type=int, default=100, help="Width and height of the grid")
+    parser.add_argument("--locations", type=int, default=500, help="Pickup and delivery locations")
+    parser.add_argument("--forklifts", type=int, default=50)
+    parser.add_argument("--orders", type=int, default=2000, help="Orders, each with one dispatch plan")
+    parser.add_argument("--ticks", type=int, default=500, help="Ticks for the throughput run")
+    parser.add_argument("--max-ticks", type=int, default=200000, help="Cap for the time-to-complete run")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip", action="append", default=[], choices=["ticks", "complete", "memory", "latency"])
+    parser.add_argument("--out", help="Write results here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def warehouse_layout(size: int):
+    # Two-cell racks every fourth column with a cross aisle every 20 rows
+    obstacles = []
+    for x in range(2, size - 2, 4):
+        for y in range(2, size - 2, 20):
+            obstacles.append({"x": x, "y": y, "w": 2, "h": min(16, size - 2 - y)})
+    return {"width": size, "height": size, "obstacles": obstacles}
+
+
+async def seed(args):
+    from sqlalchemy import insert
+    from app.db import engine, AsyncSessionLocal
+    from app.models import Base, MapList, WarehouseMap, LocationList, Forklift, Order, DispatchPlan, Simulation
+    from app.persistence import chunked
+    from app.routing import Grid
+
+    rng = random.Random(args.seed)
+    layout = warehouse_layout(args.map_size)
+    grid = Grid.from_layout(layout)
+    free = [(x, y) for x in range(args.map_size) for y in range(args.map_size) if grid.walkable((x, y))]
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with AsyncSessionLocal() as session:
+        session.add(MapList(id=1, name="bench"))
+        await session.flush()
+        session.add(WarehouseMap(id=1, name="bench", layout=layout))
+        session.add(Simulation(id=1, name="bench", status="new"))
+        await session.flush()
+        # Stock locations first, then one home location per forklift, where
+        # each forklift starts; positions during a run go to the
+        # simulation's own rows, not these
+        cells = rng.sample(free, args.locations + args.forklifts + 1)
+        locations = [{"id": 1, "name": "Depot", "mapId": 1, "displayX": cells[0][0], "displayY": cells[0][1]}]
+        locations += [
+            {"id": i + 2, "name": f"L{i}", "mapId": 1, "displayX": x, "displayY": y}
+            for i, (x, y) in enumerate(cells[1:args.locations + 1])
+        ]
+        homes = [
+            {"id": args.locations + 2 + i, "name": f"Forklift {i + 1}", "mapId": 1, "displayX": x, "displayY": y}
+            for i, (x, y) in enumerate(cells[args.locations + 1:])
+        ]
+        stock = [loc["id"] for loc in locations[1:]]
+        forklifts = [
+            {"id": i + 1, "name": f"F{i + 1}", "status": "available", "location_id": home["id"]}
+            for i, home in enumerate(homes)
+        ]
+        orders = [
+            {"id": i + 1, "pickup_location_id": p, "delivery_location_id": d, "status": "pending"}
+            for i, (p, d) in enumerate(rng.sample(stock, 2) for _ in range(args.orders))
+        ]
+        plans = [
+            {"id": i + 1, "forklift_id": i % args.forklifts + 1, "order_id": i + 1, "simulation_id": 1}
+            for i in range(args.orders)
+        ]
+        for model, rows in ((LocationList, locations + homes), (Forklift, forklifts), (Order, orders), (DispatchPlan, plans)):
+            for chunk in chunked(rows):
+                await session.execute(insert(model).values(chunk))
+        await session.commit()
+
+
+def fresh_engine():
+    from app.simulation_engine import SimulationEngine
+    from app.routing import router
+    # Routes from an earlier run must not make a later one look faster
+    router.invalidate(1)
+    return SimulationEngine()
+
+
+async def bench_ticks(args) -> dict:
+    await seed(args)
+    engine = fresh_engine()
+    start = time.perf_counter()
+    await engine.run_simulation(1, speed=0, max_steps=args.ticks)
+    elapsed = time.perf_counter() - start
+    return {"ticks": args.ticks, "seconds": elapsed, "ticks_per_second": args.ticks / elapsed}
+
+
+async def bench_complete(args) -> dict:
+    from sqlalchemy import func, select
+    from app.db import AsyncSessionLocal
+    from app.models import Simulation, SimulationOrder
+    await seed(args)
+    engine = fresh_engine()
+    start = time.perf_counter()
+    await engine.run_simulation(1, speed=0, max_steps=args.max_ticks)
+    elapsed = time.perf_counter() - start
+    async with AsyncSessionLocal() as session:
+        simulation = await session.get(Simulation, 1)
+        done = (await session.execute(select(func.count()).select_from(SimulationOrder).where(
+            SimulationOrder.simulation_id == 1, SimulationOrder.status == "done"))).scalar()
+    return {
+        "orders": args.orders,
+        "orders_done": done,
+        "completed": simulation.status == "completed",
+        "simulated_seconds": (simulation.end_time - simulation.start_time).total_seconds(),
+        "seconds": elapsed,
+    }
+
+
+async def bench_memory(args) -> dict:
+    # Peak over loading the world and a short run; tracemalloc slows
+    # everything down, so this is kept out of the timed runs
+    await seed(args)
+    engine = fresh_engine()
+    ticks = min(args.ticks, 100)
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    await engine.run_simulation(1, speed=0, max_steps=ticks)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"ticks": ticks, "peak_mb": (peak - baseline) / 2**20, "retained_mb": (current - baseline) / 2**20}
+
+
+async def bench_latency(args) -> dict:
+    import httpx
+    import numpy as np
+    from app.main import app
+    await seed(args)
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def timed_get(path):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.get(path)
+                response.raise_for_status()
+                return time.perf_counter() - start
+
+        for path in ("/plans/all", "/forklifts/", "/orders/"):
+            await timed_get(path)  # Warm up
+            start = time.perf_counter()
+            latencies = np.array(await asyncio.gather(*(timed_get(path) for _ in range(args.requests))))
+            wall = time.perf_counter() - start
+            results[path] = {
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "p50_ms": float(np.percentile(latencies, 50) * 1000),
+                "p99_ms": float(np.percentile(latencies, 99) * 1000),
+                "mean_ms": float(latencies.mean() * 1000),
+                "requests_per_second": args.requests / wall,
+            }
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    benches = {"ticks": bench_ticks, "complete": bench_complete, "memory": bench_memory, "latency": bench_latency}
+    results = {}
+    for name, bench in benches.items():
+        if name in args.skip:
+            continue
+        print(f"running {name}...", file=sys.stderr)
+        results[name] = await bench(args)
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "database": args.database_url.split(":", 1)[0],
+        "params": {
+            "map_size": args.map_size,
+            "locations": args.locations,
+            "forklifts": args.forklifts,
+            "orders": args.orders,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # app.db reads these at import time, so they are set before any app import
+    os.environ["DATABASE_URL"] = args.database_url
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
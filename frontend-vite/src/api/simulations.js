@@ -0,0 +1,10 @@
+import axios from 'axios';
+
+const API_BASE = 'http://localhost:8000';
+
+// Forklift positions and order statuses as one simulation's runs left them;
+// /orders/ and /forklifts/ only show the master rows
+export async function getSimulationState(simulationId) {
+  const response = await axios.get(`${API_BASE}/simulations/${simulationId}/state`);
+  return response.data;
+}
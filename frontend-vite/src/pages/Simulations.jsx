@@ -1,4 +1,5 @@
 import React, { useEffect, useState } from 'react';
+import { useSearchParams } from 'react-router-dom';
 import SimulationGrid from '../components/SimulationGrid';
 import OrdersSidebar from '../components/OrdersSidebar';
 import ForkliftList from '../components/ForkliftList';
@@ -6,6 +7,7 @@ import SimulationGridSimple from '../components/SimulationGridSimple';
 import ForkliftStatusList from '../components/ForkliftStatusList';
 import { getForklifts, getLocations, getMaps, getPlans, resetPlanTimes, blockForklift, unblockForklift, resetAllForklifts } from '../api/forklifts';
 import { getOrders, resetAllOrders } from '../api/orders';
+import { getSimulationState } from '../api/simulations';
 import CircularProgress from '@mui/material/CircularProgress';
 import Typography from '@mui/material/Typography';
 import Box from '@mui/material/Box';
@@ -22,6 +24,17 @@ export default function Simulations() {
   const [filters, setFilters] = useState({ status: '', forkliftId: '' });
   const [selectedOrderId, setSelectedOrderId] = useState(null);
   const [forkliftStatusFilter, setForkliftStatusFilter] = useState('');
+  // With ?simulation=<id>, order statuses are that simulation's own
+  const [searchParams] = useSearchParams();
+  const simulationId = searchParams.get('simulation');
+
+  const fetchOrders = async () => {
+    const ordersData = await getOrders();
+    if (!simulationId) return ordersData;
+    const state = await getSimulationState(simulationId);
+    const statuses = Object.fromEntries(state.orders.map(o => [o.id, o.status]));
+    return ordersData.map(o => (o.id in statuses ? { ...o, status: statuses[o.id] } : o));
+  };
 
   console.log('Simulations component rendering', { forklifts, locations, orders, plans, loading, error });
 
@@ -33,7 +46,7 @@ export default function Simulations() {
         getForklifts(),
         getLocations(),
         getMaps(),
-        getOrders(),
+        fetchOrders(),
         getPlans()
       ]);
       console.log('Data fetched:', { forkliftsData, locationsData, mapsData, ordersData, plansData });
@@ -53,7 +66,7 @@ export default function Simulations() {
 
   useEffect(() => {
     fetchAll();
-  }, []);
+  }, [simulationId]);
 
   const handleResetTimes = async () => {
     await resetPlanTimes();
@@ -78,7 +91,7 @@ export default function Simulations() {
 
   const handleOrderStatusChange = () => {
     // Refresh orders data when simulation updates order status
-    getOrders().then(setOrders);
+    fetchOrders().then(setOrders);
   };
 
   if (loading) return <CircularProgress />;
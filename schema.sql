@@ -69,4 +69,81 @@ CREATE TABLE simulations (
     start_time TIMESTAMP,
     end_time TIMESTAMP,
     status TEXT
-); 
\ No newline at end of file
+);
+
+-- Travel distances between every pair of locations on a map, as raw int32
+-- arrays (see app/distances.py)
+CREATE TABLE location_distances (
+    mapId INT PRIMARY KEY REFERENCES mapList(id),
+    layout_hash TEXT NOT NULL,
+    location_ids BYTEA NOT NULL,
+    coords BYTEA NOT NULL,
+    distances BYTEA NOT NULL,
+    updated_at TIMESTAMP
+);
+
+-- Compressed .npz checkpoints of running simulations (see app/snapshots.py)
+CREATE TABLE simulation_snapshots (
+    id SERIAL PRIMARY KEY,
+    simulation_id INT NOT NULL REFERENCES simulations(id),
+    parent_id INT REFERENCES simulations(id),
+    step INT NOT NULL,
+    sim_time TIMESTAMP NOT NULL,
+    speed FLOAT,
+    max_steps INT,
+    mode TEXT,
+    data BYTEA NOT NULL,
+    created_at TIMESTAMP
+);
+
+-- Per-simulation copies of the forklift positions and order statuses a
+-- run has changed; the forklifts, orders and locations tables are only
+-- ever read by the engine (see app/world_state.py)
+CREATE TABLE simulation_forklifts (
+    simulation_id INT NOT NULL REFERENCES simulations(id) ON DELETE CASCADE,
+    forklift_id INT NOT NULL REFERENCES forklifts(id) ON DELETE CASCADE,
+    location_id INT REFERENCES locationList(id) ON DELETE CASCADE,
+    x INT NOT NULL,
+    y INT NOT NULL,
+    PRIMARY KEY (simulation_id, forklift_id)
+);
+
+CREATE TABLE simulation_orders (
+    simulation_id INT NOT NULL REFERENCES simulations(id) ON DELETE CASCADE,
+    order_id INT NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+    status TEXT NOT NULL,
+    PRIMARY KEY (simulation_id, order_id)
+);
+
+-- Streaming order generators (see app/generator.py): the configuration per
+-- simulation, and the orders inserted ahead of their release
+CREATE TABLE order_generators (
+    simulation_id INT PRIMARY KEY REFERENCES simulations(id),
+    config JSONB NOT NULL,
+    updated_at TIMESTAMP
+);
+
+-- Parameter sweeps over headless runs (see app/experiments.py)
+CREATE TABLE experiments (
+    id SERIAL PRIMARY KEY,
+    name TEXT,
+    status TEXT NOT NULL,
+    config JSONB NOT NULL,
+    runs_total INT NOT NULL,
+    runs_done INT NOT NULL DEFAULT 0,
+    results JSONB,
+    created_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- Indexes behind the filtered, keyset-paginated list endpoints. Safe to run
+-- against an existing database.
+CREATE INDEX IF NOT EXISTS ix_operation_logs_simulation_timestamp ON operation_logs (simulation_id, timestamp);
+CREATE INDEX IF NOT EXISTS ix_operation_logs_simulation_forklift ON operation_logs (simulation_id, forklift_id);
+CREATE INDEX IF NOT EXISTS ix_kpis_simulation_timestamp ON kpis (simulation_id, timestamp);
+-- Keyset pagination filters on simulation_id and walks id
+CREATE INDEX IF NOT EXISTS ix_operation_logs_simulation_id ON operation_logs (simulation_id, id);
+CREATE INDEX IF NOT EXISTS ix_kpis_simulation_id ON kpis (simulation_id, id);
+CREATE INDEX IF NOT EXISTS ix_dispatch_plans_simulation_forklift ON dispatch_plans (simulation_id, forklift_id);
+CREATE INDEX IF NOT EXISTS ix_orders_status ON orders (status);
+CREATE INDEX IF NOT EXISTS ix_simulation_snapshots_simulation_step ON simulation_snapshots (simulation_id, step);
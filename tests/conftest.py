@@ -0,0 +1,104 @@
+# Tests run against a scratch SQLite file seeded by the benchmark harness,
+# no PostgreSQL needed:
+#
+#   pip install -r tests/requirements.txt
+#   python -m pytest -q
+
+import asyncio
+import os
+import sys
+import tempfile
+
+import httpx
+import pytest
+from sqlalchemy import event, select
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_PATH = os.path.join(tempfile.gettempdir(), "forklift_tests_%d.db" % os.getpid())
+os.environ["DATABASE_URL"] = "sqlite+aiosqlite:///" + DB_PATH
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench import parse_args, seed  # noqa: E402
+from app.db import AsyncSessionLocal, engine, sim_engine  # noqa: E402
+from app.models import KPI, OperationLog, Simulation, SimulationForklift, SimulationOrder  # noqa: E402
+from app.response_cache import FORKLIFTS, LOCATIONS, MAPS, ORDERS, PLANS, response_cache  # noqa: E402
+from app.routing import router  # noqa: E402
+
+
+def enforce_foreign_keys(dbapi_connection, connection_record):
+    # SQLite leaves foreign keys unchecked unless asked, PostgreSQL doesn't
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+for e in (engine, sim_engine):
+    event.listen(e.sync_engine, "connect", enforce_foreign_keys)
+
+
+def warehouse_args(**overrides):
+    # A small warehouse that a headless run gets through in well under a second
+    argv = ["--map-size", "40", "--locations", "60", "--forklifts", "10", "--orders", "100"]
+    for key, value in overrides.items():
+        argv += ["--" + key.replace("_", "-"), str(value)]
+    return parse_args(argv)
+
+
+async def reseed(args=None):
+    # Rows were replaced behind the app's back, nothing cached still holds
+    await seed(args or warehouse_args())
+    router.invalidate(1)
+    response_cache.invalidate(LOCATIONS, MAPS, FORKLIFTS, ORDERS, PLANS)
+
+
+async def history(simulation_id: int = 1):
+    # Everything a run leaves behind, with times relative to its start
+    async with AsyncSessionLocal() as session:
+        sim = await session.get(Simulation, simulation_id)
+        logs = (await session.execute(
+            select(OperationLog).where(OperationLog.simulation_id == simulation_id).order_by(OperationLog.id)
+        )).scalars().all()
+        kpis = (await session.execute(
+            select(KPI).where(KPI.simulation_id == simulation_id).order_by(KPI.id)
+        )).scalars().all()
+        positions = (await session.execute(
+            select(SimulationForklift.forklift_id, SimulationForklift.x, SimulationForklift.y)
+            .where(SimulationForklift.simulation_id == simulation_id).order_by(SimulationForklift.forklift_id)
+        )).all()
+        statuses = (await session.execute(
+            select(SimulationOrder.order_id, SimulationOrder.status)
+            .where(SimulationOrder.simulation_id == simulation_id).order_by(SimulationOrder.order_id)
+        )).all()
+        return {
+            "logs": [((l.timestamp - sim.start_time).total_seconds(), l.forklift_id, l.event, l.details) for l in logs],
+            "kpis": [((k.timestamp - sim.start_time).total_seconds(), k.execution_time, k.block_time) for k in kpis],
+            "positions": positions,
+            "statuses": statuses,
+            "status": sim.status,
+        }
+
+
+def client():
+    # The app served in-process, without a server
+    from app.main import app
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+@pytest.fixture
+def run():
+    # Runs a coroutine on a fresh event loop; pooled connections belong to
+    # the loop that opened them, so they are dropped before it closes
+    def run(coro):
+        async def main():
+            try:
+                return await coro
+            finally:
+                await engine.dispose()
+                await sim_engine.dispose()
+        return asyncio.run(main())
+    return run
+
+
+def pytest_sessionfinish(session, exitstatus):
+    if os.path.exists(DB_PATH):
+        os.remove(DB_PATH)
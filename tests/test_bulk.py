@@ -0,0 +1,118 @@
+from sqlalchemy import func, select
+
+from app.bulk import MAX_BULK_ROWS
+from app.db import AsyncSessionLocal
+from app.models import Forklift, Order
+from app.persistence import CHUNK_SIZE
+from conftest import client, reseed, warehouse_args
+
+ARGS = warehouse_args(orders=0)
+BAD_LOCATION = 10 ** 6
+
+
+async def count(model) -> int:
+    async with AsyncSessionLocal() as session:
+        return (await session.execute(select(func.count()).select_from(model))).scalar()
+
+
+def order(pickup: int = 1, delivery: int = 2) -> dict:
+    return {"pickup_location_id": pickup, "delivery_location_id": delivery, "status": "pending"}
+
+
+def test_bad_rows_are_reported_and_the_rest_land(run):
+    rows = [
+        order(),
+        {"pickup_location_id": 1, "status": "pending"},
+        "not a row",
+        order(pickup=BAD_LOCATION),
+        order(3, 4),
+    ]
+
+    async def scenario():
+        await reseed(ARGS)
+        async with client() as http:
+            response = await http.post("/orders/bulk", json=rows)
+        return response, await count(Order)
+
+    response, stored = run(scenario())
+    assert response.status_code == 200
+    result = response.json()
+    assert result["created"] == 2 == stored
+    assert len(result["ids"]) == 2
+    # One entry per rejected row, by position in the request, whichever
+    # check rejected it
+    assert [e["row"] for e in result["errors"]] == [1, 2, 3]
+    assert [m.split(":")[0] for m in result["errors"][0]["errors"]] == ["delivery_location_id"]
+    assert result["errors"][1]["errors"] == ["row must be an object"]
+    assert "FOREIGN KEY" in result["errors"][2]["errors"][0]
+
+
+def test_a_rejected_row_only_costs_its_own_chunk_a_retry(run):
+    rows = [order() for _ in range(CHUNK_SIZE + 500)]
+    rows[CHUNK_SIZE + 200] = order(delivery=BAD_LOCATION)
+
+    async def scenario():
+        await reseed(ARGS)
+        async with client() as http:
+            response = await http.post("/orders/bulk", json=rows)
+        return response.json(), await count(Order)
+
+    result, stored = run(scenario())
+    assert result["created"] == len(rows) - 1 == stored
+    assert [e["row"] for e in result["errors"]] == [CHUNK_SIZE + 200]
+
+
+def test_csv_and_ndjson_rows(run):
+    csv_body = "name,status,location_id\nA,available,1\nB,available,\nC,available,x\nD,available,2\n"
+    ndjson_body = '{"name": "E", "status": "available", "location_id": 3}\n\n{"name": "F", "status": "available"}\n'
+
+    async def scenario():
+        await reseed(ARGS)
+        before = await count(Forklift)
+        async with client() as http:
+            csv_result = (await http.post("/forklifts/bulk", content=csv_body,
+                                          headers={"content-type": "text/csv"})).json()
+            ndjson_result = (await http.post("/forklifts/bulk", content=ndjson_body,
+                                             headers={"content-type": "application/x-ndjson"})).json()
+        return csv_result, ndjson_result, await count(Forklift) - before
+
+    csv_result, ndjson_result, added = run(scenario())
+    # An empty CSV cell is a missing value
+    assert csv_result["created"] == 2
+    assert [e["row"] for e in csv_result["errors"]] == [1, 2]
+    assert [m.split(":")[0] for m in csv_result["errors"][0]["errors"]] == ["location_id"]
+    assert ndjson_result["created"] == 1
+    assert [e["row"] for e in ndjson_result["errors"]] == [1]
+    assert added == 3
+
+
+def test_plan_times_are_checked_per_row(run):
+    plan = {"forklift_id": 1, "order_id": None, "end_time": None, "simulation_id": 1}
+    rows = [
+        dict(plan, start_time="2024-01-01T08:00:00"),
+        dict(plan, start_time="not a time"),
+    ]
+
+    async def scenario():
+        await reseed(ARGS)
+        async with client() as http:
+            return (await http.post("/plans/bulk", json=rows)).json()
+
+    result = run(scenario())
+    assert result["created"] == 1
+    assert [e["row"] for e in result["errors"]] == [1]
+    assert [m.split(":")[0] for m in result["errors"][0]["errors"]] == ["start_time"]
+
+
+def test_unreadable_bodies_are_rejected_whole(run):
+    async def scenario():
+        await reseed(ARGS)
+        async with client() as http:
+            return [
+                (await http.post("/orders/bulk", content="[", headers={"content-type": "application/json"})).status_code,
+                (await http.post("/orders/bulk", json={"rows": []})).status_code,
+                (await http.post("/orders/bulk", content="<orders/>", headers={"content-type": "application/xml"})).status_code,
+                (await http.post("/orders/bulk", json=[order()] * (MAX_BULK_ROWS + 1))).status_code,
+            ], await count(Order)
+
+    assert run(scenario()) == ([400, 400, 415, 413], 0)
@@ -0,0 +1,93 @@
+import random
+from collections import deque
+
+import numpy as np
+import pytest
+
+from app.distances import UNREACHABLE, DistanceIndex, DistanceMatrix, _distance_rows, layout_hash
+from app.routing import Grid
+from conftest import client, reseed
+
+
+def bfs_rows(grid: Grid, coords: np.ndarray) -> np.ndarray:
+    # Plain breadth-first search per location: location cells can be
+    # entered even when blocked, but only walkable cells and the start
+    # can be left
+    cells = [tuple(c) for c in coords.tolist()]
+    locations = set(cells)
+    rows = np.full((len(cells), len(cells)), UNREACHABLE, dtype=np.int32)
+    for i, start in enumerate(cells):
+        seen = {start: 0}
+        queue = deque([start])
+        while queue:
+            cell = queue.popleft()
+            if cell != start and not grid.walkable(cell):
+                continue
+            for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+                nxt = (cell[0] + dx, cell[1] + dy)
+                if nxt not in seen and (grid.walkable(nxt) or nxt in locations):
+                    seen[nxt] = seen[cell] + 1
+                    queue.append(nxt)
+        rows[i] = [seen.get(c, UNREACHABLE) for c in cells]
+    return rows
+
+
+def random_grid(rng: random.Random):
+    width, height = rng.randint(3, 25), rng.randint(3, 25)
+    blocked = {(x, y) for x in range(width) for y in range(height) if rng.random() < 0.3}
+    coords = np.array([(rng.randrange(width), rng.randrange(height)) for _ in range(rng.randint(1, 30))],
+                      dtype=np.int64)
+    return Grid(blocked, width, height), coords
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_graph_search_matches_breadth_first_search(seed):
+    grid, coords = random_grid(random.Random(seed))
+    expected = bfs_rows(grid, coords)
+    assert (_distance_rows(grid, coords, list(range(len(coords)))) == expected).all()
+    # Any subset of sources gives the same rows
+    sources = list(range(0, len(coords), 3))
+    assert (_distance_rows(grid, coords, sources) == expected[sources]).all()
+
+
+def test_open_floor_is_manhattan():
+    coords = np.array([(0, 0), (3, 4), (-2, 1)], dtype=np.int64)
+    rows = _distance_rows(None, coords, [0, 1, 2])
+    assert rows.tolist() == [[0, 7, 3], [7, 0, 8], [3, 8, 0]]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_incremental_update_matches_rebuild(seed):
+    rng = random.Random(seed)
+    grid, coords = random_grid(rng)
+    ids = np.arange(1, len(coords) + 1, dtype=np.int64)
+    old = DistanceMatrix(1, layout_hash(grid), ids, coords,
+                         _distance_rows(grid, coords, list(range(len(coords)))))
+    # Drop one location, move one and add two
+    keep = np.arange(1, len(coords))
+    new_ids = np.concatenate((ids[keep], [100, 101]))
+    new_coords = np.concatenate((coords[keep], [(0, 0), (grid.width - 1, grid.height - 1)]))
+    if len(keep):
+        new_coords[0] = (rng.randrange(grid.width), rng.randrange(grid.height))
+    updated, changed = DistanceIndex._update(old, grid, new_ids, new_coords)
+    assert changed
+    assert updated.location_ids.tolist() == new_ids.tolist()
+    assert (updated.distances == bfs_rows(grid, new_coords)).all()
+
+
+def test_distances_endpoint(run):
+    async def scenario():
+        await reseed()
+        async with client() as http:
+            full = (await http.get("/warehouse/maps/1/distances")).json()
+            row = (await http.get("/warehouse/maps/1/distances",
+                                  params={"from_location": full["location_ids"][0]})).json()
+            missing = await http.get("/warehouse/maps/999/distances")
+        return full, row, missing
+
+    full, row, missing = run(scenario())
+    distances = np.array(full["distances"])
+    assert distances.shape == (len(full["location_ids"]),) * 2
+    assert (distances == distances.T).all() and (np.diag(distances) == 0).all()
+    assert row["distances"] == full["distances"][0]
+    assert missing.status_code == 404
@@ -0,0 +1,43 @@
+import pytest
+
+from app.db import AsyncSessionLocal
+from app.models import OrderGenerator
+from app.simulation_engine import SimulationEngine
+from conftest import history, reseed, warehouse_args
+
+
+async def add_generator(config: dict):
+    async with AsyncSessionLocal() as session:
+        session.add(OrderGenerator(simulation_id=1, config=config))
+        await session.commit()
+
+
+SCENARIOS = {
+    "seeded": (warehouse_args(forklifts=25, orders=150), None),
+    "generated": (warehouse_args(orders=20), {"process": "poisson", "seed": 3, "rate_per_hour": 900,
+                                              "horizon_seconds": 600}),
+}
+
+
+@pytest.mark.parametrize("scenario", sorted(SCENARIOS))
+def test_event_mode_logs_what_tick_mode_logs(run, scenario):
+    args, generator = SCENARIOS[scenario]
+
+    async def runs():
+        results = {}
+        for mode in ("tick", "event"):
+            await reseed(args)
+            if generator is not None:
+                await add_generator(generator)
+            await SimulationEngine().run_simulation(1, speed=0, mode=mode)
+            results[mode] = await history()
+        return results["tick"], results["event"]
+
+    tick, event = run(runs())
+    assert tick["status"] == event["status"] == "completed"
+    assert len(tick["logs"]) >= 2 * 20
+    # Same pickups and deliveries at the same simulated times, same end state;
+    # event mode only samples KPIs when something happens
+    for key in ("logs", "positions", "statuses"):
+        assert event[key] == tick[key], key
+    assert len(event["kpis"]) < len(tick["kpis"])
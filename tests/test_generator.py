@@ -0,0 +1,36 @@
+from sqlalchemy import func, select
+
+from app.db import AsyncSessionLocal
+from app.models import DispatchPlan, Order, OrderGenerator, SimulationOrder
+from app.simulation_engine import SimulationEngine
+from conftest import history, reseed, warehouse_args
+
+ARGS = warehouse_args(orders=20)
+CONFIG = {"process": "poisson", "seed": 5, "rate_per_hour": 1200, "horizon_seconds": 900}
+
+
+async def table_sizes():
+    async with AsyncSessionLocal() as session:
+        return [(await session.execute(select(func.count()).select_from(model))).scalar()
+                for model in (Order, DispatchPlan, SimulationOrder)]
+
+
+def test_generated_orders_stay_out_of_the_tables(run):
+    async def scenario():
+        await reseed(ARGS)
+        async with AsyncSessionLocal() as session:
+            session.add(OrderGenerator(simulation_id=1, config=CONFIG))
+            await session.commit()
+        before = await table_sizes()
+        await SimulationEngine().run_simulation(1, speed=0)
+        return before, await table_sizes(), await history()
+
+    before, after, result = run(scenario())
+    assert result["status"] == "completed"
+    deliveries = [log for log in result["logs"] if log[2] == "delivery"]
+    assert len(deliveries) > 20
+    # Only the seeded orders have rows: the master tables are unchanged and
+    # the simulation's own statuses cover the seeded orders alone
+    assert after[:2] == before[:2]
+    assert after[2] == 20
+    assert all(order_id > 0 for order_id, _ in result["statuses"])
@@ -0,0 +1,47 @@
+from sqlalchemy import select, update
+
+from app.db import AsyncSessionLocal
+from app.models import DispatchPlan, Forklift, LocationList, Order
+from conftest import client, reseed, warehouse_args
+
+
+async def add_orders(locations, indices):
+    async with AsyncSessionLocal() as session:
+        for i in indices:
+            session.add(Order(pickup_location_id=locations[i], delivery_location_id=locations[-1 - i],
+                              status="pending"))
+        await session.commit()
+
+
+def test_second_batch_joins_the_back_of_each_queue(run):
+    async def scenario():
+        await reseed(warehouse_args(forklifts=5, orders=0))
+        async with AsyncSessionLocal() as session:
+            await session.execute(update(Forklift).where(Forklift.id == 5).values(status="busy"))
+            await session.commit()
+            locations = (await session.execute(select(LocationList.id).order_by(LocationList.id))).scalars().all()
+        async with client() as http:
+            await add_orders(locations, range(24))
+            first = (await http.post("/plans/optimize", params={"simulation_id": 1})).json()
+            await add_orders(locations, range(24, 34))
+            second = (await http.post("/plans/optimize", params={"simulation_id": 1})).json()
+            missing = await http.post("/plans/optimize", params={"simulation_id": 999})
+        async with AsyncSessionLocal() as session:
+            plans = (await session.execute(
+                select(DispatchPlan).order_by(DispatchPlan.forklift_id, DispatchPlan.start_time)
+            )).scalars().all()
+        return first, second, missing, plans
+
+    first, second, missing, plans = run(scenario())
+    assert (first["created"], second["created"]) == (24, 10)
+    assert first["unassigned"] == second["unassigned"] == []
+    assert missing.status_code == 404
+    queues = {}
+    for plan in plans:
+        queues.setdefault(plan.forklift_id, []).append(plan)
+    # Only available forklifts are planned, and no plan starts before the
+    # one ahead of it in the queue has ended
+    assert sorted(queues) == [1, 2, 3, 4]
+    for queue in queues.values():
+        for ahead, behind in zip(queue, queue[1:]):
+            assert behind.start_time >= ahead.end_time
@@ -0,0 +1,52 @@
+import pytest
+
+from app.pagination import NEXT_CURSOR_HEADER
+from app.simulation_engine import SimulationEngine
+from conftest import client, reseed
+
+ENDPOINTS = ["/orders/", "/plans/all", "/kpis/", "/operation_logs/"]
+
+
+async def walk(http, path: str, limit: int):
+    # Follows the cursor header until a page comes back without one
+    rows, pages, params = [], 0, {"limit": limit}
+    while True:
+        response = await http.get(path, params=params)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page) <= limit
+        rows += page
+        pages += 1
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if cursor is None:
+            return rows, pages
+        assert int(cursor) == page[-1]["id"]
+        params = {"limit": limit, "after_id": cursor}
+
+
+@pytest.mark.parametrize("path", ENDPOINTS)
+def test_keyset_pages_cover_the_unbounded_list(run, path):
+    async def scenario():
+        await reseed()
+        await SimulationEngine().run_simulation(1, speed=0, max_steps=200)
+        async with client() as http:
+            everything = await http.get(path)
+            assert NEXT_CURSOR_HEADER not in everything.headers
+            return everything.json(), await walk(http, path, 37)
+
+    everything, (paged, pages) = run(scenario())
+    # No default limit: the plain request returns every row, in id order
+    assert len(everything) > 37
+    assert [row["id"] for row in everything] == sorted(row["id"] for row in everything)
+    assert paged == everything
+    assert pages == len(everything) // 37 + 1
+
+
+@pytest.mark.parametrize("limit", [0, -1, 10001])
+def test_out_of_range_limit_is_rejected(run, limit):
+    async def scenario():
+        await reseed()
+        async with client() as http:
+            return [(await http.get(path, params={"limit": limit})).status_code for path in ENDPOINTS]
+
+    assert run(scenario()) == [400] * len(ENDPOINTS)
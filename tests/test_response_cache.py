@@ -0,0 +1,77 @@
+from sqlalchemy import update
+
+from app.db import AsyncSessionLocal
+from app.models import Forklift
+from app.response_cache import FORKLIFTS, response_cache
+from app.simulation_engine import SimulationEngine
+from conftest import client, reseed
+
+
+def test_conditional_get_gets_304_until_a_write(run):
+    async def scenario():
+        await reseed()
+        async with client() as http:
+            first = await http.get("/forklifts/")
+            etag = first.headers["etag"]
+            revalidated = await http.get("/forklifts/", headers={"If-None-Match": etag})
+            # Weak form and lists of tags match too
+            weak = await http.get("/forklifts/", headers={"If-None-Match": f'"other", W/{etag}'})
+            other = await http.get("/forklifts/", headers={"If-None-Match": '"other"'})
+            filtered = await http.get("/forklifts/", params={"status": "blocked"})
+            await http.post("/forklifts/1/block")
+            after_write = await http.get("/forklifts/", headers={"If-None-Match": etag})
+        return first, revalidated, weak, other, filtered, after_write
+
+    first, revalidated, weak, other, filtered, after_write = run(scenario())
+    assert first.status_code == 200
+    assert first.headers["cache-control"] == "no-cache"
+    assert revalidated.status_code == weak.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["etag"] == first.headers["etag"]
+    assert other.status_code == 200 and other.content == first.content
+    # Each query string is its own entry
+    assert filtered.json() == [] and filtered.headers["etag"] != first.headers["etag"]
+    # The block went through the API, which invalidated the scope
+    assert after_write.status_code == 200
+    assert after_write.headers["etag"] != first.headers["etag"]
+    assert next(f for f in after_write.json() if f["id"] == 1)["status"] == "blocked"
+
+
+def test_entry_is_served_until_its_scope_is_invalidated(run):
+    async def scenario():
+        await reseed()
+        async with client() as http:
+            etag = (await http.get("/forklifts/")).headers["etag"]
+            # A write behind the API's back is not seen until an invalidation
+            async with AsyncSessionLocal() as session:
+                await session.execute(update(Forklift).where(Forklift.id == 1).values(name="renamed"))
+                await session.commit()
+            cached = await http.get("/forklifts/", headers={"If-None-Match": etag})
+            response_cache.invalidate(FORKLIFTS)
+            rebuilt = await http.get("/forklifts/", headers={"If-None-Match": etag})
+            # Rebuilding unchanged data hands out the same ETag again
+            response_cache.invalidate(FORKLIFTS)
+            unchanged = await http.get("/forklifts/", headers={"If-None-Match": rebuilt.headers["etag"]})
+        return cached, rebuilt, unchanged
+
+    cached, rebuilt, unchanged = run(scenario())
+    assert cached.status_code == 304
+    assert rebuilt.status_code == 200
+    assert next(f for f in rebuilt.json() if f["id"] == 1)["name"] == "renamed"
+    assert unchanged.status_code == 304
+
+
+def test_finished_plans_invalidate_the_plan_list(run):
+    async def scenario():
+        await reseed()
+        async with client() as http:
+            before = await http.get("/plans/all", params={"simulation_id": 1})
+            await SimulationEngine().run_simulation(1, speed=0, max_steps=200)
+            after = await http.get("/plans/all", params={"simulation_id": 1},
+                                   headers={"If-None-Match": before.headers["etag"]})
+        return before, after
+
+    before, after = run(scenario())
+    assert after.status_code == 200
+    assert after.headers["etag"] != before.headers["etag"]
+    assert sum(p["end_time"] is not None for p in after.json()) > sum(p["end_time"] is not None for p in before.json())
@@ -0,0 +1,24 @@
+import pytest
+from app.simulation_engine import SimulationEngine
+from conftest import history, reseed
+
+
+@pytest.mark.parametrize("mode", ["tick", "event"])
+def test_resume_matches_uninterrupted_run(run, mode):
+    async def scenario():
+        await reseed()
+        await SimulationEngine().run_simulation(1, speed=0, mode=mode)
+        full = await history()
+        resumed = {}
+        # 137 falls between two events, where the event engine is idle
+        for stop in (137, 150, 400):
+            await reseed()
+            await SimulationEngine().run_simulation(1, speed=0, mode=mode, max_steps=stop)
+            await SimulationEngine().run_simulation(1, speed=0, resume=True)
+            resumed[stop] = await history()
+        return full, resumed
+
+    full, resumed = run(scenario())
+    assert full["status"] == "completed"
+    for stop, result in resumed.items():
+        assert result == full, stop
@@ -0,0 +1,38 @@
+from sqlalchemy import select
+
+from app.db import AsyncSessionLocal
+from app.models import LocationList, Order
+from app.trajectories import trajectory_index
+from conftest import client, reseed, warehouse_args
+
+
+def test_index_is_reused_until_a_plan_changes(run):
+    async def scenario():
+        await reseed(warehouse_args(orders=0))
+        async with AsyncSessionLocal() as session:
+            locations = (await session.execute(select(LocationList.id).order_by(LocationList.id))).scalars().all()
+            for i in range(40):
+                session.add(Order(pickup_location_id=locations[i % 30], delivery_location_id=locations[-1 - i % 30],
+                                  status="pending"))
+            await session.commit()
+        async with client() as http:
+            await http.post("/plans/optimize", params={"simulation_id": 1})
+            plans = (await http.get("/plans/all", params={"simulation_id": 1})).json()
+            params = {"simulation_id": 1, "from": min(p["start_time"] for p in plans),
+                      "to": max(p["end_time"] for p in plans), "step": 5}
+            first = (await http.get("/plans/positions", params=params)).json()
+            built = trajectory_index.entries[1]
+            again = (await http.get("/plans/positions", params=params)).json()
+            reused = trajectory_index.entries[1] is built
+            await http.delete("/plans/%d" % plans[0]["id"])
+            await http.get("/plans/positions", params=params)
+            rebuilt = trajectory_index.entries[1] is not built
+            missing = await http.get("/plans/positions", params={"at": params["from"]})
+        return first, again, reused, rebuilt, missing
+
+    first, again, reused, rebuilt, missing = run(scenario())
+    assert len(first["forklift_ids"]) == len(first["x"]) > 0
+    assert again == first
+    assert reused and rebuilt
+    # Positions are per simulation, so one has to be named
+    assert missing.status_code == 422